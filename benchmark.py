@@ -0,0 +1,515 @@
+# benchmark.py
+"""
+Замеры производительности основных операций TerraVision на синтетических архивах.
+
+    python benchmark.py generate --scale medium
+    python benchmark.py run --scale tile --output baseline.json
+    python benchmark.py run --scale tile --output new.json
+    python benchmark.py compare baseline.json new.json --threshold 0.1
+
+generate создает архив NDVI/SAVI/SWIR GeoTIFF с такими же именами файлов, как у
+реальных данных (ndvi_region_<запад>_<юг>_<восток>_<север>_<дата>_<дата>.tif).
+run выполняет каждый замер в отдельном процессе: кэши стеков внутри процесса не
+влияют на результат, а пиковая память (максимальный RSS) относится к одному замеру.
+Подготовка данных (например, загрузка стека перед расчетом статистик) в замер
+времени не входит. compare сравнивает медианные времена и пиковую память с базовыми
+и завершается с кодом 1, если найдены регрессии.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DATA_DIR = "benchmark_data"
+
+INDEX_NAMES = ('NDVI', 'SAVI', 'SWIR')
+
+# Регион реальных данных; имена синтетических файлов строятся по той же схеме
+REGION = (39.0, 43.5, 46.0, 47.0)
+
+FIRST_DATE = (2020, 9)
+
+# Масштабы архивов: (строки, столбцы, месяцы)
+SCALES = {
+    'tile': (344, 520, 49),
+    'medium': (2048, 2048, 120),
+    'large': (10000, 10000, 240),
+}
+
+# Параметры синтетического сигнала каждого индекса в единицах uint8:
+# (среднее, сезонная амплитуда, тренд за год, шум)
+SIGNALS = {
+    'NDVI': (60.0, 40.0, 1.5, 12.0),
+    'SAVI': (35.0, 25.0, 1.0, 8.0),
+    'SWIR': (245.0, 6.0, -0.5, 4.0),
+}
+
+# Доля пикселей без данных: постоянная область (вне снимка) и облака каждого месяца
+NODATA_FRACTION = 0.5
+CLOUD_FRACTION = 0.2
+
+GENERATE_BLOCK_ROWS = 512
+
+DEFAULT_REPEAT = 3
+
+# Допустимое относительное ухудшение по времени и памяти
+DEFAULT_THRESHOLD = 0.10
+
+# Меньшие абсолютные изменения считаются шумом измерений
+NOISE_FLOOR = {'median': 0.005, 'peak_rss_mb': 5.0}
+
+RESULTS_VERSION = 1
+
+
+def month_ends(count, first=FIRST_DATE):
+    """Последние дни count месяцев, начиная с месяца first (год, месяц)."""
+    import calendar
+    year, month = first
+    dates = []
+    for _ in range(count):
+        dates.append(datetime(year, month, calendar.monthrange(year, month)[1]))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return dates
+
+
+def file_name(index_name, date, region=REGION):
+    region_name = "_".join(str(value) for value in region)
+    return f"{index_name.lower()}_region_{region_name}_{date:%Y-%m-%d}_{date:%Y-%m-%d}.tif"
+
+
+def archive_dir(scale, root=DATA_DIR):
+    return os.path.join(root, scale)
+
+
+def _synthetic_block(index_name, month, rows, width, height, seed):
+    import numpy as np
+    mean, amplitude, trend, noise = SIGNALS[index_name]
+    rng = np.random.default_rng([seed, month, rows.start])
+    y = np.arange(rows.start, rows.stop, dtype=np.float32)[:, None] / height
+    x = np.arange(width, dtype=np.float32)[None, :] / width
+    # Пространственная структура постоянна во времени, сезонность и тренд общие для всех пикселей
+    spatial = 0.5 * np.sin(6.0 * x + 4.0 * y) + 0.5 * np.cos(9.0 * x * y)
+    season = np.sin(2 * np.pi * (month % 12) / 12.0)
+    values = (mean * (1 + 0.3 * spatial) + amplitude * season + trend * month / 12.0
+              + rng.normal(0.0, noise, (len(y), width)).astype(np.float32))
+    values = np.clip(np.rint(values), 1, 255).astype(np.uint8)
+    outside = (x + 0.3 * y) > 1.0 - NODATA_FRACTION * 0.65
+    clouds = rng.random((len(y), width), dtype=np.float32) < CLOUD_FRACTION
+    values[np.broadcast_to(outside, values.shape) | clouds] = 0
+    return values
+
+
+def generate_archive(output_dir, height, width, months, seed=0, compress=None, progress=None, region=REGION):
+    """
+    Создает синтетический архив: папки ndvi/, savi/ и swir/ с months растрами uint8
+    height x width для региона region (запад, юг, восток, север). Значения содержат
+    пространственную структуру, сезонность, тренд, шум и пропуски (0). Растры пишутся
+    блоками строк, поэтому память не зависит от размера. Уже существующие файлы не перезаписываются.
+    """
+    import rasterio
+    from affine import Affine
+    from rasterio.windows import Window
+    west, south, east, north = region
+    profile = {
+        'driver': 'GTiff', 'dtype': 'uint8', 'nodata': None, 'count': 1, 'height': height, 'width': width,
+        'crs': 'EPSG:4326', 'transform': Affine((east - west) / width, 0.0, west, 0.0, -(north - south) / height, north),
+    }
+    if compress:
+        profile.update(compress=compress, tiled=True, blockxsize=256, blockysize=256)
+    dates = month_ends(months)
+    total = len(INDEX_NAMES) * months
+    done = 0
+    for index_name in INDEX_NAMES:
+        data_dir = os.path.join(output_dir, index_name.lower())
+        os.makedirs(data_dir, exist_ok=True)
+        for month, date in enumerate(dates):
+            path = os.path.join(data_dir, file_name(index_name, date, region))
+            done += 1
+            if os.path.exists(path):
+                continue
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with rasterio.open(tmp_path, 'w', **profile) as dst:
+                for row in range(0, height, GENERATE_BLOCK_ROWS):
+                    rows = range(row, min(row + GENERATE_BLOCK_ROWS, height))
+                    block = _synthetic_block(index_name, month, rows, width, height, seed)
+                    dst.write(block, 1, window=Window(0, row, width, len(rows)))
+            os.replace(tmp_path, path)
+            if progress is not None:
+                progress(done, total, path)
+    return output_dir
+
+
+# Замеры: setup(data_dir, workdir) готовит входные данные (не входит во время),
+# run(state) выполняет измеряемую операцию
+
+
+def _files(data_dir, index_name):
+    from raster_cube import list_rasters
+    return list_rasters(os.path.join(data_dir, index_name.lower()))
+
+
+def _stack(data_dir, index_name):
+    from raster_cube import load_stack_from_files
+    return load_stack_from_files(_files(data_dir, index_name), index_name, use_disk_cache=False)
+
+
+def setup_load(data_dir, workdir):
+    return _files(data_dir, 'NDVI')
+
+
+def run_load(files):
+    from raster_cube import clear_cache, load_stack_from_files
+    # Стек, загруженный предыдущим повтором, не должен браться из кэша процесса
+    clear_cache()
+    load_stack_from_files(files, 'NDVI', use_disk_cache=False)
+
+
+def setup_load_cached(data_dir, workdir):
+    from raster_cube import load_stack_from_files
+    files = _files(data_dir, 'NDVI')
+    load_stack_from_files(files, 'NDVI')
+    return files
+
+
+def run_load_cached(files):
+    from raster_cube import clear_cache, load_stack_from_files
+    clear_cache()
+    load_stack_from_files(files, 'NDVI')
+
+
+def setup_stack(data_dir, workdir):
+    return _stack(data_dir, 'NDVI')
+
+
+def run_stats(stack):
+    from pixel_histogram import PixelHistogram
+    histogram = PixelHistogram.from_stack(stack.data)
+    histogram.mean(), histogram.std(), histogram.median()
+
+
+def setup_correlation(data_dir, workdir):
+    from raster_cube import AlignedIndices
+    aligned = AlignedIndices({name: _files(data_dir, name) for name in ('NDVI', 'SAVI')}, use_disk_cache=False)
+    return aligned['NDVI'], aligned['SAVI']
+
+
+def run_correlation(stacks):
+    from correlation import stack_correlation
+    stack_correlation(*stacks)
+
+
+def run_trend(stack):
+    from index_trend_analysis import calculate_average_index
+    calculate_average_index(stack)
+
+
+def run_trend_maps(stack):
+    from pixel_trend import stack_trends
+    stack_trends(stack)
+
+
+def setup_normalization(data_dir, workdir):
+    return os.path.join(data_dir, 'ndvi'), os.path.join(workdir, 'ndvi_aggregates.npz')
+
+
+def run_normalization(state):
+    from raster_cube import normalize_index
+    from running_aggregates import update_aggregates
+    data_dir, state_path = state
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    aggregates = update_aggregates(data_dir, state_path)
+    normalize_index(aggregates.mean())
+
+
+def setup_classify_lut(data_dir, workdir):
+    return _files(data_dir, 'NDVI')
+
+
+def run_classify_lut(files):
+    from ndvi_classes import classify_files
+    classify_files(files).modal_class()
+
+
+def setup_classify_mlp(data_dir, workdir):
+    from land_cover_map import load_model
+    paths = [_files(data_dir, name)[0] for name in INDEX_NAMES]
+    return load_model(), paths, os.path.join(workdir, 'land_classes.tif')
+
+
+def run_classify_mlp(state):
+    from land_cover_map import classify_month
+    model, paths, output_path = state
+    classify_month(model, *paths, output_path)
+
+
+def setup_forecast(data_dir, workdir):
+    from index_forecasting_sarima import index_series
+    return index_series(_stack(data_dir, 'NDVI'))['Value']
+
+
+def run_forecast(series):
+    from index_forecasting_sarima import forecast_sarima
+    forecast_sarima(series)
+
+
+# Размер блока карт прогноза: ряд на каждый блок 8x8 пикселей
+FORECAST_BLOCK = 8
+
+
+def run_forecast_maps(stack):
+    from pixel_forecast import stack_forecast
+    stack_forecast(stack, block=FORECAST_BLOCK, mode='filter')
+
+
+# Число одновременных запросов к сервису рекомендаций (по одной точке)
+RECOMMEND_REQUESTS = 10000
+
+
+def setup_recommend(data_dir, workdir):
+    import numpy as np
+    import rasterio
+    rasters = []
+    for name in INDEX_NAMES:
+        with rasterio.open(_files(data_dir, name)[0]) as src:
+            rasters.append(src.read(1).ravel())
+    features = np.stack(rasters, axis=1)
+    features = features[(features != 0).all(axis=1)]
+    rng = np.random.default_rng(0)
+    return features[rng.integers(0, len(features), RECOMMEND_REQUESTS)].astype(np.float64)
+
+
+def run_recommend(points):
+    import asyncio
+    from recommendation_service import RecommendationService
+
+    async def requests():
+        service = RecommendationService()
+        await asyncio.gather(*(service.recommend(point[None, :]) for point in points))
+
+    asyncio.run(requests())
+
+
+BENCHMARKS = {
+    'load': (setup_load, run_load),
+    'load_cached': (setup_load_cached, run_load_cached),
+    'stats': (setup_stack, run_stats),
+    'correlation': (setup_correlation, run_correlation),
+    'trend': (setup_stack, run_trend),
+    'trend_maps': (setup_stack, run_trend_maps),
+    'normalization': (setup_normalization, run_normalization),
+    'classify_lut': (setup_classify_lut, run_classify_lut),
+    'classify_mlp': (setup_classify_mlp, run_classify_mlp),
+    'forecast': (setup_forecast, run_forecast),
+    'forecast_maps': (setup_stack, run_forecast_maps),
+    'recommend': (setup_recommend, run_recommend),
+}
+
+
+def peak_rss_mb():
+    """Максимальный RSS процесса в МБ (None, если недоступен)."""
+    from profiling import peak_rss
+    peak = peak_rss()
+    return None if peak is None else peak / (1024 * 1024)
+
+
+def _run_case(name, data_dir, repeat, connection):
+    try:
+        os.chdir(BASE_DIR)
+        sys.path.insert(0, BASE_DIR)
+        setup, run = BENCHMARKS[name]
+        with tempfile.TemporaryDirectory(prefix='terravision_bench_') as workdir:
+            state = setup(data_dir, workdir)
+            setup_rss = peak_rss_mb()
+            times = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                run(state)
+                times.append(time.perf_counter() - started)
+        connection.send({'times': times, 'setup_rss_mb': setup_rss, 'peak_rss_mb': peak_rss_mb()})
+    except Exception as e:
+        connection.send({'error': f"{type(e).__name__}: {e}"})
+    finally:
+        connection.close()
+
+
+def run_case(name, data_dir, repeat=DEFAULT_REPEAT):
+    """Выполняет замер name в отдельном процессе и возвращает словарь результатов."""
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case, args=(name, os.path.abspath(data_dir), repeat, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'error': "процесс замера завершился без результата"}
+    process.join()
+    if process.exitcode not in (0, None) and 'error' not in result:
+        result['error'] = f"код завершения {process.exitcode}"
+    if 'times' in result:
+        result['best'] = min(result['times'])
+        result['median'] = statistics.median(result['times'])
+    return result
+
+
+def archive_shape(data_dir):
+    import rasterio
+    files = _files(data_dir, 'NDVI')
+    if not files:
+        raise ValueError(f"В папке {data_dir} нет растров NDVI.")
+    with rasterio.open(files[0]) as src:
+        return src.height, src.width, len(files)
+
+
+def run_benchmarks(data_dir, names=None, repeat=DEFAULT_REPEAT, scale=None, progress=None):
+    """Выполняет замеры names (по умолчанию все) на архиве data_dir и возвращает результаты для JSON."""
+    import numpy as np
+    height, width, months = archive_shape(data_dir)
+    results = {
+        'version': RESULTS_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'scale': scale,
+        'shape': [height, width],
+        'months': months,
+        'repeat': repeat,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'machine': platform.node(),
+            'cpu_count': os.cpu_count(),
+        },
+        'benchmarks': {},
+    }
+    for name in names or BENCHMARKS:
+        result = run_case(name, data_dir, repeat)
+        results['benchmarks'][name] = result
+        if progress is not None:
+            progress(name, result)
+    return results
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Сравнивает медианные времена и пиковую память замеров. Возвращает список строк
+    (замер, метрика, базовое значение, текущее значение, отношение, регрессия ли).
+    Регрессия - ухудшение больше threshold и больше NOISE_FLOOR метрики.
+    """
+    rows = []
+    for name, base in baseline['benchmarks'].items():
+        new = current['benchmarks'].get(name)
+        if new is None or 'error' in base or 'error' in new:
+            continue
+        for metric in ('median', 'peak_rss_mb'):
+            if not base.get(metric) or new.get(metric) is None:
+                continue
+            ratio = new[metric] / base[metric]
+            regression = ratio > 1 + threshold and new[metric] - base[metric] > NOISE_FLOOR[metric]
+            rows.append((name, metric, base[metric], new[metric], ratio, regression))
+    return rows
+
+
+def _print_result(name, result):
+    if 'error' in result:
+        print(f"  {name:<14} ошибка: {result['error']}")
+        return
+    memory = f"{result['peak_rss_mb']:.0f} МБ" if result['peak_rss_mb'] is not None else "-"
+    print(f"  {name:<14} медиана {result['median']:.3f} с, лучшее {result['best']:.3f} с, пик памяти {memory}")
+
+
+def cmd_generate(args):
+    height, width, months = SCALES[args.scale] if args.scale else (args.height, args.width, args.months)
+    output_dir = args.data_dir or archive_dir(args.scale or f"{height}x{width}x{months}")
+    print(f"Архив {height}x{width}, {months} месяцев: {output_dir}")
+    generate_archive(output_dir, height, width, months, args.seed, args.compress,
+                     lambda done, total, path: print(f"[{done}/{total}] {path}"))
+    return 0
+
+
+def cmd_run(args):
+    data_dir = args.data_dir or archive_dir(args.scale)
+    if not os.path.isdir(os.path.join(data_dir, 'ndvi')):
+        if not args.scale:
+            raise SystemExit(f"В папке {data_dir} нет архива.")
+        print(f"Создание синтетического архива {args.scale} в {data_dir}...")
+        generate_archive(data_dir, *SCALES[args.scale])
+    height, width, months = archive_shape(data_dir)
+    print(f"Замеры на архиве {data_dir}: {height}x{width}, {months} месяцев, повторов {args.repeat}")
+    results = run_benchmarks(data_dir, args.only, args.repeat, args.scale, _print_result)
+    output = args.output or os.path.join(
+        "benchmark_results", f"{datetime.now():%Y%m%d_%H%M%S}_{args.scale or 'custom'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {output}")
+    return 1 if any('error' in result for result in results['benchmarks'].values()) else 0
+
+
+def cmd_compare(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    if (baseline.get('shape'), baseline.get('months')) != (current.get('shape'), current.get('months')):
+        print("Предупреждение: замеры выполнены на архивах разного размера.")
+    rows = compare_results(baseline, current, args.threshold)
+    units = {'median': 'с', 'peak_rss_mb': 'МБ'}
+    for name, metric, base, new, ratio, regression in rows:
+        mark = "РЕГРЕССИЯ" if regression else ""
+        print(f"{name:<14} {metric:<12} {base:10.3f} -> {new:10.3f} {units[metric]:<2} x{ratio:5.2f} {mark}")
+    regressions = [row for row in rows if row[-1]]
+    if regressions:
+        print(f"Регрессий: {len(regressions)} (порог {args.threshold:.0%})")
+        return 1
+    print(f"Регрессий нет (порог {args.threshold:.0%})")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='benchmark', description="Замеры производительности TerraVision.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="создать синтетический архив")
+    generate.add_argument('--scale', choices=SCALES)
+    generate.add_argument('--height', type=int, default=SCALES['tile'][0])
+    generate.add_argument('--width', type=int, default=SCALES['tile'][1])
+    generate.add_argument('--months', type=int, default=SCALES['tile'][2])
+    generate.add_argument('--seed', type=int, default=0)
+    generate.add_argument('--compress', help="сжатие GeoTIFF (например, deflate)")
+    generate.add_argument('--data-dir', help=f"папка архива (по умолчанию {DATA_DIR}/<масштаб>)")
+
+    run = commands.add_parser('run', help="выполнить замеры и сохранить результаты в JSON")
+    run.add_argument('--scale', choices=SCALES, default='tile')
+    run.add_argument('--data-dir', help="архив для замеров (по умолчанию синтетический архив масштаба)")
+    run.add_argument('--only', nargs='+', choices=BENCHMARKS, help="выполнить только эти замеры")
+    run.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    run.add_argument('--output', help="файл результатов JSON")
+
+    compare = commands.add_parser('compare', help="сравнить результаты с базовыми")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                         help="допустимое относительное ухудшение (0.1 = 10%%)")
+    return parser
+
+
+COMMANDS = {'generate': cmd_generate, 'run': cmd_run, 'compare': cmd_compare}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+# climatology.py
+
+import os
+import json
+import threading
+import numpy as np
+import rasterio
+import profiling
+import stack_cache
+from raster_cube import NODATA_VALUE, NDVI_DIR, extract_date, extract_region, list_rasters
+from running_aggregates import WelfordAggregates
+
+STATE_VERSION = 2
+
+# Минимальное число лет с данными календарного месяца для расчета аномалии
+MIN_YEARS = 3
+
+MONTHS = range(1, 13)
+
+
+class MonthlyClimatology:
+    """
+    Попиксельная климатология индекса по календарным месяцам.
+
+    Для каждого из 12 месяцев хранится WelfordAggregates: число лет с данными,
+    среднее и сумма квадратов отклонений по всем снимкам этого месяца. Снимок
+    добавляется за один проход по растру, поэтому новые месяцы архива учитываются
+    без перечитывания старых. Значения в исходных единицах растра, пропуски
+    (NODATA_VALUE) не учитываются.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.calendar = {month: WelfordAggregates(self.shape) for month in MONTHS}
+
+    def __len__(self):
+        return sum(len(aggregates) for aggregates in self.calendar.values())
+
+    @property
+    def months(self):
+        """Учтенные снимки: дата (ISO) -> подпись файла."""
+        result = {}
+        for aggregates in self.calendar.values():
+            result.update(aggregates.months)
+        return result
+
+    def add_month(self, date, raster, signature=None):
+        """Добавляет снимок за дату date в климатологию его календарного месяца."""
+        self.calendar[date.month].add_month(date, raster, signature)
+
+    def count(self, month):
+        """Число лет с данными календарного месяца month (1-12) по пикселям."""
+        return self.calendar[month].count
+
+    def mean(self, month):
+        return self.calendar[month].mean()
+
+    def std(self, month, ddof=1):
+        return self.calendar[month].std(ddof)
+
+    def means(self):
+        """Средние всех месяцев: массив (12, строки, столбцы) float32."""
+        return np.stack([self.mean(month) for month in MONTHS]).astype(np.float32)
+
+    def stds(self, ddof=1):
+        return np.stack([self.std(month, ddof) for month in MONTHS]).astype(np.float32)
+
+    def counts(self):
+        return np.stack([self.count(month) for month in MONTHS])
+
+    def anomaly(self, date, raster, exclude_self=True, min_years=MIN_YEARS, ddof=1, window=None):
+        """
+        Стандартизованная аномалия снимка за дату date: (значение - среднее) / стандартное
+        отклонение климатологии его календарного месяца, float32. Если снимок сам учтен
+        в климатологии и exclude_self, его вклад исключается из среднего и дисперсии.
+        NaN - пропуск, меньше min_years лет с данными или нулевое отклонение.
+        Если задано окно window (rasterio.windows.Window), raster - только это окно снимка.
+        """
+        aggregates = self.calendar[date.month]
+        rows, cols = slice(None), slice(None)
+        if window is not None:
+            rows = slice(window.row_off, window.row_off + window.height)
+            cols = slice(window.col_off, window.col_off + window.width)
+        raster = np.asarray(raster)
+        if raster.shape != aggregates.count[rows, cols].shape:
+            raise ValueError("Размер растра не совпадает с размером климатологии.")
+        valid = raster != NODATA_VALUE
+        x = raster.astype(np.float64)
+        n = aggregates.count[rows, cols].astype(np.float64)
+        mean, m2 = aggregates.mean_values[rows, cols], aggregates.m2[rows, cols]
+        if exclude_self and str(np.datetime64(date, 'D')) in aggregates.months:
+            # Обратный шаг Уэлфорда: климатология без этого снимка
+            with np.errstate(invalid='ignore', divide='ignore'):
+                loo_mean = np.where(n > 1, (n * mean - x) / (n - 1), 0.0)
+            m2 = np.where(valid, np.maximum(m2 - (x - loo_mean) * (x - mean), 0.0), m2)
+            mean = np.where(valid, loo_mean, mean)
+            n = np.where(valid, n - 1, n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(m2 / (n - ddof))
+            result = (x - mean) / std
+        result[~valid | (n < max(min_years, ddof + 1)) | ~(std > 0)] = np.nan
+        return result.astype(np.float32)
+
+    def save(self, path):
+        """Сохраняет состояние в .npz (запись через временный файл)."""
+        fields = {}
+        for name, attribute in (('count', 'count'), ('mean', 'mean_values'), ('m2', 'm2')):
+            fields[name] = np.stack([getattr(self.calendar[month], attribute) for month in MONTHS])
+        months = {month: self.calendar[month].months for month in MONTHS}
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=STATE_VERSION, months=json.dumps(months), **fields)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as state:
+            if int(state['version']) != STATE_VERSION:
+                raise ValueError("Неподдерживаемая версия состояния.")
+            climatology = cls(state['count'].shape[1:])
+            months = json.loads(state['months'].item())
+            for k, month in enumerate(MONTHS):
+                aggregates = climatology.calendar[month]
+                aggregates.count = state['count'][k]
+                aggregates.mean_values = state['mean'][k]
+                aggregates.m2 = state['m2'][k]
+                aggregates.months = months[str(month)]
+        return climatology
+
+
+def state_path_for(paths):
+    """Файл состояния климатологии набора файлов индекса в папке кэша (с учетом региона в имени)."""
+    data_dir = os.path.basename(os.path.dirname(os.path.abspath(paths[0])))
+    region = extract_region(paths[0])
+    name = data_dir.lower() if region is None else f"{data_dir.lower()}_{region}"
+    return os.path.join(stack_cache.cache_dir_for(paths), f"{name}_climatology.npz")
+
+
+def _read(path, window=None):
+    with rasterio.open(path) as src:
+        raster = src.read(1, window=window)
+    profiling.count_read(raster.nbytes)
+    return raster
+
+
+@profiling.profiled('climatology', 'reduce')
+def update_climatology(paths, state_path=None, progress=None):
+    """
+    Обновляет сохраненную климатологию по растрам paths (файлы одного индекса и региона).
+
+    Новые снимки добавляются по одному растру, остальные файлы не читаются. Если файл
+    учтенного снимка изменился или удален, заново строится только климатология его
+    календарного месяца. progress(done, total, path) вызывается после каждого прочитанного файла.
+    """
+    files = {}
+    for path in paths:
+        date = extract_date(path)
+        if date is not None:
+            files[str(np.datetime64(date, 'D'))] = (date, stack_cache.file_signature(path))
+    if not files:
+        raise ValueError("Нет растров с датой в имени.")
+    state_path = state_path or state_path_for(paths)
+
+    climatology = None
+    if os.path.exists(state_path):
+        try:
+            climatology = MonthlyClimatology.load(state_path)
+        except (OSError, ValueError, KeyError):
+            climatology = None
+    if climatology is not None:
+        for month in MONTHS:
+            known = climatology.calendar[month].months
+            if any(files.get(key, (None, None))[1] != signature for key, signature in known.items()):
+                climatology.calendar[month] = WelfordAggregates(climatology.shape)
+
+    known = climatology.months if climatology is not None else {}
+    new_months = sorted(key for key in files if key not in known)
+    for done, key in enumerate(new_months, start=1):
+        date, signature = files[key]
+        raster = _read(signature[0])
+        if climatology is None:
+            climatology = MonthlyClimatology(raster.shape)
+        climatology.add_month(date, raster, signature)
+        if progress is not None:
+            progress(done, len(new_months), signature[0])
+
+    if new_months or not os.path.exists(state_path):
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        climatology.save(state_path)
+    return climatology
+
+
+def anomaly_for_file(climatology, path, exclude_self=True, min_years=MIN_YEARS, window=None):
+    """
+    Стандартизованная аномалия растра path (или его окна window, см. raster_cube.resolve_window).
+    Для окна читаются только его блоки растра.
+    """
+    date = extract_date(path)
+    if date is None:
+        raise ValueError(f"В имени файла {path} нет даты.")
+    return climatology.anomaly(date, _read(path, window), exclude_self, min_years, window=window)
+
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    files = list_rasters(NDVI_DIR)
+    ndvi_climatology = update_climatology(
+        files, progress=lambda done, total, path: print(f"[{done}/{total}] {os.path.basename(path)}"))
+    last = files[-1]
+    anomaly = anomaly_for_file(ndvi_climatology, last)
+    plt.figure(figsize=(10, 6))
+    plt.imshow(anomaly, cmap='RdBu', vmin=-3, vmax=3)
+    plt.colorbar(label="Стандартизованная аномалия")
+    plt.title(f"Аномалия NDVI за {extract_date(last):%Y-%m} относительно климатологии месяца")
+    plt.xticks([])
+    plt.yticks([])
+    plt.tight_layout()
+    plt.show()
@@ -0,0 +1,68 @@
+# correlation.py
+
+import numpy as np
+from profiling import profiled
+from raster_cube import NODATA_VALUE
+
+# Количество строк растра, обрабатываемых за один проход
+DEFAULT_BLOCK_ROWS = 64
+
+
+def _block_mask(block):
+    """Маска пропусков блока: NaN для вещественных данных, NODATA_VALUE для целочисленных."""
+    if np.issubdtype(block.dtype, np.floating):
+        return np.isnan(block)
+    return block == NODATA_VALUE
+
+
+@profiled('correlation', 'reduce')
+def masked_correlation(stack1, stack2, mask1=None, mask2=None, block_rows=DEFAULT_BLOCK_ROWS,
+                       progress=None):
+    """
+    Вычисляет попиксельный коэффициент корреляции Пирсона между двумя стеками
+    (время, строки, столбцы).
+
+    Средние, ковариация и дисперсии считаются по одному и тому же набору дат,
+    где валидны оба индекса. Стеки обрабатываются блоками по block_rows строк
+    в float32, поэтому дополнительная память не зависит от размера растра.
+    Маски (True - нет данных) по умолчанию определяются по NaN или NODATA_VALUE.
+    progress(done_rows, total_rows) вызывается после каждого блока.
+    """
+    if stack1.shape != stack2.shape:
+        raise ValueError("Размеры стеков не совпадают.")
+    _, rows, cols = stack1.shape
+    correlation_map = np.full((rows, cols), np.nan, dtype=np.float32)
+
+    for r0 in range(0, rows, block_rows):
+        r1 = min(r0 + block_rows, rows)
+        a = np.asarray(stack1[:, r0:r1], dtype=np.float32)
+        b = np.asarray(stack2[:, r0:r1], dtype=np.float32)
+        invalid1 = _block_mask(stack1[:, r0:r1]) if mask1 is None else mask1[:, r0:r1]
+        invalid2 = _block_mask(stack2[:, r0:r1]) if mask2 is None else mask2[:, r0:r1]
+        invalid = invalid1 | invalid2
+
+        # Обнуляем пропуски, чтобы они не влияли на суммы
+        a = np.where(invalid, np.float32(0), a)
+        b = np.where(invalid, np.float32(0), b)
+        count = (~invalid).sum(axis=0, dtype=np.float32)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            a -= a.sum(axis=0) / count
+            b -= b.sum(axis=0) / count
+            a[invalid] = 0
+            b[invalid] = 0
+            cov = np.einsum('tij,tij->ij', a, b)
+            var1 = np.einsum('tij,tij->ij', a, a)
+            var2 = np.einsum('tij,tij->ij', b, b)
+            block = cov / np.sqrt(var1 * var2)
+        block[(count <= 1) | (var1 <= 0) | (var2 <= 0)] = np.nan
+        correlation_map[r0:r1] = np.clip(block, -1, 1)
+
+        if progress is not None:
+            progress(r1, rows)
+    return correlation_map
+
+
+def stack_correlation(stack1, stack2, block_rows=DEFAULT_BLOCK_ROWS, progress=None):
+    """Корреляция между двумя IndexStack одинакового размера с учетом их масок пропусков."""
+    return masked_correlation(stack1.data, stack2.data, block_rows=block_rows, progress=progress)
@@ -1,35 +1,13 @@
 import rasterio
 import numpy as np
 import matplotlib.pyplot as plt
-import os
+from raster_cube import load_stack
 
 # Определите пути к папкам с данными
 NDVI_DIR = r"ndvi"
 SAVI_DIR = r"savi"
 SWIR_DIR = r"swir"
 
-def load_and_reproject_raster(file_path, target_crs, target_resolution=None):
-    """
-    Загружает растровый файл, выполняет репроекцию и, при необходимости, ресемплинг.
-    """
-    with rasterio.open(file_path) as src:
-        data = src.read(1)
-        profile = src.profile
-        return data, profile
-
-def load_all_rasters(data_dir):
-    """
-    Загружает все растровые файлы из указанной директории.
-    """
-    data_dict = {}
-    for root, _, files in os.walk(data_dir):
-        for file in files:
-            if file.endswith('.tif'):
-                file_path = os.path.join(root, file)
-                data, profile = load_and_reproject_raster(file_path, "EPSG:4326")
-                data_dict[file] = {'data': data, 'profile': profile}
-    return data_dict
-
 def plot_raster(data, title=""):
     """Построение растра для визуальной проверки."""
     plt.figure(figsize=(8, 8))
@@ -39,16 +17,16 @@ def plot_raster(data, title=""):
     plt.show()
 
 # Загружаем данные из NDVI, SAVI и SWIR
-ndvi_data = load_all_rasters(NDVI_DIR)
-savi_data = load_all_rasters(SAVI_DIR)
-swir_data = load_all_rasters(SWIR_DIR)
+ndvi_data = load_stack(NDVI_DIR, "NDVI")
+savi_data = load_stack(SAVI_DIR, "SAVI")
+swir_data = load_stack(SWIR_DIR, "SWIR")
 
 # Выводим количество файлов для проверки
 print(f"Загружено {len(ndvi_data)} файлов NDVI, {len(savi_data)} файлов SAVI, {len(swir_data)} файлов SWIR.")
 
 # Пример отображения одного из файлов NDVI
-sample_file = list(ndvi_data.keys())[0]
-data = ndvi_data[sample_file]['data']
+sample_file = ndvi_data.file_names[0]
+data = ndvi_data.data[0]
 
 # Проверка уникальных значений
 unique_values = np.unique(data)
@@ -59,7 +37,7 @@ print("Минимум:", np.min(data))
 print("Максимум:", np.max(data))
 
 # Проверка наличия маски данных
-with rasterio.open(os.path.join(NDVI_DIR, sample_file)) as src:
+with rasterio.open(ndvi_data.files[0]) as src:
     if src.count > 1:
         print("Маска присутствует")
         mask = src.read_masks(1)
@@ -0,0 +1,101 @@
+# gui_pyramid.py
+
+import profiling
+
+# Запас вокруг видимой области при загрузке фрагмента (доля размера области с каждой стороны),
+# чтобы небольшие сдвиги не требовали новой загрузки
+FETCH_MARGIN = 0.5
+
+# Изменение масштаба на один шаг колеса мыши
+ZOOM_STEP = 1.25
+
+
+class PyramidView:
+    """
+    Показывает OverviewPyramid на осях matplotlib.
+
+    Отрисовывается только фрагмент уровня, соответствующего размеру видимой области
+    в экранных пикселях. При масштабировании и сдвиге (панель инструментов или
+    колесо мыши) загружается фрагмент нужного уровня для новой области; если она
+    уже покрыта загруженным фрагментом того же уровня, данные не читаются.
+    Координаты осей - пиксели полного разрешения.
+    """
+
+    def __init__(self, ax, pyramid, **imshow_options):
+        self.ax = ax
+        self.pyramid = pyramid
+        self.loaded = None
+        height, width = pyramid.shape
+        level, data, extent = self._fetch(0, width, 0, height)
+        self.image = ax.imshow(data, extent=self._imshow_extent(extent), origin='upper',
+                               interpolation='nearest', **imshow_options)
+        self.loaded = (level, extent)
+        ax.set_xlim(0, width)
+        ax.set_ylim(height, 0)
+        ax.set_autoscale_on(False)
+        self._callbacks = [ax.callbacks.connect('xlim_changed', self._on_limits_changed),
+                           ax.callbacks.connect('ylim_changed', self._on_limits_changed)]
+        canvas = ax.figure.canvas
+        self._canvas_callbacks = [canvas.mpl_connect('resize_event', self._on_limits_changed),
+                                  canvas.mpl_connect('scroll_event', self._on_scroll)]
+
+    @staticmethod
+    def _imshow_extent(extent):
+        x0, x1, y0, y1 = extent
+        return x0, x1, y1, y0
+
+    def _screen_size(self):
+        bbox = self.ax.get_window_extent()
+        return max(bbox.width, 1), max(bbox.height, 1)
+
+    def _fetch(self, x0, x1, y0, y1):
+        screen_width, screen_height = self._screen_size()
+        with profiling.stage('tile', 'render'):
+            return self.pyramid.fetch(x0, x1, y0, y1, screen_width, screen_height)
+
+    def visible_area(self):
+        x0, x1 = sorted(self.ax.get_xlim())
+        y0, y1 = sorted(self.ax.get_ylim())
+        return x0, x1, y0, y1
+
+    def refresh(self):
+        """Загружает фрагмент для текущей видимой области, если загруженного недостаточно."""
+        x0, x1, y0, y1 = self.visible_area()
+        screen_width, screen_height = self._screen_size()
+        scale = max((x1 - x0) / screen_width, (y1 - y0) / screen_height)
+        level = self.pyramid.level_for(scale)
+        if self.loaded is not None:
+            loaded_level, (lx0, lx1, ly0, ly1) = self.loaded
+            height, width = self.pyramid.shape
+            covered = (lx0 <= max(x0, 0) and lx1 >= min(x1, width) and
+                       ly0 <= max(y0, 0) and ly1 >= min(y1, height))
+            if loaded_level == level and covered:
+                return False
+        margin_x, margin_y = (x1 - x0) * FETCH_MARGIN, (y1 - y0) * FETCH_MARGIN
+        level, data, extent = self._fetch(x0 - margin_x, x1 + margin_x, y0 - margin_y, y1 + margin_y)
+        self.image.set_data(data)
+        self.image.set_extent(self._imshow_extent(extent))
+        self.loaded = (level, extent)
+        return True
+
+    def _on_limits_changed(self, *args):
+        if self.refresh():
+            self.ax.figure.canvas.draw_idle()
+
+    def _on_scroll(self, event):
+        if event.inaxes is not self.ax or event.xdata is None:
+            return
+        factor = 1 / ZOOM_STEP if event.button == 'up' else ZOOM_STEP
+        x0, x1 = self.ax.get_xlim()
+        y0, y1 = self.ax.get_ylim()
+        # Точка под курсором остается на месте
+        self.ax.set_xlim(event.xdata + (x0 - event.xdata) * factor, event.xdata + (x1 - event.xdata) * factor)
+        self.ax.set_ylim(event.ydata + (y0 - event.ydata) * factor, event.ydata + (y1 - event.ydata) * factor)
+        self.ax.figure.canvas.draw_idle()
+
+    def disconnect(self):
+        for cid in self._callbacks:
+            self.ax.callbacks.disconnect(cid)
+        for cid in self._canvas_callbacks:
+            self.ax.figure.canvas.mpl_disconnect(cid)
+        self.pyramid.close()
@@ -0,0 +1,94 @@
+# gui_workers.py
+
+import threading
+import time
+import traceback
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+
+class TaskCancelled(Exception):
+    """Задача остановлена пользователем."""
+
+
+class WorkerSignals(QObject):
+    """Сигналы фоновой задачи; доставляются в главный поток Qt."""
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """
+    Выполняет fn(report_progress) в пуле потоков QThreadPool.
+
+    report_progress(done, total) отправляет прогресс в интерфейс и выбрасывает
+    TaskCancelled, если пользователь отменил задачу, поэтому долгие вычисления
+    прерываются в ближайшей точке отчета о прогрессе. Результат fn передается
+    сигналом finished, ошибка - сигналом failed.
+    """
+
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+        self.signals = WorkerSignals()
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def report_progress(self, done, total):
+        if self.is_cancelled:
+            raise TaskCancelled()
+        self.signals.progress.emit(int(done), int(total))
+
+    def run(self):
+        try:
+            result = self.fn(self.report_progress)
+        except TaskCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            traceback.print_exc()
+            self.signals.failed.emit(str(e))
+        else:
+            if self.is_cancelled:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.finished.emit(result)
+
+
+class WarmupSignals(QObject):
+    """Сигналы прогрева: готовность этапа (имя, результат, секунды), ошибка этапа и завершение."""
+    ready = pyqtSignal(str, object, float)
+    failed = pyqtSignal(str, str)
+    finished = pyqtSignal()
+
+
+class Warmup(QRunnable):
+    """
+    Последовательно выполняет этапы прогрева [(имя, функция), ...] в фоновом потоке:
+    импорт тяжелых модулей и загрузку модели. О готовности каждого этапа сообщает
+    сигнал ready, поэтому интерфейс может включать кнопки по мере готовности.
+    Ошибка одного этапа не останавливает остальные.
+    """
+
+    def __init__(self, stages):
+        super().__init__()
+        self.stages = list(stages)
+        self.signals = WarmupSignals()
+
+    def run(self):
+        for name, fn in self.stages:
+            started = time.perf_counter()
+            try:
+                result = fn()
+            except Exception as e:
+                traceback.print_exc()
+                self.signals.failed.emit(name, str(e))
+                continue
+            self.signals.ready.emit(name, result, time.perf_counter() - started)
+        self.signals.finished.emit()
@@ -1,39 +1,98 @@
-import os
+import sys
+import warnings
+from contextlib import ExitStack
 import numpy as np
 import pandas as pd
 import rasterio
+from raster_cube import load_stack, list_rasters
+from pixel_histogram import HISTOGRAM_DTYPES, PixelHistogram
 
 # Определение путей к папкам с индексами
 NDVI_DIR = "ndvi"
 SAVI_DIR = "savi"
 SWIR_DIR = "swir"
 
+STATISTICS = ('mean', 'std', 'median')
+
 def calculate_statistics(data_stack):
     """Вычисляет среднее, стандартное отклонение и медиану для каждого индекса."""
-    mean_val = np.nanmean(data_stack, axis=2)
-    std_val = np.nanstd(data_stack, axis=2)
-    median_val = np.nanmedian(data_stack, axis=2)
+    mean_val = np.nanmean(data_stack, axis=0)
+    std_val = np.nanstd(data_stack, axis=0)
+    median_val = np.nanmedian(data_stack, axis=0)
     return mean_val, std_val, median_val
 
 def load_data_stack(directory):
-    """Загружает данные из всех файлов в директории и создает стек."""
-    data_list = []
-    for file_name in sorted(os.listdir(directory)):
-        file_path = os.path.join(directory, file_name)
-        with rasterio.open(file_path) as src:
-            data = src.read(1).astype(float)
-            data[data == 0] = np.nan  # Убираем нулевые значения
-            data_list.append(data)
-    return np.dstack(data_list)
-
-# Загрузка данных и расчет статистики
-ndvi_stack = load_data_stack(NDVI_DIR)
-savi_stack = load_data_stack(SAVI_DIR)
-swir_stack = load_data_stack(SWIR_DIR)
-
-ndvi_mean, ndvi_std, ndvi_median = calculate_statistics(ndvi_stack)
-savi_mean, savi_std, savi_median = calculate_statistics(savi_stack)
-swir_mean, swir_std, swir_median = calculate_statistics(swir_stack)
+    """Загружает данные из всех файлов в директории и создает стек (время, строки, столбцы)."""
+    return load_stack(directory).to_float()  # Нулевые значения заменяются на NaN
+
+def calculate_statistics_histogram(directory):
+    """
+    Вычисляет попиксельные среднее, стандартное отклонение и медиану по гистограмме
+    целочисленных кодов индекса (см. PixelHistogram) без перевода стека в float64.
+    Стеки других типов считаются через calculate_statistics.
+    """
+    stack = load_stack(directory)
+    if stack.data.dtype not in HISTOGRAM_DTYPES:
+        return calculate_statistics(stack.to_float())
+    histogram = PixelHistogram.from_stack(stack.data)
+    return histogram.mean(), histogram.std(), histogram.median()
+
+def calculate_statistics_streaming(directory, output_prefix):
+    """
+    Вычисляет попиксельные среднее, стандартное отклонение и медиану по блокам растра.
+
+    Для каждого блока (rasterio block window) читаются только соответствующие окна всех
+    месяцев, результат сразу записывается в растры <output_prefix>_mean.tif, _std.tif
+    и _median.tif. Пиковая память близка к размеру стека одного блока.
+    Возвращает средние по растру значения каждой статистики.
+    """
+    paths = list_rasters(directory)
+    totals = np.zeros(len(STATISTICS))
+    counts = np.zeros(len(STATISTICS))
+    with ExitStack() as stack:
+        sources = [stack.enter_context(rasterio.open(path)) for path in paths]
+        first = sources[0]
+        for src in sources[1:]:
+            if (src.height, src.width) != (first.height, first.width):
+                raise ValueError(f"Размер растра {src.name} не совпадает с остальными файлами.")
+
+        profile = first.profile.copy()
+        profile.update(dtype='float32', count=1, nodata=np.nan)
+        outputs = [
+            stack.enter_context(rasterio.open(f"{output_prefix}_{name}.tif", 'w', **profile))
+            for name in STATISTICS
+        ]
+
+        for _, window in first.block_windows(1):
+            block = np.empty((len(sources), window.height, window.width), dtype=np.float32)
+            for i, src in enumerate(sources):
+                block[i] = src.read(1, window=window)
+            block[block == 0] = np.nan  # Убираем нулевые значения
+
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)  # Пиксели без данных дают NaN
+                results = calculate_statistics(block)
+
+            for k, (result, output) in enumerate(zip(results, outputs)):
+                output.write(result.astype(np.float32), 1, window=window)
+                valid = ~np.isnan(result)
+                totals[k] += result[valid].sum(dtype=np.float64)
+                counts[k] += valid.sum()
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return totals / counts
+
+# Потоковый режим: python index_summary_statistics.py --streaming
+if '--streaming' in sys.argv[1:]:
+    # Попиксельные карты записываются в <индекс>_statistics_*.tif
+    ndvi_mean, ndvi_std, ndvi_median = calculate_statistics_streaming(NDVI_DIR, "ndvi_statistics")
+    savi_mean, savi_std, savi_median = calculate_statistics_streaming(SAVI_DIR, "savi_statistics")
+    swir_mean, swir_std, swir_median = calculate_statistics_streaming(SWIR_DIR, "swir_statistics")
+else:
+    # Загрузка данных и расчет статистики по попиксельным гистограммам
+    ndvi_mean, ndvi_std, ndvi_median = calculate_statistics_histogram(NDVI_DIR)
+    savi_mean, savi_std, savi_median = calculate_statistics_histogram(SAVI_DIR)
+    swir_mean, swir_std, swir_median = calculate_statistics_histogram(SWIR_DIR)
 
 # Создаем таблицу с результатами
 summary_data = {
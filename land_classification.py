@@ -1,33 +1,20 @@
-import os
-import numpy as np
 import rasterio
+from ndvi_classes import classify_ndvi
+from raster_catalog import open_catalog
 import matplotlib.pyplot as plt
 from matplotlib.colors import ListedColormap
 
 # Определите путь к папке NDVI
 NDVI_DIR = "ndvi"
 
-def classify_ndvi(data):
-    """
-    Классифицирует значения NDVI по типам земельных участков.
-    """
-    classification = np.zeros_like(data)
-    classification[(data < 0)] = 1  # Вода
-    classification[(data >= 0) & (data < 0.2)] = 2  # Пустыня/городские зоны
-    classification[(data >= 0.2) & (data < 0.4)] = 3  # Редкая растительность/кустарники
-    classification[(data >= 0.4) & (data < 0.6)] = 4  # Средняя растительность
-    classification[(data >= 0.6)] = 5  # Плотная растительность (леса)
-    return classification
-
 def load_ndvi(file_path):
-    """Загружает растровый файл NDVI и нормализует данные."""
+    """Загружает растровый файл NDVI в исходном типе данных (нулевые значения - пропуски)."""
     with rasterio.open(file_path) as src:
-        data = src.read(1).astype(float)
-        data[data == 0] = np.nan  # Убираем нулевые значения, если это "пустые" значения
-        return data
+        return src.read(1)
 
 # Выберем один файл NDVI для тестирования классификации
-sample_file = os.path.join(NDVI_DIR, os.listdir(NDVI_DIR)[0])  # Используем первый файл в папке NDVI
+with open_catalog(index_dirs={"NDVI": NDVI_DIR}) as catalog:
+    sample_file = catalog.paths("NDVI")[0]  # Используем первый по дате файл NDVI
 ndvi_data = load_ndvi(sample_file)
 
 # Классификация NDVI
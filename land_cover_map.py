@@ -0,0 +1,156 @@
+# land_cover_map.py
+
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.windows import Window
+import profiling
+from mlp_inference import MLPKernel, load_mlp_kernel
+from raster_catalog import open_catalog
+from raster_cube import NDVI_DIR, SAVI_DIR, SWIR_DIR, NODATA_VALUE, extract_date, resolve_window, window_profile
+
+# Признаки в том порядке, в котором на них обучалась модель
+FEATURE_NAMES = ['NDVI', 'SAVI', 'SWIR']
+
+# Код класса для пикселей без данных (классы модели начинаются с 1)
+CLASS_NODATA = 0
+
+# Число пикселей, классифицируемых за один вызов модели
+DEFAULT_BATCH_SIZE = 65536
+
+# Число строк растра в одном тайле
+DEFAULT_TILE_ROWS = 256
+
+# Количество потоков по умолчанию: матричные операции numpy отпускают GIL
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+OUTPUT_DIR = "land_classes"
+
+
+def load_model():
+    return load_mlp_kernel()
+
+
+def predict_batched(model, features, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Классифицирует массив признаков (N, 3) пакетами по batch_size строк моделью
+    MLPKernel или MLPClassifier. Возвращает коды классов uint8.
+    """
+    classes = np.empty(len(features), dtype=np.uint8)
+    for start in range(0, len(features), batch_size):
+        batch = features[start:start + batch_size]
+        if not isinstance(model, MLPKernel):
+            # Модели sklearn нужны имена признаков
+            batch = pd.DataFrame(batch, columns=FEATURE_NAMES)
+        classes[start:start + batch_size] = model.predict(batch)
+    return classes
+
+
+def classify_pixels(model, ndvi, savi, swir, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Классифицирует каждый пиксель трех выровненных растров (строки, столбцы).
+    Пиксели, где хотя бы один индекс равен NODATA_VALUE, получают CLASS_NODATA.
+    """
+    valid = (ndvi != NODATA_VALUE) & (savi != NODATA_VALUE) & (swir != NODATA_VALUE)
+    classes = np.full(ndvi.shape, CLASS_NODATA, dtype=np.uint8)
+    if valid.any():
+        # Признаки собираются только для валидных пикселей, сразу в float32
+        features = np.empty((int(valid.sum()), len(FEATURE_NAMES)), dtype=np.float32)
+        for k, raster in enumerate((ndvi, savi, swir)):
+            features[:, k] = raster[valid]
+        classes[valid] = predict_batched(model, features, batch_size)
+    return classes
+
+
+def _classify_tile(model, paths, window, batch_size):
+    # Каждый тайл открывает файлы заново: наборы данных rasterio нельзя читать из нескольких потоков
+    rasters = []
+    for path in paths:
+        with rasterio.open(path) as src:
+            rasters.append(src.read(1, window=window))
+        profiling.count_read(rasters[-1].nbytes)
+    return window, classify_pixels(model, *rasters, batch_size=batch_size)
+
+
+@profiling.profiled('classify_month', 'predict')
+def classify_month(model, ndvi_path, savi_path, swir_path, output_path, batch_size=DEFAULT_BATCH_SIZE,
+                   tile_rows=DEFAULT_TILE_ROWS, workers=None, window=None, bbox=None):
+    """
+    Строит карту классов земель для одного месяца и записывает ее в GeoTIFF uint8
+    (nodata = CLASS_NODATA). Растр делится на тайлы по tile_rows строк, которые
+    читаются и классифицируются параллельно в workers потоках.
+    С window или bbox (см. raster_cube.resolve_window) классифицируется и
+    записывается только область интереса.
+    """
+    paths = (ndvi_path, savi_path, swir_path)
+    with rasterio.open(ndvi_path) as src:
+        profile = src.profile.copy()
+        height, width = src.height, src.width
+    for path in paths[1:]:
+        with rasterio.open(path) as src:
+            if (src.height, src.width) != (height, width):
+                raise ValueError(f"Размер растра {path} не совпадает с растром {ndvi_path}.")
+
+    region = resolve_window(ndvi_path, window, bbox) or Window(0, 0, width, height)
+    if (region.width, region.height) != (width, height):
+        profile = window_profile(profile, region)
+    profile.update(dtype='uint8', count=1, nodata=CLASS_NODATA, compress='deflate')
+    col_off, row_off, width, height = int(region.col_off), int(region.row_off), int(region.width), int(region.height)
+    windows = [Window(col_off, row_off + row, width, min(tile_rows, height - row)) for row in range(0, height, tile_rows)]
+    workers = workers or DEFAULT_WORKERS
+
+    def target(window):
+        # Окно тайла в координатах выходного растра
+        return Window(0, window.row_off - row_off, window.width, window.height)
+
+    with rasterio.open(output_path, 'w', **profile) as dst:
+        if workers <= 1 or len(windows) <= 1:
+            for window in windows:
+                dst.write(_classify_tile(model, paths, window, batch_size)[1], 1, window=target(window))
+        else:
+            with ThreadPoolExecutor(max_workers=min(workers, len(windows))) as executor:
+                futures = [executor.submit(_classify_tile, model, paths, window, batch_size) for window in windows]
+                # Запись выполняется только в вызывающем потоке
+                for future in as_completed(futures):
+                    window, classes = future.result()
+                    dst.write(classes, 1, window=target(window))
+    return output_path
+
+
+def match_months(ndvi_files, savi_files, swir_files):
+    """Сопоставляет файлы трех индексов по дате съемки. Возвращает список (дата, ndvi, savi, swir)."""
+    by_date = [{extract_date(path): path for path in files if extract_date(path) is not None}
+               for files in (ndvi_files, savi_files, swir_files)]
+    dates = sorted(set(by_date[0]) & set(by_date[1]) & set(by_date[2]))
+    return [(date, by_date[0][date], by_date[1][date], by_date[2][date]) for date in dates]
+
+
+def classify_archive(model, ndvi_dir=NDVI_DIR, savi_dir=SAVI_DIR, swir_dir=SWIR_DIR, output_dir=OUTPUT_DIR,
+                     batch_size=DEFAULT_BATCH_SIZE, tile_rows=DEFAULT_TILE_ROWS, workers=None, progress=None,
+                     window=None, bbox=None):
+    """
+    Классифицирует все месяцы (или их область window/bbox), для которых есть растры всех
+    трех индексов, и записывает карты классов в output_dir/land_classes_<дата>.tif.
+    progress(done, total, path) вызывается после каждого месяца. Возвращает список записанных файлов.
+    """
+    index_dirs = dict(zip(FEATURE_NAMES, (ndvi_dir, savi_dir, swir_dir)))
+    with open_catalog(index_dirs=index_dirs) as catalog:
+        months = match_months(*(catalog.paths(name) for name in FEATURE_NAMES))
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = []
+    for done, (date, ndvi_path, savi_path, swir_path) in enumerate(months, start=1):
+        output_path = os.path.join(output_dir, f"land_classes_{date:%Y-%m-%d}.tif")
+        classify_month(model, ndvi_path, savi_path, swir_path, output_path, batch_size, tile_rows, workers,
+                       window, bbox)
+        outputs.append(output_path)
+        if progress is not None:
+            progress(done, len(months), output_path)
+    return outputs
+
+
+if __name__ == "__main__":
+    mlp_model = load_model()
+    written = classify_archive(mlp_model, progress=lambda done, total, path: print(f"[{done}/{total}] {path}"))
+    print(f"Карты классов сохранены в папку: {OUTPUT_DIR} ({len(written)} файлов)")
@@ -50,3 +50,7 @@ print(classification_report(y_test, y_pred))
 import joblib
 joblib.dump(mlp, 'mlp_model2.pkl')
 print("Модель сохранена как 'mlp_model2.pkl'")
+
+# Веса для быстрого прямого прохода на numpy (mlp_inference.py)
+from mlp_inference import export_weights
+print(f"Веса модели сохранены в файл: {export_weights()}")
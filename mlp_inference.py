@@ -0,0 +1,150 @@
+# mlp_inference.py
+
+import os
+import hashlib
+import warnings
+import numpy as np
+
+# Сохраненная модель sklearn и извлеченные из нее веса
+MODEL_PATH = 'mlp_model2.pkl'
+WEIGHTS_PATH = 'mlp_weights.npz'
+
+_HIDDEN_ACTIVATIONS = {
+    'identity': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'tanh': lambda x: np.tanh(x, out=x),
+    'logistic': lambda x: np.reciprocal(np.exp(np.negative(x, out=x), out=x) + 1, out=x),
+}
+
+
+def _flush_subnormal(array):
+    """
+    Переводит массив в float32 и обнуляет субнормальные значения. Веса, близкие к нулю
+    после регуляризации, при переводе в float32 становятся субнормальными, а умножение
+    на них в BLAS выполняется на порядок медленнее; на результат они не влияют.
+    """
+    array = np.array(array, dtype=np.float32, order='C')
+    array[np.abs(array) < np.finfo(np.float32).tiny] = 0
+    return array
+
+
+def model_hash(model_path=MODEL_PATH):
+    """Хэш файла модели: по нему load_mlp_kernel определяет, что веса устарели."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def export_weights(model_path=MODEL_PATH, weights_path=WEIGHTS_PATH):
+    """
+    Извлекает из обученного MLPClassifier веса (coefs_, intercepts_), классы и
+    функции активации и сохраняет их в компактный файл .npz вместе с хэшем файла модели.
+    """
+    import joblib
+    model = joblib.load(model_path)
+    if model.activation not in _HIDDEN_ACTIVATIONS:
+        raise ValueError(f"Неподдерживаемая функция активации: {model.activation}")
+    arrays = {
+        'classes': np.asarray(model.classes_),
+        'activation': np.array(model.activation),
+        'out_activation': np.array(model.out_activation_),
+        'feature_names': np.asarray(getattr(model, 'feature_names_in_', []), dtype=str),
+        'model_hash': np.array(model_hash(model_path)),
+    }
+    for i, (coef, intercept) in enumerate(zip(model.coefs_, model.intercepts_)):
+        arrays[f'coef_{i}'] = _flush_subnormal(coef)
+        arrays[f'intercept_{i}'] = _flush_subnormal(intercept)
+    np.savez(weights_path, **arrays)
+    return weights_path
+
+
+class MLPKernel:
+    """
+    Прямой проход многослойного перцептрона на numpy в float32.
+
+    Возвращает те же коды классов, что и MLPClassifier.predict, но без проверки входа
+    sklearn и без построения DataFrame. Softmax монотонен, поэтому класс выбирается
+    по максимуму выхода последнего слоя без вычисления вероятностей.
+    """
+
+    def __init__(self, coefs, intercepts, classes, activation='relu', out_activation='softmax',
+                 feature_names=()):
+        if out_activation not in ('softmax', 'logistic'):
+            raise ValueError(f"Неподдерживаемая выходная функция активации: {out_activation}")
+        self.coefs = [_flush_subnormal(c) for c in coefs]
+        self.intercepts = [_flush_subnormal(b) for b in intercepts]
+        self.classes = np.asarray(classes)
+        self.activation = str(activation)
+        self.out_activation = str(out_activation)
+        self.feature_names = [str(name) for name in feature_names]
+        self._hidden = _HIDDEN_ACTIVATIONS[self.activation]
+
+    @classmethod
+    def load(cls, weights_path=WEIGHTS_PATH):
+        with np.load(weights_path) as weights:
+            n_layers = sum(1 for key in weights.files if key.startswith('coef_'))
+            return cls([weights[f'coef_{i}'] for i in range(n_layers)],
+                       [weights[f'intercept_{i}'] for i in range(n_layers)],
+                       weights['classes'], weights['activation'].item(),
+                       weights['out_activation'].item(), weights['feature_names'])
+
+    @property
+    def n_features(self):
+        return self.coefs[0].shape[0]
+
+    def decision_function(self, X):
+        """Выход последнего слоя до softmax для массива признаков (N, n_features)."""
+        activations = np.ascontiguousarray(X, dtype=np.float32)
+        if activations.ndim != 2 or activations.shape[1] != self.n_features:
+            raise ValueError(f"Ожидается массив признаков (N, {self.n_features}).")
+        last = len(self.coefs) - 1
+        for i, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            activations = activations @ coef
+            activations += intercept
+            if i != last:
+                self._hidden(activations)
+        return activations
+
+    def predict(self, X):
+        """Коды классов для массива признаков (N, n_features) или DataFrame с теми же столбцами."""
+        output = self.decision_function(X)
+        if self.out_activation == 'logistic':
+            # Бинарная классификация: один выход, порог 0 до сигмоиды
+            return self.classes[(output[:, 0] > 0).astype(np.intp)]
+        return self.classes[output.argmax(axis=1)]
+
+    def predict_one(self, *features):
+        """Код класса для одного набора признаков, например predict_one(ndvi, savi, swir)."""
+        return self.predict(np.array([features], dtype=np.float32))[0]
+
+
+def _exported_hash(weights_path):
+    try:
+        with np.load(weights_path) as weights:
+            return weights['model_hash'].item() if 'model_hash' in weights.files else None
+    except (OSError, ValueError):
+        return None
+
+
+def load_mlp_kernel(weights_path=WEIGHTS_PATH, model_path=MODEL_PATH):
+    """
+    Загружает веса модели. Если файла весов нет или он извлечен из другой версии
+    model_path (переобученной или замененной модели), веса предварительно извлекаются
+    заново (для этого нужен sklearn).
+    """
+    exists = os.path.exists(weights_path)
+    if os.path.exists(model_path) and (not exists or _exported_hash(weights_path) != model_hash(model_path)):
+        try:
+            export_weights(model_path, weights_path)
+        except ImportError:
+            if not exists:
+                raise
+            warnings.warn(f"Веса {weights_path} извлечены из другой версии {model_path}, а sklearn "
+                          f"для их обновления не установлен: используются прежние веса.")
+    return MLPKernel.load(weights_path)
+
+
+if __name__ == "__main__":
+    print(f"Веса модели сохранены в файл: {export_weights()}")
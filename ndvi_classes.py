@@ -0,0 +1,125 @@
+# ndvi_classes.py
+
+from functools import lru_cache
+import numpy as np
+import rasterio
+import profiling
+from raster_cube import NODATA_VALUE
+
+# Границы классов NDVI: класс k (с 1) соответствует BREAKS[k-2] <= NDVI < BREAKS[k-1]
+NDVI_BREAKS = (0.0, 0.2, 0.4, 0.6)
+
+CLASS_NAMES = ('Вода', 'Пустыня/городские зоны', 'Редкая растительность/кустарники',
+               'Средняя растительность', 'Плотная растительность (леса)')
+
+# Код класса для пикселей без данных
+CLASS_NODATA = 0
+
+# Целочисленные типы, для которых классификация выполняется по таблице всех возможных значений
+_LUT_DTYPES = (np.uint8, np.int8, np.uint16, np.int16)
+
+
+@lru_cache(maxsize=None)
+def classification_lut(dtype, breaks=NDVI_BREAKS):
+    """
+    Таблица классов для всех значений целочисленного типа dtype (кэшируется).
+    Возвращает (таблица uint8, смещение): класс значения v равен table[v - смещение].
+    """
+    info = np.iinfo(dtype)
+    values = np.arange(info.min, info.max + 1)
+    table = (np.digitize(values, breaks) + 1).astype(np.uint8)
+    if info.min <= NODATA_VALUE <= info.max:
+        table[NODATA_VALUE - info.min] = CLASS_NODATA
+    return table, info.min
+
+
+def classify_ndvi(data, breaks=NDVI_BREAKS):
+    """
+    Классифицирует значения NDVI по типам земельных участков за один проход.
+
+    Для 8- и 16-битных целых данных класс берется из таблицы по значению пикселя,
+    для остальных типов используется np.digitize. Результат - uint8, пиксели
+    без данных (NODATA_VALUE или NaN) получают класс CLASS_NODATA.
+    """
+    data = np.asarray(data)
+    if data.dtype.type in _LUT_DTYPES:
+        table, offset = classification_lut(data.dtype, tuple(breaks))
+        if offset == 0:
+            return table[data]
+        return table[data.astype(np.int32) - offset]
+
+    classification = (np.digitize(data, breaks) + 1).astype(np.uint8)
+    invalid = data == NODATA_VALUE
+    if np.issubdtype(data.dtype, np.floating):
+        invalid |= np.isnan(data)
+    classification[invalid] = CLASS_NODATA
+    return classification
+
+
+class ClassCounter:
+    """
+    Попиксельные счетчики классов по месяцам.
+
+    Хранит для каждого пикселя число месяцев с каждым кодом класса (включая
+    CLASS_NODATA), поэтому преобладающий класс и частоты классов считаются по любому
+    числу месяцев без хранения стека классификаций.
+    """
+
+    def __init__(self, shape, n_classes=len(CLASS_NAMES), dtype=np.uint16):
+        self.shape = tuple(shape)
+        self.n_classes = n_classes
+        self.months = 0
+        n_pixels = int(np.prod(self.shape))
+        self._pixels = np.arange(n_pixels)
+        self.counts = np.zeros((n_classes + 1, n_pixels), dtype=dtype)
+
+    def update(self, classification):
+        """Добавляет карту классов одного месяца (коды 0..n_classes)."""
+        codes = np.asarray(classification).ravel()
+        if codes.size != self._pixels.size:
+            raise ValueError("Размер карты классов не совпадает с размером счетчика.")
+        if codes.size and codes.max() > self.n_classes:
+            raise ValueError("Код класса выходит за допустимый диапазон.")
+        # Каждый пиксель получает ровно один класс, повторяющихся индексов нет
+        self.counts[codes, self._pixels] += 1
+        self.months += 1
+
+    def valid_count(self):
+        """Число месяцев с данными для каждого пикселя."""
+        return (self.months - self.counts[CLASS_NODATA].astype(np.int64)).reshape(self.shape)
+
+    def modal_class(self):
+        """
+        Преобладающий класс каждого пикселя (uint8). При равенстве выбирается меньший код,
+        пиксели без данных во всех месяцах получают CLASS_NODATA.
+        """
+        modal = (self.counts[1:].argmax(axis=0) + 1).astype(np.uint8)
+        modal[self.valid_count().ravel() == 0] = CLASS_NODATA
+        return modal.reshape(self.shape)
+
+    def frequencies(self):
+        """Доля месяцев с каждым классом среди месяцев с данными: массив (классы, строки, столбцы) float32."""
+        valid = self.valid_count().ravel().astype(np.float32)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = self.counts[1:] / valid
+        return result.astype(np.float32, copy=False).reshape((self.n_classes,) + self.shape)
+
+
+@profiling.profiled('classify_ndvi', 'predict')
+def classify_files(paths, breaks=NDVI_BREAKS, window=None):
+    """
+    Классифицирует растры NDVI (или их окно window) по одному и накапливает счетчики классов.
+    Возвращает ClassCounter.
+    """
+    counter = None
+    for path in paths:
+        with rasterio.open(path) as src:
+            raster = src.read(1, window=window)
+        profiling.count_read(raster.nbytes)
+        classification = classify_ndvi(raster, breaks)
+        if counter is None:
+            counter = ClassCounter(classification.shape)
+        counter.update(classification)
+    if counter is None:
+        raise ValueError("Нет растров для классификации.")
+    return counter
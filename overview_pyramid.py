@@ -0,0 +1,268 @@
+# overview_pyramid.py
+
+import os
+import re
+import json
+import hashlib
+import threading
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+import profiling
+import stack_cache
+from raster_cube import NODATA_VALUE
+
+PYRAMID_DIR_NAME = "pyramids"
+PYRAMID_VERSION = 1
+
+# Верхний уровень пирамиды не больше этого размера по каждой стороне
+MIN_LEVEL_SIZE = 256
+
+# Число строк уровня, уменьшаемых за один шаг построения (четное)
+BUILD_BLOCK_ROWS = 1024
+
+
+def downsample2(block):
+    """
+    Уменьшает блок float32 в 2 раза по каждой оси средним по валидным (не NaN) пикселям.
+    Нечетный край дополняется пропусками.
+    """
+    rows, cols = block.shape
+    padded = np.full((rows + rows % 2, cols + cols % 2), np.nan, dtype=np.float32)
+    padded[:rows, :cols] = block
+    quads = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    valid = ~np.isnan(quads)
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, quads, 0).sum(axis=(1, 3), dtype=np.float32)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan).astype(np.float32)
+
+
+def _level_shapes(height, width, min_size=MIN_LEVEL_SIZE):
+    shapes = [(height, width)]
+    while max(shapes[-1]) > min_size:
+        h, w = shapes[-1]
+        shapes.append(((h + 1) // 2, (w + 1) // 2))
+    return shapes
+
+
+class _ArraySource:
+    """Полное разрешение из массива в памяти (или memmap): производные продукты."""
+
+    def __init__(self, array, nodata=None):
+        self.array = array
+        self.nodata = nodata
+        self.shape = array.shape
+
+    def read(self, rows, cols):
+        block = np.asarray(self.array[rows, cols], dtype=np.float32)
+        if self.nodata is not None:
+            block = np.where(self.array[rows, cols] == self.nodata, np.nan, block)
+        return block
+
+
+class _RasterSource:
+    """Полное разрешение читается из растра окнами; в памяти хранится только запрошенный фрагмент."""
+
+    def __init__(self, path, nodata=NODATA_VALUE):
+        self.path = path
+        self.nodata = nodata
+        # Свой набор данных rasterio в каждом потоке: идентификатор потока -> набор данных
+        self._datasets = {}
+        self._lock = threading.Lock()
+        with rasterio.open(path) as src:
+            self.shape = (src.height, src.width)
+
+    def read(self, rows, cols):
+        thread = threading.get_ident()
+        src = self._datasets.get(thread)
+        if src is None:
+            src = rasterio.open(self.path)
+            with self._lock:
+                self._datasets[thread] = src
+        window = Window(cols.start, rows.start, cols.stop - cols.start, rows.stop - rows.start)
+        raw = src.read(1, window=window)
+        profiling.count_read(raw.nbytes)
+        block = raw.astype(np.float32)
+        if self.nodata is not None:
+            block[raw == self.nodata] = np.nan
+        return block
+
+    def close(self):
+        """Закрывает открытые наборы данных; следующее чтение откроет растр заново."""
+        with self._lock:
+            datasets, self._datasets = self._datasets, {}
+        for src in datasets.values():
+            src.close()
+
+
+class OverviewPyramid:
+    """
+    Пирамида обзоров растра: уровень 0 - полное разрешение, уровень k уменьшен в 2**k раз.
+
+    Уровни 1 и выше хранятся в кэше на диске (.npy, открываются через memmap) и строятся
+    один раз блоками строк, поэтому размер растра не ограничен памятью. Уровень 0 читается
+    из источника по запрошенному окну. Пропуски хранятся как NaN.
+    """
+
+    def __init__(self, source, cache_base, min_size=MIN_LEVEL_SIZE):
+        self.source = source
+        self.shape = source.shape
+        self.cache_base = cache_base
+        self.level_shapes = _level_shapes(*self.shape, min_size)
+        self._levels = [None] * len(self.level_shapes)
+
+    @property
+    def levels(self):
+        return len(self.level_shapes)
+
+    def close(self):
+        """Закрывает растр источника (уровни в кэше открыты через memmap и закрываются сами)."""
+        close = getattr(self.source, 'close', None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _level_path(self, level):
+        return f"{self.cache_base}_L{level}.npy"
+
+    def build(self, progress=None):
+        """Строит недостающие уровни; progress(done, total) вызывается после каждого уровня."""
+        manifest_path = self.cache_base + ".json"
+        manifest = {'version': PYRAMID_VERSION, 'shapes': [list(shape) for shape in self.level_shapes]}
+        try:
+            with open(manifest_path, encoding='utf-8') as f:
+                cached = json.load(f) == manifest
+        except (OSError, ValueError):
+            cached = False
+        if cached and all(os.path.exists(self._level_path(k)) for k in range(1, self.levels)):
+            return self
+
+        with profiling.stage('pyramid', 'pyramid', shape=list(self.shape)):
+            os.makedirs(os.path.dirname(self.cache_base), exist_ok=True)
+            tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+            for level in range(1, self.levels):
+                height, width = self.level_shapes[level]
+                tmp_path = self._level_path(level) + tmp_suffix
+                out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(height, width))
+                previous_height, previous_width = self.level_shapes[level - 1]
+                for row in range(0, previous_height, BUILD_BLOCK_ROWS):
+                    rows = slice(row, min(row + BUILD_BLOCK_ROWS, previous_height))
+                    block = self.read(level - 1, rows, slice(0, previous_width))
+                    out[row // 2:row // 2 + (rows.stop - rows.start + 1) // 2] = downsample2(block)
+                out.flush()
+                del out
+                os.replace(tmp_path, self._level_path(level))
+                self._levels[level] = None
+                if progress is not None:
+                    progress(level, self.levels - 1)
+            with open(manifest_path + tmp_suffix, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(manifest_path + tmp_suffix, manifest_path)
+        return self
+
+    def _level(self, level):
+        if self._levels[level] is None:
+            self._levels[level] = np.load(self._level_path(level), mmap_mode='r')
+        return self._levels[level]
+
+    def read(self, level, rows, cols):
+        """Фрагмент уровня level (срезы строк и столбцов в координатах уровня), float32."""
+        if level == 0:
+            return self.source.read(rows, cols)
+        return np.asarray(self._level(level)[rows, cols])
+
+    def level_for(self, pixels_per_screen_pixel):
+        """Самый грубый уровень, разрешение которого не хуже экранного."""
+        if pixels_per_screen_pixel <= 1:
+            return 0
+        return min(int(np.floor(np.log2(pixels_per_screen_pixel))), self.levels - 1)
+
+    def fetch(self, x0, x1, y0, y1, screen_width, screen_height):
+        """
+        Фрагмент для отображения области [x0, x1) x [y0, y1) (пиксели полного разрешения)
+        в окне screen_width x screen_height экранных пикселей.
+        Возвращает (уровень, массив, (x0, x1, y0, y1) фрагмента в пикселях полного разрешения).
+        """
+        height, width = self.shape
+        x0, x1 = max(0, int(np.floor(x0))), min(width, int(np.ceil(x1)))
+        y0, y1 = max(0, int(np.floor(y0))), min(height, int(np.ceil(y1)))
+        scale = max((x1 - x0) / max(screen_width, 1), (y1 - y0) / max(screen_height, 1))
+        level = self.level_for(scale)
+        factor = 2 ** level
+        level_height, level_width = self.level_shapes[level]
+        rows = slice(y0 // factor, min(level_height, -(-y1 // factor)))
+        cols = slice(x0 // factor, min(level_width, -(-x1 // factor)))
+        data = self.read(level, rows, cols)
+        extent = (cols.start * factor, min(width, cols.stop * factor),
+                  rows.start * factor, min(height, rows.stop * factor))
+        return level, data, extent
+
+    def value_range(self, low=2, high=98):
+        """Перцентили значений по верхнему уровню (для шкалы цветов)."""
+        top = self.read(self.levels - 1, slice(None), slice(None))
+        values = top[~np.isnan(top)]
+        if values.size == 0:
+            return 0.0, 1.0
+        return float(np.percentile(values, low)), float(np.percentile(values, high))
+
+
+def _pyramid_base(cache_dir, key):
+    return os.path.join(cache_dir, PYRAMID_DIR_NAME, key)
+
+
+def _remove_stale(base):
+    """
+    Удаляет уровни и манифесты пирамид того же источника (base = <папка>/<имя>_<ключ>)
+    с другим ключом: прежние версии измененного растра или продукта.
+    """
+    directory, stem = os.path.split(base)
+    name, key = stem.rsplit('_', 1)
+    pattern = re.compile(re.escape(name) + r"_([0-9a-f]{24})(_L\d+\.npy|\.json)$")
+    for file_name in os.listdir(directory):
+        match = pattern.match(file_name)
+        if match and match.group(1) != key:
+            try:
+                os.remove(os.path.join(directory, file_name))
+            except OSError:
+                pass
+
+
+def raster_pyramid(path, nodata=NODATA_VALUE, progress=None):
+    """
+    Пирамида растра индекса. Кэш хранится в папке кэша рядом с папкой индекса
+    и перестраивается при изменении файла.
+    """
+    signature = stack_cache.file_signature(path)
+    key = hashlib.blake2b(json.dumps(signature).encode('utf-8'), digest_size=12).hexdigest()
+    base = _pyramid_base(stack_cache.cache_dir_for([path]), f"{os.path.basename(path)[:-4]}_{key}")
+    pyramid = OverviewPyramid(_RasterSource(path, nodata), base).build(progress)
+    _remove_stale(base)
+    # Растр, открытый потоком построения, закрывается; для показа он откроется заново
+    pyramid.close()
+    return pyramid
+
+
+def array_key(array, chunk_rows=4096):
+    """Хэш содержимого, формы и типа массива (ключ кэша производного продукта)."""
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update(f"{array.shape}{array.dtype}".encode('utf-8'))
+    for row in range(0, array.shape[0], chunk_rows):
+        digest.update(np.ascontiguousarray(array[row:row + chunk_rows]).tobytes())
+    return digest.hexdigest()
+
+
+def array_pyramid(array, name, cache_dir=stack_cache.CACHE_DIR_NAME, nodata=None, progress=None):
+    """
+    Пирамида производного продукта (например, карты корреляции). Уровни кэшируются
+    в cache_dir по хэшу содержимого, поэтому повторный показ того же результата их не строит.
+    """
+    base = _pyramid_base(cache_dir, f"{name}_{array_key(array)}")
+    pyramid = OverviewPyramid(_ArraySource(array, nodata), base).build(progress)
+    _remove_stale(base)
+    return pyramid
@@ -0,0 +1,90 @@
+# parallel_reader.py
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import rasterio
+import profiling
+
+# Количество потоков по умолчанию: rasterio отпускает GIL во время декодирования
+DEFAULT_WORKERS = min(32, os.cpu_count() or 1)
+
+# Максимальный объем растров, декодируемых одновременно
+DEFAULT_MAX_INFLIGHT_BYTES = 256 * 1024 * 1024
+
+
+class ByteBudget:
+    """Ограничивает суммарный объем буферов, занятых одновременно выполняющимися чтениями."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self._condition:
+            # Файл больше лимита читается, только когда других чтений нет
+            while self.used and self.used + nbytes > self.limit:
+                self._condition.wait()
+            self.used += nbytes
+
+    def release(self, nbytes):
+        with self._condition:
+            self.used -= nbytes
+            self._condition.notify_all()
+
+
+def _read_one(path, out, budget, window=None):
+    nbytes = out.nbytes
+    budget.acquire(nbytes)
+    try:
+        with rasterio.open(path) as src:
+            if window is None and (src.height, src.width) != out.shape:
+                raise ValueError(f"Размер растра {path} не совпадает с остальными файлами.")
+            if window is not None and (window.col_off + window.width > src.width or
+                                       window.row_off + window.height > src.height):
+                raise ValueError(f"Окно {window} выходит за границы растра {path}.")
+            # С окном читаются только блоки файла, пересекающиеся с ним
+            src.read(1, out=out, window=window)
+        profiling.count_read(nbytes)
+    finally:
+        budget.release(nbytes)
+    return path
+
+
+def read_rasters_parallel(paths, out, indices=None, workers=None,
+                          max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES, progress=None, window=None):
+    """
+    Декодирует первую полосу каждого растра paths[k] в out[indices[k]] в пуле потоков.
+    window (rasterio Window) ограничивает чтение одной областью всех растров.
+
+    Порядок срезов задается indices (по умолчанию 0..N-1) и не зависит от порядка
+    завершения чтений. progress(done, total, path) вызывается в вызывающем потоке
+    после каждого прочитанного файла.
+    """
+    if indices is None:
+        indices = range(len(paths))
+    indices = list(indices)
+    workers = workers or DEFAULT_WORKERS
+    total = len(paths)
+    if workers <= 1 or total <= 1:
+        for done, (i, path) in enumerate(zip(indices, paths), start=1):
+            _read_one(path, out[i], ByteBudget(np.inf), window)
+            if progress is not None:
+                progress(done, total, path)
+        return out
+
+    budget = ByteBudget(max_inflight_bytes)
+    with ThreadPoolExecutor(max_workers=min(workers, total)) as executor:
+        futures = [executor.submit(_read_one, path, out[i], budget, window) for i, path in zip(indices, paths)]
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                path = future.result()
+                if progress is not None:
+                    progress(done, total, path)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return out
@@ -0,0 +1,392 @@
+# pixel_forecast.py
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import numpy as np
+from profiling import profiled, stage
+from raster_cube import NODATA_VALUE, NDVI_DIR, load_stack
+
+# Размер блока в пикселях: ряд блока - среднее по его валидным пикселям (1 - попиксельно)
+BLOCK_SIZE = 1
+
+# Минимальное число месяцев с данными в ряду: модель берет обычную и сезонную (12 месяцев) разности
+MIN_MONTHS = 24
+
+# Число рядов в одном задании пула процессов
+CHUNK_SERIES = 128
+
+# Заданий в очереди на один процесс: ряды готовятся по мере выполнения, а не все сразу
+QUEUE_PER_PROCESS = 2
+
+# Ограничение числа итераций оптимизатора для ряда в режиме fit
+MAXITER = 50
+
+# Уровень значимости доверительного интервала
+ALPHA = 0.05
+
+# Режимы: fit - параметры оцениваются для каждого ряда (старт с параметров сцены),
+# filter - параметры сцены, для ряда оцениваются только масштаб и состояние фильтра Калмана
+MODES = ('fit', 'filter')
+
+# Коды растра статуса
+STATUS_NO_DATA = 0
+STATUS_FITTED = 1
+STATUS_SHARED = 2
+STATUS_NOT_CONVERGED = 3
+STATUS_FAILED = 4
+
+STATUS_LABELS = {
+    STATUS_NO_DATA: "мало месяцев с данными, прогноз не строился",
+    STATUS_FITTED: "параметры оценены для ряда",
+    STATUS_SHARED: "параметры сцены (режим filter)",
+    STATUS_NOT_CONVERGED: "оценка не сошлась, использованы параметры сцены",
+    STATUS_FAILED: "ошибка модели, прогноза нет",
+}
+
+# Продукты прогноза: имя -> описание
+FORECAST_PRODUCTS = {
+    'mean': "прогноз",
+    'lower': "нижняя граница доверительного интервала",
+    'upper': "верхняя граница доверительного интервала",
+}
+
+# Переменные окружения, ограничивающие потоки BLAS в процессах пула
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+OUTPUT_DIR = "forecast_maps"
+
+
+def month_offsets(dates):
+    """Номера месяцев съемок от месяца первой даты (пропущенные месяцы остаются пропусками ряда)."""
+    return np.array([(date.year - dates[0].year) * 12 + date.month - dates[0].month for date in dates])
+
+
+def forecast_months(dates, periods):
+    """Месяцы прогноза (pandas.PeriodIndex) после месяца последней даты."""
+    import pandas as pd
+    return pd.period_range(pd.Period(dates[-1], 'M') + 1, periods=periods, freq='M')
+
+
+def block_profile(profile, block):
+    """Профиль растра сетки блоков block x block пикселей (неполные блоки у края включаются)."""
+    from affine import Affine
+    transform = profile['transform']
+    profile = dict(profile)
+    profile.update(width=-(-profile['width'] // block), height=-(-profile['height'] // block),
+                   transform=Affine(transform.a * block, transform.b, transform.c,
+                                    transform.d, transform.e * block, transform.f))
+    return profile
+
+
+def _as_float(raster):
+    """Растр float32 с пропусками NaN (NODATA_VALUE для целочисленных данных)."""
+    if np.issubdtype(raster.dtype, np.floating):
+        return np.asarray(raster, dtype=np.float32)
+    values = raster.astype(np.float32)
+    values[raster == NODATA_VALUE] = np.nan
+    return values
+
+
+def _block_means(raster, block):
+    """Среднее по валидным пикселям блоков block x block растра float32 (NaN - нет данных)."""
+    if block == 1:
+        return raster
+    rows, cols = raster.shape
+    padded = np.full((-(-rows // block) * block, -(-cols // block) * block), np.nan, dtype=np.float32)
+    padded[:rows, :cols] = raster
+    blocks = padded.reshape(padded.shape[0] // block, block, padded.shape[1] // block, block)
+    valid = ~np.isnan(blocks)
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, blocks, 0).sum(axis=(1, 3), dtype=np.float32)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan).astype(np.float32)
+
+
+def scene_series(data, offsets):
+    """Среднее значение по валидным пикселям для каждого месяца сетки (NaN - нет съемки)."""
+    series = np.full(offsets[-1] + 1, np.nan)
+    for k, offset in enumerate(offsets):
+        values = _as_float(data[k])
+        valid = ~np.isnan(values)
+        if valid.any():
+            series[offset] = values[valid].mean(dtype=np.float64)
+    return series
+
+
+def _series_chunks(data, offsets, block, enough, chunk_series):
+    """
+    Ряды блоков, отмеченных в enough (сетка блоков), порциями по chunk_series:
+    (индексы блоков в сетке, ряды (блоки, месяцы) float32). Стек проходится полосами
+    строк блоков, поэтому в памяти одновременно только ряды одной полосы.
+    """
+    block_rows, block_cols = enough.shape
+    band_rows = max(1, chunk_series * 4 // block_cols)
+    months = offsets[-1] + 1
+    buffer_cells, buffer_series, buffered = [], [], 0
+    for r0 in range(0, block_rows, band_rows):
+        r1 = min(r0 + band_rows, block_rows)
+        band = np.full((months, r1 - r0, block_cols), np.nan, dtype=np.float32)
+        for k, offset in enumerate(offsets):
+            band[offset] = _block_means(_as_float(data[k, r0 * block:r1 * block]), block)
+        keep = enough[r0:r1].reshape(-1)
+        buffer_cells.append(np.arange(r0 * block_cols, r1 * block_cols)[keep])
+        buffer_series.append(np.ascontiguousarray(band.reshape(months, -1).T[keep]))
+        buffered += int(keep.sum())
+        while buffered >= chunk_series or (r1 == block_rows and buffered):
+            cells, series = np.concatenate(buffer_cells), np.concatenate(buffer_series)
+            yield cells[:chunk_series], series[:chunk_series]
+            buffer_cells, buffer_series = [cells[chunk_series:]], [series[chunk_series:]]
+            buffered = len(buffer_cells[0])
+
+
+def valid_months(data, block=BLOCK_SIZE):
+    """Число месяцев с данными в каждом блоке block x block пикселей."""
+    _, rows, cols = data.shape
+    counts = np.zeros((-(-rows // block), -(-cols // block)), dtype=np.int32)
+    for raster in data:
+        counts += ~np.isnan(_block_means(_as_float(raster), block))
+    return counts
+
+
+def fit_shared(series):
+    """Параметры SARIMA (без дисперсии, она концентрируется) для ряда series."""
+    import warnings
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+    from index_forecasting_sarima import ORDER, SEASONAL_ORDER
+    model = SARIMAX(series, order=ORDER, seasonal_order=SEASONAL_ORDER, enforce_stationarity=False,
+                    enforce_invertibility=False, concentrate_scale=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return np.asarray(model.fit(disp=False).params)
+
+
+def forecast_chunk(series, params, periods=12, mode='fit', alpha=ALPHA, maxiter=MAXITER):
+    """
+    Прогноз SARIMA на periods месяцев для каждого ряда series (ряды, месяцы).
+
+    Возвращает (прогноз, нижняя граница, верхняя граница) - массивы (ряды, periods) float32 -
+    и статусы рядов (uint8, коды STATUS_*). Ошибка или несошедшаяся оценка одного ряда
+    не влияет на остальные.
+    """
+    import warnings
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+    from index_forecasting_sarima import ORDER, SEASONAL_ORDER
+    count = len(series)
+    mean, lower, upper = (np.full((count, periods), np.nan, dtype=np.float32) for _ in range(3))
+    status = np.full(count, STATUS_FAILED, dtype=np.uint8)
+    for k, values in enumerate(series):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                model = SARIMAX(values.astype(np.float64), order=ORDER, seasonal_order=SEASONAL_ORDER,
+                                enforce_stationarity=False, enforce_invertibility=False, concentrate_scale=True)
+                result, state = None, STATUS_SHARED
+                if mode == 'fit':
+                    result = model.fit(start_params=params, maxiter=maxiter, disp=False)
+                    state = STATUS_FITTED
+                    if not result.mle_retvals.get('converged', True):
+                        result, state = None, STATUS_NOT_CONVERGED
+                if result is None:
+                    result = model.filter(params)
+                forecast = result.get_forecast(periods)
+                predicted = np.asarray(forecast.predicted_mean)
+                interval = np.asarray(forecast.conf_int(alpha=alpha))
+        except Exception:
+            continue
+        if np.isfinite(predicted).all() and np.isfinite(interval).all():
+            mean[k], lower[k], upper[k] = predicted, interval[:, 0], interval[:, 1]
+            status[k] = state
+    return mean, lower, upper, status
+
+
+@contextmanager
+def _single_threaded_blas():
+    """Процессы пула, запущенные внутри блока, используют BLAS в один поток (ряды уже распараллелены)."""
+    saved = {name: os.environ.get(name) for name in THREAD_VARIABLES}
+    os.environ.update({name: '1' for name in THREAD_VARIABLES})
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+@profiled('pixel_forecast', 'fit')
+def pixel_forecast(data, dates, block=BLOCK_SIZE, mode='fit', periods=12, alpha=ALPHA, min_months=MIN_MONTHS,
+                   maxiter=MAXITER, processes=None, chunk_series=CHUNK_SERIES, progress=None):
+    """
+    Прогноз SARIMA(1,1,1)(1,1,1,12) на periods месяцев для каждого пикселя стека data
+    (время, строки, столбцы) с датами dates или, при block > 1, для каждого блока
+    block x block пикселей (ряд блока - среднее по его валидным пикселям).
+
+    Модель сначала оценивается один раз по среднему ряду сцены. В режиме fit ее
+    параметры - начальная точка оценки каждого ряда (не больше maxiter итераций);
+    если оценка не сошлась, ряд прогнозируется с параметрами сцены. В режиме filter
+    параметры сцены используются для всех рядов, для ряда оцениваются только масштаб
+    и состояние фильтра Калмана - это на порядок быстрее. Пропущенные месяцы остаются
+    пропусками ряда; блоки с данными меньше чем за min_months месяцев не прогнозируются.
+
+    Ряды обрабатываются порциями по chunk_series в пуле из processes процессов
+    (1 - в текущем процессе); упавшая порция отмечается статусом STATUS_FAILED,
+    остальные продолжают выполняться. progress(done, total) вызывается после каждой
+    порции (в рядах с достаточными данными).
+
+    Возвращает словарь: 'mean', 'lower', 'upper' - массивы (periods, строки блоков,
+    столбцы блоков) float32 с прогнозом и границами доверительного интервала 1 - alpha,
+    'status' - коды STATUS_* (uint8), 'months' - месяцы прогноза, 'params' - параметры сцены.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный режим прогноза: {mode}")
+    if block < 1:
+        raise ValueError("Размер блока должен быть положительным.")
+    if len(data) != len(dates):
+        raise ValueError("Число дат не совпадает с числом срезов стека.")
+    offsets = month_offsets(dates)
+    if np.any(np.diff(offsets) <= 0):
+        raise ValueError("Даты стека должны относиться к разным месяцам и идти по возрастанию.")
+    enough = valid_months(data, block) >= min_months
+    shape = enough.shape
+    # Если ни один ряд не прогнозируется (короткий архив), модель сцены не оценивается
+    params = fit_shared(scene_series(data, offsets)) if enough.any() else None
+    results = {name: np.full((periods,) + shape, np.nan, dtype=np.float32) for name in FORECAST_PRODUCTS}
+    status = np.where(enough, STATUS_FAILED, STATUS_NO_DATA).astype(np.uint8)
+    total = int(enough.sum())
+    done = 0
+
+    def store(cells, chunk_result):
+        nonlocal done
+        rows_index, cols_index = np.unravel_index(cells, shape)
+        for name, values in zip(FORECAST_PRODUCTS, chunk_result[:3]):
+            results[name][:, rows_index, cols_index] = values.T
+        status[rows_index, cols_index] = chunk_result[3]
+        done += len(cells)
+        if progress is not None:
+            progress(done, total)
+
+    chunks = _series_chunks(data, offsets, block, enough, chunk_series)
+    options = (params, periods, mode, alpha, maxiter)
+    processes = max(1, processes or os.cpu_count() or 1)
+    if processes == 1 or total <= chunk_series:
+        for cells, series in chunks:
+            store(cells, forecast_chunk(series, *options))
+    else:
+        _run_pool(chunks, options, processes, store)
+    return dict(results, status=status, months=forecast_months(dates, periods), params=params)
+
+
+def _run_pool(chunks, options, processes, store):
+    """
+    Выполняет порции в пуле процессов с ограниченной очередью. Если процесс пула завершился
+    аварийно, порции, выполнявшиеся в сломанном пуле, повторяются по одной в новом пуле:
+    теряется только порция, которая ломает пул и при повторе.
+    """
+    context = multiprocessing.get_context('spawn')
+    executor = None
+    futures = {}
+
+    def collect(return_when):
+        nonlocal executor
+        finished, _ = wait(futures, return_when=return_when)
+        victims = []
+        for future in finished:
+            cells, series = futures.pop(future)
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                victims.append((cells, series))
+                continue
+            except Exception:
+                # Ошибка вне моделей рядов: порция остается со статусом STATUS_FAILED
+                continue
+            store(cells, result)
+        if not victims:
+            return
+        # Остальные порции сломанного пула завершаются той же ошибкой (или успели выполниться)
+        finished, _ = wait(futures)
+        for future in finished:
+            cells, series = futures.pop(future)
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                victims.append((cells, series))
+                continue
+            except Exception:
+                continue
+            store(cells, result)
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+        for cells, series in victims:
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+            try:
+                result = executor.submit(forecast_chunk, series, *options).result()
+            except BrokenProcessPool:
+                # Порция ломает пул и при повторе: ее ряды остаются со статусом STATUS_FAILED
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = None
+                continue
+            except Exception:
+                continue
+            store(cells, result)
+
+    with _single_threaded_blas():
+        try:
+            for cells, series in chunks:
+                if executor is None:
+                    executor = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+                futures[executor.submit(forecast_chunk, series, *options)] = (cells, series)
+                while len(futures) >= processes * QUEUE_PER_PROCESS:
+                    collect(FIRST_COMPLETED)
+            while futures:
+                collect(FIRST_COMPLETED)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+
+def stack_forecast(stack, **options):
+    """Прогноз рядов IndexStack (см. pixel_forecast)."""
+    return pixel_forecast(stack.data, stack.dates, **options)
+
+
+def write_forecast_maps(forecast, profile, output_dir, prefix, block=BLOCK_SIZE):
+    """
+    Записывает прогноз в output_dir/<prefix>_forecast_<продукт>.tif (канал k - k-й месяц прогноза,
+    float32, nodata NaN) и статусы рядов в <prefix>_forecast_status.tif.
+    """
+    import rasterio
+    os.makedirs(output_dir, exist_ok=True)
+    profile = block_profile(profile, block)
+    profile.update(driver='GTiff', compress='deflate')
+    for key in ('blockxsize', 'blockysize', 'tiled', 'interleave'):
+        profile.pop(key, None)
+    months = [str(month) for month in forecast['months']]
+    paths = []
+    for name, description in FORECAST_PRODUCTS.items():
+        paths.append(os.path.join(output_dir, f"{prefix}_forecast_{name}.tif"))
+        with stage('write', 'write', path=paths[-1]), \
+                rasterio.open(paths[-1], 'w', **dict(profile, dtype='float32', count=len(months), nodata=np.nan)) as dst:
+            dst.write(forecast[name])
+            for band, month in enumerate(months, start=1):
+                dst.set_band_description(band, f"{description} {month}")
+    paths.append(os.path.join(output_dir, f"{prefix}_forecast_status.tif"))
+    with stage('write', 'write', path=paths[-1]), \
+            rasterio.open(paths[-1], 'w', **dict(profile, dtype='uint8', count=1, nodata=None)) as dst:
+        dst.write(forecast['status'], 1)
+        dst.set_band_description(1, "; ".join(f"{code} - {label}" for code, label in STATUS_LABELS.items()))
+    return paths
+
+
+if __name__ == "__main__":
+    ndvi = load_stack(NDVI_DIR, "NDVI")
+    forecast = stack_forecast(ndvi, block=4, mode='filter',
+                              progress=lambda done, total: print(f"\r{done}/{total} рядов", end=""))
+    print()
+    for path in write_forecast_maps(forecast, ndvi.profile, OUTPUT_DIR, "ndvi", block=4):
+        print(f"Сохранено: {path}")
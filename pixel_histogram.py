@@ -0,0 +1,151 @@
+# pixel_histogram.py
+
+import numpy as np
+from profiling import profiled
+from raster_cube import NODATA_VALUE
+
+# Число соседних значений в одной группе грубой гистограммы
+GROUP_SIZE = 16
+
+# Типы растров, коды которых можно считать гистограммой; остальные стеки - через float (nanmedian)
+HISTOGRAM_DTYPES = (np.dtype(np.uint8), np.dtype(np.uint16))
+
+
+def _check_dtype(dtype):
+    if np.dtype(dtype) not in HISTOGRAM_DTYPES:
+        raise ValueError(f"Гистограмма строится только для uint8 и uint16, получен {np.dtype(dtype)}.")
+
+
+class PixelHistogram:
+    """
+    Попиксельная гистограмма целочисленных кодов индекса.
+
+    Для каждого пикселя хранится число месяцев с каждым значением из диапазона
+    [min_value, max_value] (массив счетчиков размером (значения, пиксели)) и грубая
+    гистограмма по группам из GROUP_SIZE значений. Этого достаточно для точных медианы,
+    перцентилей, среднего и стандартного отклонения без хранения стека: память
+    не зависит от числа месяцев, а поиск перцентиля просматривает одну группу значений.
+    """
+
+    def __init__(self, shape, min_value, max_value, dtype=np.uint16):
+        if max_value < min_value:
+            raise ValueError("max_value должен быть не меньше min_value.")
+        self.shape = tuple(shape)
+        self.min_value = int(min_value)
+        self.max_value = int(max_value)
+        n_pixels = int(np.prod(self.shape))
+        n_bins = self.max_value - self.min_value + 1
+        self.counts = np.zeros((n_bins, n_pixels), dtype=dtype)
+        self.group_counts = np.zeros((-(-n_bins // GROUP_SIZE), n_pixels), dtype=dtype)
+
+    @classmethod
+    @profiled('histogram', 'reduce')
+    def from_stack(cls, data, mask=None):
+        """Строит гистограмму по стеку (время, строки, столбцы) за один проход по месяцам."""
+        _check_dtype(data.dtype)
+        valid = data != NODATA_VALUE if mask is None else ~mask
+        # Счетчики не превышают число месяцев
+        dtype = np.uint8 if data.shape[0] <= np.iinfo(np.uint8).max else np.uint16
+        if not valid.any():
+            histogram = cls(data.shape[1:], 0, 0, dtype)
+        else:
+            values = data[valid]
+            histogram = cls(data.shape[1:], values.min(), values.max(), dtype)
+        for i in range(data.shape[0]):
+            histogram.update(data[i], None if mask is None else mask[i])
+        return histogram
+
+    @property
+    def bins(self):
+        return np.arange(self.min_value, self.max_value + 1)
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes + self.group_counts.nbytes
+
+    def update(self, raster, mask=None):
+        """Добавляет в гистограмму один месяц; mask (True - нет данных) по умолчанию raster == NODATA_VALUE."""
+        values = np.asarray(raster).ravel()
+        _check_dtype(values.dtype)
+        valid = values != NODATA_VALUE if mask is None else ~np.asarray(mask).ravel()
+        pixels = np.flatnonzero(valid)
+        values = values[pixels]
+        if values.size and (values.min() < self.min_value or values.max() > self.max_value):
+            raise ValueError("Значения растра выходят за диапазон гистограммы.")
+        bins = values.astype(np.intp) - self.min_value
+        # Каждый пиксель встречается один раз, поэтому повторяющихся индексов нет
+        self.counts[bins, pixels] += 1
+        self.group_counts[bins // GROUP_SIZE, pixels] += 1
+
+    def count(self):
+        """Число валидных месяцев для каждого пикселя."""
+        return self.group_counts.sum(axis=0, dtype=np.int64).reshape(self.shape)
+
+    def _moments(self):
+        """Число значений, сумма и сумма квадратов для каждого пикселя (без копии счетчиков в float)."""
+        total = np.zeros(self.counts.shape[1])
+        squares = np.zeros(self.counts.shape[1])
+        for value, counts in zip(self.bins.astype(np.float64), self.counts):
+            total += value * counts
+            squares += value * value * counts
+        return self.count().ravel(), total, squares
+
+    def mean(self):
+        n, total, _ = self._moments()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (total / n).reshape(self.shape)
+
+    def std(self):
+        """Стандартное отклонение (ddof=0), как у np.nanstd."""
+        n, total, squares = self._moments()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / n
+            return np.sqrt(np.maximum(squares / n - mean * mean, 0)).reshape(self.shape)
+
+    def _rank_values(self, rank):
+        """Значение с порядковым номером rank (с нуля) для каждого пикселя."""
+        n_bins, n_pixels = self.counts.shape
+        pixels = np.arange(n_pixels)
+        # Группа, в которую попадает rank, и число значений в предыдущих группах
+        group = np.zeros(n_pixels, dtype=np.intp)
+        before = np.zeros(n_pixels, dtype=np.int64)
+        cumulative = np.zeros(n_pixels, dtype=np.int64)
+        for group_counts in self.group_counts:
+            cumulative += group_counts
+            inside = cumulative <= rank
+            group += inside
+            np.copyto(before, cumulative, where=inside)
+        # Точное значение внутри найденной группы
+        first_bin = group * GROUP_SIZE
+        offset = np.zeros(n_pixels, dtype=np.intp)
+        for j in range(GROUP_SIZE - 1):
+            bins = np.minimum(first_bin + j, n_bins - 1)
+            before += self.counts[bins, pixels]
+            offset += before <= rank
+        return first_bin + offset + self.min_value
+
+    def percentile(self, q):
+        """
+        Точные перцентили q (в процентах, число или список) с линейной интерполяцией,
+        как у np.nanpercentile. Для списка q возвращает массив (len(q), строки, столбцы).
+        """
+        qs = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        n = self.count().ravel()
+        result = np.empty((len(qs), n.size))
+        for k, value in enumerate(qs):
+            position = (n - 1) * (value / 100.0)
+            lower = np.floor(position).astype(np.int64)
+            upper = np.minimum(lower + 1, n - 1)
+            lower_value = self._rank_values(lower)
+            upper_value = self._rank_values(upper)
+            # Интерполяция в той же форме, что и в numpy (_lerp)
+            fraction = position - lower
+            diff = (upper_value - lower_value).astype(np.float64)
+            values = np.where(fraction >= 0.5, upper_value - diff * (1 - fraction),
+                              lower_value + diff * fraction)
+            result[k] = np.where(n > 0, values, np.nan)
+        result = result.reshape((len(qs),) + self.shape)
+        return result[0] if np.ndim(q) == 0 else result
+
+    def median(self):
+        return self.percentile(50)
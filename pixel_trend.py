@@ -0,0 +1,181 @@
+# pixel_trend.py
+
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import rasterio
+from profiling import profiled
+from raster_cube import NODATA_VALUE, NDVI_DIR, load_stack
+
+# Объем временных массивов пар месяцев (оценка Сена, тест Манна-Кендалла) на один блок пикселей
+DEFAULT_BLOCK_BYTES = 64 * 1024 * 1024
+
+# Число потоков: numpy отпускает GIL при сортировке и арифметике над блоками
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Минимальное число месяцев с данными, при котором тренд пикселя вычисляется
+MIN_MONTHS = 3
+
+# Продукты trend_maps: имя -> описание
+TREND_PRODUCTS = {
+    'ols_slope': "наклон МНК, единиц индекса в год",
+    'ols_intercept': "значение линии МНК на первую дату",
+    'sen_slope': "наклон Тейла-Сена, единиц индекса в год",
+    'mk_z': "статистика Z теста Манна-Кендалла",
+    'mk_p': "двусторонний p-уровень теста Манна-Кендалла",
+}
+
+OUTPUT_DIR = "trend_maps"
+
+
+def time_axis(dates):
+    """Время съемок в годах от первой даты."""
+    return np.array([(date - dates[0]).days / 365.25 for date in dates], dtype=np.float64)
+
+
+def _block_mask(block):
+    """Маска пропусков блока: NaN для вещественных данных, NODATA_VALUE для целочисленных."""
+    if np.issubdtype(block.dtype, np.floating):
+        return np.isnan(block)
+    return block == NODATA_VALUE
+
+
+def _ols(values, valid, times):
+    """Наклон и свободный член МНК для пикселей values (пиксели, время) по валидным месяцам."""
+    weights = valid.astype(np.float64)
+    y = np.where(valid, values, 0.0)
+    n = weights.sum(axis=1)
+    sum_t = weights @ times
+    sum_tt = weights @ (times * times)
+    sum_y = y.sum(axis=1)
+    sum_ty = y @ times
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (n * sum_ty - sum_t * sum_y) / (n * sum_tt - sum_t * sum_t)
+        intercept = (sum_y - slope * sum_t) / n
+    return slope, intercept
+
+
+def _sen_mann_kendall(values, valid, times, first, second):
+    """
+    Наклон Тейла-Сена, статистика Z и p-уровень теста Манна-Кендалла для пикселей values
+    (пиксели, время) по парам месяцев first[k] < second[k], где оба месяца валидны.
+    """
+    from scipy.special import ndtr
+    pairs_valid = valid[:, first] & valid[:, second]
+    slopes = values[:, second] - values[:, first]
+    slopes *= (1 / (times[second] - times[first])).astype(np.float32)
+    # Пропуски - +inf: при сортировке они уходят в конец
+    slopes[~pairs_valid] = np.inf
+    count = pairs_valid.sum(axis=1)
+    # S = число возрастающих пар минус число убывающих (знак наклона совпадает со знаком разности)
+    s = (np.count_nonzero(slopes > 0, axis=1) - (len(first) - count) - np.count_nonzero(slopes < 0, axis=1))
+    s = s.astype(np.float64)
+
+    # Медиана наклонов валидных пар
+    slopes.sort(axis=1)
+    lower = np.take_along_axis(slopes, np.maximum(count - 1, 0)[:, None] // 2, axis=1)[:, 0]
+    upper = np.take_along_axis(slopes, (count // 2)[:, None], axis=1)[:, 0]
+    sen = np.where(count > 0, (lower + upper) / 2, np.nan)
+
+    # Дисперсия S с поправкой на совпадающие значения: для каждого значения считается
+    # размер его группы совпадений c, тогда сумма t(t-1)(2t+5) по группам = 2*sum(c^2) + 3*sum(c) - 5n
+    equal = (values[:, :, None] == values[:, None, :]) & valid[:, :, None] & valid[:, None, :]
+    group = equal.sum(axis=2, dtype=np.float64)
+    n = valid.sum(axis=1, dtype=np.float64)
+    ties = 2 * (group * group).sum(axis=1) + 3 * group.sum(axis=1) - 5 * n
+    variance = (n * (n - 1) * (2 * n + 5) - ties) / 18
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = np.where(variance > 0, (s - np.sign(s)) / np.sqrt(variance), np.nan)
+    p = 2 * ndtr(-np.abs(z))
+    return sen, z, p
+
+
+def _trend_block(data, mask, times, first, second, min_months, r0, r1, c0, c1):
+    months = data.shape[0]
+    block = data[:, r0:r1, c0:c1]
+    invalid = _block_mask(block) if mask is None else mask[:, r0:r1, c0:c1]
+    # (пиксели, время): ряд каждого пикселя непрерывен в памяти
+    values = np.ascontiguousarray(np.asarray(block, dtype=np.float32).reshape(months, -1).T)
+    valid = ~np.ascontiguousarray(np.asarray(invalid).reshape(months, -1).T)
+    enough = valid.sum(axis=1) >= min_months
+    slope, intercept = _ols(values, valid, times)
+    sen, z, p = _sen_mann_kendall(values, valid, times, first, second)
+    products = {'ols_slope': slope, 'ols_intercept': intercept, 'sen_slope': sen, 'mk_z': z, 'mk_p': p}
+    return r0, r1, c0, c1, {name: np.where(enough, product, np.nan).reshape(r1 - r0, c1 - c0)
+                            for name, product in products.items()}
+
+
+@profiled('pixel_trend', 'reduce')
+def pixel_trends(data, dates, mask=None, block_bytes=DEFAULT_BLOCK_BYTES, min_months=MIN_MONTHS, workers=None,
+                 progress=None):
+    """
+    Попиксельные тренды стека data (время, строки, столбцы) с датами съемок dates.
+
+    Возвращает словарь массивов (строки, столбцы) float32 с продуктами TREND_PRODUCTS:
+    наклон и свободный член МНК, наклон Тейла-Сена (медиана наклонов по всем парам
+    месяцев) и статистику Z и p-уровень теста Манна-Кендалла с поправкой на совпадения.
+    Время измеряется в годах от первой даты, значения - в единицах индекса.
+    Пропуски (mask, по умолчанию NaN или NODATA_VALUE) исключаются; у пикселей
+    с данными меньше чем за min_months месяцев тренды - NaN.
+
+    Пиксели обрабатываются векторно блоками в workers потоках: размер блока подбирается
+    так, чтобы массивы пар месяцев одного блока занимали не больше block_bytes. Блок - несколько
+    строк или, если строка целиком не помещается (длинные ряды), часть строки.
+    progress(done, total) вызывается после каждого блока (в пикселях).
+    """
+    months, rows, cols = data.shape
+    if months != len(dates):
+        raise ValueError("Число дат не совпадает с числом срезов стека.")
+    times = time_axis(dates)
+    first, second = np.triu_indices(months, k=1)
+    # Наклоны пар (float32), их маска, маска совпадений и значения на пиксель
+    pixel_bytes = len(first) * 5 + months * months + months * 16
+    block_pixels = max(1, block_bytes // max(pixel_bytes, 1))
+    block_rows = max(1, block_pixels // cols)
+    block_cols = min(cols, block_pixels)
+    results = {name: np.full((rows, cols), np.nan, dtype=np.float32) for name in TREND_PRODUCTS}
+
+    blocks = [(r0, min(r0 + block_rows, rows), c0, min(c0 + block_cols, cols))
+              for r0 in range(0, rows, block_rows) for c0 in range(0, cols, block_cols)]
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(workers or DEFAULT_WORKERS, len(blocks)))) as executor:
+        futures = [executor.submit(_trend_block, data, mask, times, first, second, min_months, *block)
+                   for block in blocks]
+        for future in as_completed(futures):
+            r0, r1, c0, c1, products = future.result()
+            for name, values in products.items():
+                results[name][r0:r1, c0:c1] = values
+            done += (r1 - r0) * (c1 - c0)
+            if progress is not None:
+                progress(done, rows * cols)
+    return results
+
+
+def stack_trends(stack, block_bytes=DEFAULT_BLOCK_BYTES, min_months=MIN_MONTHS, workers=None, progress=None):
+    """Попиксельные тренды IndexStack (см. pixel_trends)."""
+    return pixel_trends(stack.data, stack.dates, block_bytes=block_bytes, min_months=min_months, workers=workers,
+                        progress=progress)
+
+
+def write_trend_maps(trends, profile, output_dir, prefix):
+    """Записывает продукты трендов в output_dir/<prefix>_<продукт>.tif (float32, nodata NaN)."""
+    os.makedirs(output_dir, exist_ok=True)
+    profile = dict(profile)
+    profile.update(driver='GTiff', dtype='float32', count=1, nodata=np.nan, compress='deflate')
+    for key in ('blockxsize', 'blockysize', 'tiled', 'interleave'):
+        profile.pop(key, None)
+    paths = []
+    for name, values in trends.items():
+        paths.append(os.path.join(output_dir, f"{prefix}_{name}.tif"))
+        with rasterio.open(paths[-1], 'w', **profile) as dst:
+            dst.write(values.astype(np.float32, copy=False), 1)
+            dst.set_band_description(1, TREND_PRODUCTS.get(name, name))
+    return paths
+
+
+if __name__ == "__main__":
+    ndvi = load_stack(NDVI_DIR, "NDVI")
+    trends = stack_trends(ndvi, progress=lambda done, total: print(f"\r{done}/{total} пикселей", end=""))
+    print()
+    for path in write_trend_maps(trends, ndvi.profile, OUTPUT_DIR, "ndvi"):
+        print(f"Сохранено: {path}")
@@ -1,27 +1,25 @@
-import joblib
-import pandas as pd
+from mlp_inference import load_mlp_kernel
 
-# Загрузка модели классификации
-mlp_model = joblib.load('mlp_model2.pkl')
+# Загрузка модели классификации (веса mlp_model2.pkl, прямой проход на numpy)
+mlp_model = load_mlp_kernel()
+
+# Соответствие классов с типами земель
+CLASS_MAPPING = {
+    1: 'Вода',
+    2: 'Пустыня/городские зоны',
+    3: 'Редкая растительность/кустарники',
+    4: 'Средняя растительность',
+    5: 'Плотная растительность (леса)'
+}
 
 def classify_land_use(ndvi, savi, swir):
     """
     Классифицирует тип земельного участка на основе индексов NDVI, SAVI и SWIR.
     """
-    # Создаем DataFrame с именами признаков для модели
-    data = pd.DataFrame([[ndvi, savi, swir]], columns=['NDVI', 'SAVI', 'SWIR'])
-    prediction = mlp_model.predict(data)
-    
-    # Соответствие классов с типами земель
-    class_mapping = {
-        1: 'Вода',
-        2: 'Пустыня/городские зоны',
-        3: 'Редкая растительность/кустарники',
-        4: 'Средняя растительность',
-        5: 'Плотная растительность (леса)'
-    }
+    # Признаки передаются в порядке обучения модели: NDVI, SAVI, SWIR
+    prediction = mlp_model.predict_one(ndvi, savi, swir)
     
-    return class_mapping[prediction[0]]
+    return CLASS_MAPPING[prediction]
 
 def generate_recommendations(ndvi, savi, swir):
     """
@@ -29,7 +27,12 @@ def generate_recommendations(ndvi, savi, swir):
     """
     # Определение типа земельного участка
     land_type = classify_land_use(ndvi, savi, swir)
-    
+    return recommendation_for(land_type)
+
+def recommendation_for(land_type):
+    """
+    Возвращает рекомендацию по посадке для типа земельного участка.
+    """
     # Генерация рекомендаций по типу земельного участка
     if land_type == 'Плотная растительность (леса)':
         recommendation = 'Поддерживайте текущие культуры, возможно, высадка лесных растений.'
@@ -46,8 +49,9 @@ def generate_recommendations(ndvi, savi, swir):
 
     return recommendation
 
-# Пример использования
-ndvi_value = 0.45
-savi_value = 0.25
-swir_value = 270
-print(f"Рекомендации по посадке: {generate_recommendations(ndvi_value, savi_value, swir_value)}")
+if __name__ == "__main__":
+    # Пример использования
+    ndvi_value = 0.45
+    savi_value = 0.25
+    swir_value = 270
+    print(f"Рекомендации по посадке: {generate_recommendations(ndvi_value, savi_value, swir_value)}")
@@ -0,0 +1,293 @@
+# profiling.py
+"""
+Профилирование этапов обработки: загрузка, декодирование, сборка стеков,
+нормализация, свертки (корреляция, статистики), обучение моделей и отрисовка.
+
+Для каждого этапа записываются время (wall и CPU процесса), объем прочитанных
+растров, выделенная память (при включенном учете выделений) и пиковый RSS процесса.
+Счетчики общие для процесса, поэтому чтение в рабочих потоках учитывается в этапе,
+открытом в вызывающем потоке, а вложенные этапы входят в родительские.
+
+Профилирование выключено по умолчанию; выключенный этап - это проверка флага и
+возврат общего пустого контекста, поэтому вызовы можно оставлять в рабочем коде.
+Включение: переменная окружения TERRAVISION_PROFILE=1 (или alloc - с учетом
+выделений памяти через tracemalloc) либо enable(). Если задана переменная
+TERRAVISION_PROFILE_TRACE, при выходе из процесса в этот файл сохраняется
+трассировка в формате Chrome (chrome://tracing, Perfetto).
+"""
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# Максимальное число хранимых записей этапов
+MAX_EVENTS = 100000
+
+_enabled = False
+_track_allocations = False
+_lock = threading.Lock()
+_events = deque(maxlen=MAX_EVENTS)
+_sequence = 0
+_bytes_read = 0
+_local = threading.local()
+_origin = time.perf_counter()
+
+
+def enable(allocations=False):
+    """Включает профилирование; allocations - учитывать выделения памяти (медленнее)."""
+    global _enabled, _track_allocations
+    _track_allocations = allocations
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+
+def disable():
+    global _enabled, _track_allocations
+    _enabled = False
+    if _track_allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _track_allocations = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Удаляет накопленные записи."""
+    with _lock:
+        _events.clear()
+
+
+def mark():
+    """Номер следующей записи: events(since=mark()) вернет только записи после этого момента."""
+    return _sequence
+
+
+def events(since=0):
+    """Записи этапов (словари) в порядке завершения."""
+    with _lock:
+        return [event for event in _events if event['seq'] >= since]
+
+
+def count_read(nbytes):
+    """Учитывает nbytes прочитанных (декодированных) данных растра."""
+    global _bytes_read
+    if not _enabled:
+        return
+    with _lock:
+        _bytes_read += int(nbytes)
+
+
+def peak_rss():
+    """Максимальный RSS процесса в байтах (None, если недоступен)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS - байты
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _NullStage:
+    """Этап при выключенном профилировании: ничего не делает."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+
+    __slots__ = ('name', 'category', 'args', 'parent', 'started', 'cpu_started', 'bytes_started',
+                 'alloc_started', 'alloc_peak', 'rss_started')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        if _track_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            # Пик до начала этапа достается родителю, дальше пик считается заново
+            if self.parent is not None:
+                self.parent.alloc_peak = max(self.parent.alloc_peak, peak)
+            tracemalloc.reset_peak()
+            self.alloc_started = current
+            self.alloc_peak = current
+        self.rss_started = peak_rss()
+        self.bytes_started = _bytes_read
+        self.cpu_started = time.process_time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _sequence
+        ended = time.perf_counter()
+        cpu = time.process_time() - self.cpu_started
+        event = {
+            'name': self.name,
+            'category': self.category,
+            'start': self.started - _origin,
+            'wall': ended - self.started,
+            'cpu': cpu,
+            'bytes_read': _bytes_read - self.bytes_started,
+            'peak_rss': peak_rss(),
+            'thread': threading.get_ident(),
+            'thread_name': threading.current_thread().name,
+            'depth': len(_local.stack) - 1,
+        }
+        if event['peak_rss'] is not None and self.rss_started is not None:
+            # Насколько этап поднял пиковый RSS процесса
+            event['rss_growth'] = event['peak_rss'] - self.rss_started
+        if _track_allocations and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(self.alloc_peak, peak)
+            event['allocated'] = current - self.alloc_started
+            event['alloc_peak'] = peak - self.alloc_started
+            if self.parent is not None:
+                self.parent.alloc_peak = max(self.parent.alloc_peak, peak)
+        if exc_type is not None:
+            event['error'] = exc_type.__name__
+        if self.args:
+            event['args'] = self.args
+        _local.stack.pop()
+        with _lock:
+            event['seq'] = _sequence
+            _sequence += 1
+            _events.append(event)
+        return False
+
+
+def stage(name, category=None, **args):
+    """
+    Контекст этапа: with stage('correlation', 'reduce'): ...
+    category - группа этапа (load, decode, stack, normalize, reduce, predict, fit, render),
+    args - дополнительные сведения для трассировки.
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, category or name, args)
+
+
+def profiled(name=None, category=None):
+    """Декоратор: выполнение функции записывается как этап name (по умолчанию имя функции)."""
+    def decorate(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(label, category or label, None):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def summary(records=None):
+    """
+    Сводка по этапам: список словарей (name, category, calls, wall, cpu, bytes_read,
+    allocated, peak_rss) в порядке первого появления этапа.
+    """
+    records = events() if records is None else records
+    rows = {}
+    for event in sorted(records, key=lambda event: event['start']):
+        row = rows.setdefault(event['name'], {
+            'name': event['name'], 'category': event['category'], 'depth': event['depth'], 'calls': 0,
+            'wall': 0.0, 'cpu': 0.0, 'bytes_read': 0, 'allocated': None, 'peak_rss': None})
+        row['calls'] += 1
+        row['wall'] += event['wall']
+        row['cpu'] += event['cpu']
+        row['bytes_read'] += event['bytes_read']
+        row['depth'] = min(row['depth'], event['depth'])
+        if 'alloc_peak' in event:
+            row['allocated'] = max(row['allocated'] or 0, event['alloc_peak'])
+        if event['peak_rss'] is not None:
+            row['peak_rss'] = max(row['peak_rss'] or 0, event['peak_rss'])
+    return list(rows.values())
+
+
+def _megabytes(value):
+    return "-" if value is None else f"{value / (1024 * 1024):.1f}"
+
+
+def format_summary(rows):
+    """Таблица сводки для консоли и окна приложения."""
+    if not rows:
+        return "Нет записанных этапов."
+    lines = [f"{'этап':<28}{'вызовы':>7}{'wall, с':>10}{'CPU, с':>10}{'чтение, МБ':>12}"
+             f"{'выделено, МБ':>14}{'пик RSS, МБ':>13}"]
+    for row in rows:
+        label = ("  " * row['depth'] + row['name'])[:27]
+        lines.append(f"{label:<28}{row['calls']:>7}{row['wall']:>10.3f}{row['cpu']:>10.3f}"
+                     f"{_megabytes(row['bytes_read']):>12}{_megabytes(row['allocated']):>14}"
+                     f"{_megabytes(row['peak_rss']):>13}")
+    return "\n".join(lines)
+
+
+def chrome_trace(records=None):
+    """Записи в формате Chrome Trace Event (полные события 'X', время в микросекундах)."""
+    records = events() if records is None else records
+    pid = os.getpid()
+    trace = []
+    threads = {}
+    for event in records:
+        threads[event['thread']] = event['thread_name']
+        args = {key: event[key] for key in ('cpu', 'bytes_read', 'peak_rss', 'rss_growth', 'allocated',
+                                            'alloc_peak', 'error') if event.get(key) is not None}
+        args.update(event.get('args') or {})
+        trace.append({'name': event['name'], 'cat': event['category'], 'ph': 'X', 'pid': pid,
+                      'tid': event['thread'], 'ts': event['start'] * 1e6, 'dur': event['wall'] * 1e6,
+                      'args': args})
+    for tid, thread_name in threads.items():
+        trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+    return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+def export_chrome_trace(path, records=None):
+    """Сохраняет трассировку для chrome://tracing или Perfetto."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(chrome_trace(records), f, ensure_ascii=False, default=str)
+    return path
+
+
+def export_json(path, records=None):
+    """Сохраняет сводку по этапам и все записи в JSON."""
+    records = events() if records is None else records
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary(records), 'events': records}, f, ensure_ascii=False, indent=2, default=str)
+    return path
+
+
+def _export_at_exit(path):
+    if _events:
+        export_chrome_trace(path)
+
+
+_mode = os.environ.get('TERRAVISION_PROFILE', '').strip().lower()
+if _mode and _mode not in ('0', 'false', 'no', 'off'):
+    enable(allocations=_mode == 'alloc')
+    if os.environ.get('TERRAVISION_PROFILE_TRACE'):
+        atexit.register(_export_at_exit, os.environ['TERRAVISION_PROFILE_TRACE'])
@@ -0,0 +1,233 @@
+# raster_catalog.py
+
+import os
+import json
+import hashlib
+import sqlite3
+from collections import namedtuple
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+import stack_cache
+from raster_cube import INDEX_DIRS, DATE_PATTERN, REGION_PATTERN, list_rasters
+
+CATALOG_NAME = "catalog.sqlite"
+CATALOG_VERSION = 2
+
+_COLUMNS = ('path', 'data_dir', 'index_name', 'region', 'west', 'south', 'east', 'north', 'date_start', 'date_end',
+            'height', 'width', 'band_count', 'dtype', 'nodata', 'crs', 'transform', 'size', 'mtime_ns',
+            'fingerprint')
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS rasters (
+    path TEXT PRIMARY KEY,
+    data_dir TEXT NOT NULL,
+    index_name TEXT NOT NULL,
+    region TEXT,
+    west REAL, south REAL, east REAL, north REAL,
+    date_start TEXT, date_end TEXT,
+    height INTEGER, width INTEGER, band_count INTEGER,
+    dtype TEXT, nodata REAL, crs TEXT, transform TEXT,
+    size INTEGER, mtime_ns INTEGER, fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS rasters_index_date ON rasters (data_dir, index_name, date_end);
+PRAGMA user_version = {CATALOG_VERSION};
+"""
+
+
+class CatalogEntry(namedtuple('CatalogEntry', _COLUMNS)):
+    """Запись каталога: метаданные одного растра, полученные без чтения его пикселей."""
+
+    __slots__ = ()
+
+    @property
+    def shape(self):
+        return self.height, self.width
+
+    @property
+    def bbox(self):
+        return self.west, self.south, self.east, self.north
+
+    @property
+    def profile(self):
+        """Профиль rasterio, восстановленный из каталога."""
+        return {
+            'driver': 'GTiff', 'dtype': self.dtype, 'nodata': self.nodata,
+            'width': self.width, 'height': self.height, 'count': self.band_count,
+            'crs': CRS.from_wkt(self.crs) if self.crs else None,
+            'transform': Affine.from_gdal(*json.loads(self.transform)),
+        }
+
+
+def parse_file_name(file_name):
+    """
+    Разбирает имя вида ndvi_region_39.0_43.5_46.0_47.0_2020-09-30_2020-09-30.tif.
+    Возвращает (регион (запад, юг, восток, север) или None, дата начала, дата конца).
+    """
+    name = os.path.basename(file_name)
+    region = REGION_PATTERN.search(name)
+    dates = DATE_PATTERN.findall(name)
+    bbox = tuple(float(value) for value in region.groups()) if region else None
+    return bbox, (dates[0] if dates else None), (dates[-1] if dates else None)
+
+
+def file_fingerprint(path, chunk_size=1024 * 1024):
+    """Хэш содержимого файла (BLAKE2b, 128 бит)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _describe(path, data_dir, index_name, stat):
+    bbox, date_start, date_end = parse_file_name(path)
+    with rasterio.open(path) as src:
+        # Читается только заголовок растра
+        if bbox is None:
+            bbox = tuple(src.bounds)
+        region = "_".join(str(value) for value in bbox)
+        return CatalogEntry(
+            path, data_dir, index_name, region, *bbox, date_start, date_end,
+            src.height, src.width, src.count, src.dtypes[0], src.nodata,
+            src.crs.to_wkt() if src.crs else None, json.dumps(list(src.transform.to_gdal())),
+            stat.st_size, stat.st_mtime_ns, file_fingerprint(path))
+
+
+class RasterCatalog:
+    """
+    Каталог растров индексов в SQLite.
+
+    Для каждого файла хранятся папка индекса, тип индекса, регион из имени файла, даты,
+    размер, тип данных, CRS, геопривязка и хэш содержимого. update() перечитывает только
+    новые и измененные (по размеру и mtime) файлы, запросы к каталогу не открывают
+    растры. Каталог общий для всех папок индексов одной родительской папки, поэтому
+    запросы ограничиваются папками последнего update().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Папки индексов, к которым относятся запросы: {ИНДЕКС: абсолютный путь}
+        self.index_dirs = {}
+        self.connection = sqlite3.connect(path)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] not in (0, CATALOG_VERSION):
+            self.connection.execute("DROP TABLE IF EXISTS rasters")
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM rasters").fetchone()[0]
+
+    def update(self, index_dirs, progress=None):
+        """
+        Синхронизирует каталог с папками index_dirs ({индекс: папка}); записи отсутствующих
+        папок удаляются. Дальнейшие запросы относятся только к этим папкам.
+        Возвращает (число добавленных или обновленных записей, число удаленных).
+        progress(done, total, path) вызывается после каждого прочитанного файла.
+        """
+        self.index_dirs = {index_name.upper(): os.path.abspath(data_dir) for index_name, data_dir in index_dirs.items()}
+        known = {row[0]: row[1:] for row in self.connection.execute(
+            "SELECT path, data_dir, index_name, size, mtime_ns FROM rasters")}
+        present = set()
+        changed = []
+        for index_name, data_dir in self.index_dirs.items():
+            for path in list_rasters(data_dir):
+                path = os.path.abspath(path)
+                stat = os.stat(path)
+                present.add(path)
+                if known.get(path) != (data_dir, index_name, stat.st_size, stat.st_mtime_ns):
+                    changed.append((path, data_dir, index_name, stat))
+
+        # Удаляются записи только тех папок, которые синхронизируются
+        dirs = set(self.index_dirs.values())
+        removed = [path for path, (data_dir, *_) in known.items() if path not in present and data_dir in dirs]
+
+        with self.connection:
+            for done, (path, data_dir, index_name, stat) in enumerate(changed, start=1):
+                entry = _describe(path, data_dir, index_name, stat)
+                self.connection.execute(
+                    f"INSERT OR REPLACE INTO rasters VALUES ({', '.join('?' * len(_COLUMNS))})", entry)
+                if progress is not None:
+                    progress(done, len(changed), path)
+            self.connection.executemany("DELETE FROM rasters WHERE path = ?", [(path,) for path in removed])
+        return len(changed), len(removed)
+
+    def query(self, index=None, start=None, end=None, bbox=None, data_dir=None):
+        """
+        Записи, отсортированные по дате: index - тип индекса (NDVI, SAVI, SWIR),
+        start/end - границы периода (дата или строка YYYY-MM-DD), bbox - (запад, юг,
+        восток, север), с которым должен пересекаться регион файла. data_dir - папка
+        индекса; по умолчанию папка index (или все папки) последнего update().
+        """
+        conditions, params = [], []
+        if data_dir is None and index is not None:
+            data_dir = self.index_dirs.get(index.upper())
+        if data_dir is not None:
+            conditions.append("data_dir = ?")
+            params.append(os.path.abspath(data_dir))
+        elif self.index_dirs:
+            conditions.append(f"data_dir IN ({', '.join('?' * len(self.index_dirs))})")
+            params.extend(self.index_dirs.values())
+        if index is not None:
+            conditions.append("index_name = ?")
+            params.append(index.upper())
+        if start is not None:
+            conditions.append("date_end >= ?")
+            params.append(str(start)[:10])
+        if end is not None:
+            conditions.append("date_start <= ?")
+            params.append(str(end)[:10])
+        if bbox is not None:
+            west, south, east, north = bbox
+            conditions.append("west < ? AND east > ? AND south < ? AND north > ?")
+            params.extend([east, west, north, south])
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM rasters"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY index_name, date_end IS NULL, date_end, path"
+        return [CatalogEntry(*row) for row in self.connection.execute(sql, params)]
+
+    def paths(self, index=None, start=None, end=None, bbox=None, data_dir=None):
+        return [entry.path for entry in self.query(index, start, end, bbox, data_dir)]
+
+    def indices(self):
+        return sorted({entry.index_name for entry in self.query()})
+
+
+def open_catalog(root=".", index_dirs=None, update=True, progress=None):
+    """
+    Открывает каталог catalog.sqlite в папке кэша рядом с папками индексов index_dirs
+    (по умолчанию ndvi/, savi/ и swir/ внутри root) и, если update, синхронизирует его с ними.
+    """
+    if index_dirs is None:
+        index_dirs = {name: os.path.join(root, data_dir) for name, data_dir in INDEX_DIRS.items()}
+    if index_dirs:
+        # Как у кэша стеков: папка кэша - в родительской папке (первой) папки индекса
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(next(iter(index_dirs.values())))),
+                                 stack_cache.CACHE_DIR_NAME)
+    else:
+        cache_dir = os.path.join(root, stack_cache.CACHE_DIR_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    catalog = RasterCatalog(os.path.join(cache_dir, CATALOG_NAME))
+    if update:
+        catalog.update(index_dirs, progress)
+    else:
+        catalog.index_dirs = {name.upper(): os.path.abspath(d) for name, d in index_dirs.items()}
+    return catalog
+
+
+if __name__ == "__main__":
+    with open_catalog(progress=lambda done, total, path: print(f"[{done}/{total}] {path}")) as catalog:
+        for index_name in catalog.indices():
+            entries = catalog.query(index_name)
+            first, last = entries[0], entries[-1]
+            print(f"{index_name}: {len(entries)} файлов, {first.date_start} - {last.date_end}, "
+                  f"{first.height}x{first.width} {first.dtype}, регион {first.region}")
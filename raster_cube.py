@@ -0,0 +1,465 @@
+# raster_cube.py
+
+import os
+import re
+import math
+from functools import partial
+from datetime import datetime
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.windows import Window
+import stack_cache
+from profiling import profiled
+from parallel_reader import read_rasters_parallel
+
+# Пути к папкам с данными по умолчанию
+NDVI_DIR = "ndvi"
+SAVI_DIR = "savi"
+SWIR_DIR = "swir"
+INDEX_DIRS = {"NDVI": NDVI_DIR, "SAVI": SAVI_DIR, "SWIR": SWIR_DIR}
+
+# Нулевые значения во всех индексах означают отсутствие данных
+NODATA_VALUE = 0
+
+DATE_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2})")
+
+# Регион в имени файла: region_<запад>_<юг>_<восток>_<север>
+REGION_PATTERN = re.compile(r"region_(-?\d+(?:\.\d+)?)_(-?\d+(?:\.\d+)?)_(-?\d+(?:\.\d+)?)_(-?\d+(?:\.\d+)?)")
+
+# Кэш уже декодированных стеков в рамках процесса
+_STACK_CACHE = {}
+
+
+def extract_date(file_name):
+    """Извлекает дату съемки (последнюю дату в имени файла) или возвращает None."""
+    matches = DATE_PATTERN.findall(os.path.basename(file_name))
+    if not matches:
+        return None
+    return datetime.strptime(matches[-1], "%Y-%m-%d")
+
+
+def extract_region(file_name):
+    """Регион из имени файла в виде строки '<запад>_<юг>_<восток>_<север>' или None."""
+    match = REGION_PATTERN.search(os.path.basename(file_name))
+    return "_".join(match.groups()) if match else None
+
+
+def list_rasters(data_dir):
+    """Возвращает пути ко всем .tif файлам директории, отсортированные по дате."""
+    paths = []
+    for root, _, files in os.walk(data_dir):
+        for file in files:
+            if file.endswith('.tif'):
+                paths.append(os.path.join(root, file))
+    return sort_by_date(paths)
+
+
+def sort_by_date(paths):
+    """Сортирует пути по дате из имени файла, файлы без даты идут в конце."""
+    def key(path):
+        date = extract_date(path)
+        return (date is None, date or datetime.min, os.path.basename(path))
+    return sorted(paths, key=key)
+
+
+class IndexStack:
+    """
+    Временной ряд одного индекса: массив (время, строки, столбцы) в исходном типе данных,
+    даты съемок и профиль первого растра.
+    """
+
+    def __init__(self, name, files, dates, data, profile, window=None):
+        self.name = name
+        self.files = list(files)
+        self.dates = list(dates)
+        self.data = data
+        self.profile = profile
+        # Область файлов, из которой загружен стек (None - растр целиком)
+        self.window = window
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __repr__(self):
+        return f"IndexStack({self.name!r}, shape={self.data.shape}, dtype={self.data.dtype})"
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def file_names(self):
+        return [os.path.basename(path) if path else None for path in self.files]
+
+    @property
+    def mask(self):
+        """Маска отсутствующих данных (True там, где значение равно NODATA_VALUE)."""
+        return self.data == NODATA_VALUE
+
+    @property
+    def valid(self):
+        return self.data != NODATA_VALUE
+
+    def masked(self):
+        """Стек в виде маскированного массива без копирования данных."""
+        return np.ma.MaskedArray(self.data, mask=self.mask)
+
+    def to_float(self, dtype=np.float32):
+        """
+        Возвращает копию стека в формате с плавающей точкой с NaN вместо пропусков.
+        Нужна только ядрам, которые не умеют работать с маской.
+        """
+        data = self.data.astype(dtype)
+        data[self.mask] = np.nan
+        return data
+
+    def mean_series(self):
+        """Среднее значение индекса по валидным пикселям для каждой даты."""
+        counts = self.valid.sum(axis=(1, 2))
+        # Сумма по всем пикселям минус вклад пропусков, без копии стека
+        sums = self.data.sum(axis=(1, 2), dtype=np.float64)
+        sums -= float(NODATA_VALUE) * (self.data[0].size - counts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+
+@profiled('normalize', 'normalize')
+def normalize_index(data, mask=None):
+    """
+    Нормализует растр индекса к диапазону от -1 до 1 по минимуму и максимуму валидных значений.
+    Принимает данные в исходном типе, возвращает float32 с NaN на месте пропусков
+    (mask, по умолчанию data == NODATA_VALUE).
+    """
+    valid = data != NODATA_VALUE if mask is None else ~mask
+    result = np.full(data.shape, np.nan, dtype=np.float32)
+    values = data[valid]
+    if values.size == 0:
+        return result
+    max_val, min_val = float(values.max()), float(values.min())
+    if max_val == min_val:
+        return np.zeros(data.shape, dtype=np.float32)  # Если все значения одинаковы, возвращаем массив нулей
+    result[valid] = 2 * (values.astype(np.float32) - min_val) / (max_val - min_val) - 1
+    return result
+
+
+def window_from_bbox(transform, bbox, height, width):
+    """
+    Окно пикселей, покрывающее bbox (запад, юг, восток, север) в координатах растра
+    с геопривязкой transform, расширенное до целых пикселей и обрезанное границами
+    растра height x width. Поддерживаются растры без поворота.
+    """
+    if transform.b or transform.d:
+        raise ValueError("Растры с поворотом не поддерживаются.")
+    west, south, east, north = bbox
+    col0, col1 = sorted(((west - transform.c) / transform.a, (east - transform.c) / transform.a))
+    row0, row1 = sorted(((north - transform.f) / transform.e, (south - transform.f) / transform.e))
+    return clip_window((math.floor(col0), math.floor(row0),
+                        math.ceil(col1) - math.floor(col0), math.ceil(row1) - math.floor(row0)), height, width)
+
+
+def clip_window(window, height, width):
+    """Окно (Window или (столбец, строка, ширина, высота)), обрезанное границами растра."""
+    if not isinstance(window, Window):
+        window = Window(*window)
+    col0, row0 = max(0, int(window.col_off)), max(0, int(window.row_off))
+    col1 = min(width, int(window.col_off + window.width))
+    row1 = min(height, int(window.row_off + window.height))
+    if col1 <= col0 or row1 <= row0:
+        raise ValueError("Область не пересекается с растром.")
+    return Window(col0, row0, col1 - col0, row1 - row0)
+
+
+def window_profile(profile, window):
+    """Профиль растра для окна window: размер и геопривязка области."""
+    t = profile['transform']
+    profile = dict(profile)
+    profile.update(width=int(window.width), height=int(window.height), transform=Affine(
+        t.a, t.b, t.c + window.col_off * t.a + window.row_off * t.b,
+        t.d, t.e, t.f + window.col_off * t.d + window.row_off * t.e))
+    for key in ('blockxsize', 'blockysize', 'tiled'):
+        profile.pop(key, None)
+    return profile
+
+
+def resolve_window(path, window=None, bbox=None):
+    """
+    Окно области интереса для растров той же сетки, что и path: window - окно пикселей,
+    bbox - (запад, юг, восток, север) в координатах растра. Без области возвращает None.
+    """
+    if window is None and bbox is None:
+        return None
+    with rasterio.open(path) as src:
+        if bbox is not None:
+            return window_from_bbox(src.transform, bbox, src.height, src.width)
+        return clip_window(window, src.height, src.width)
+
+
+def _window_key(window):
+    return None if window is None else (int(window.col_off), int(window.row_off), int(window.width), int(window.height))
+
+
+class RasterCube:
+    """Набор стеков NDVI/SAVI/SWIR с общими датами, профилем и маской пропусков."""
+
+    def __init__(self, stacks):
+        self.stacks = dict(stacks)
+
+    def __getitem__(self, name):
+        return self.stacks[name.upper()]
+
+    def __contains__(self, name):
+        return name.upper() in self.stacks
+
+    def __iter__(self):
+        return iter(self.stacks.values())
+
+    @property
+    def names(self):
+        return list(self.stacks)
+
+    @property
+    def dates(self):
+        return next(iter(self.stacks.values())).dates
+
+    @property
+    def profile(self):
+        return next(iter(self.stacks.values())).profile
+
+    @property
+    def nodata_mask(self):
+        """Общая маска: True там, где хотя бы в одном индексе нет данных."""
+        shapes = {stack.shape for stack in self.stacks.values()}
+        if len(shapes) != 1:
+            raise ValueError("Размеры стеков индексов не совпадают.")
+        mask = None
+        for stack in self.stacks.values():
+            mask = stack.mask if mask is None else mask | stack.mask
+        return mask
+
+
+def _cache_key(paths):
+    key = []
+    for path in paths:
+        stat = os.stat(path)
+        key.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+    return tuple(key)
+
+
+def _read_header(path):
+    """Читает только заголовок растра: (высота, ширина, dtype, профиль)."""
+    with rasterio.open(path) as src:
+        return src.height, src.width, src.dtypes[0], src.profile
+
+
+@profiled('decode', 'decode')
+def _decode_into(paths, out, indices, workers=None, progress=None, window=None):
+    """Декодирует растры paths (или их окно window) в срезы out[indices] в пуле потоков."""
+    read_rasters_parallel(paths, out, indices, workers=workers, progress=progress, window=window)
+
+
+def _read_stack(paths, workers=None, progress=None, window=None):
+    """Декодирует список растров (или окно window каждого) в один массив (время, строки, столбцы)."""
+    height, width, dtype, profile = _read_header(paths[0])
+    if window is not None:
+        profile = window_profile(profile, window)
+        height, width = profile['height'], profile['width']
+    data = np.empty((len(paths), height, width), dtype=dtype)
+    _decode_into(paths, data, range(len(paths)), workers, progress, window)
+    return data, profile
+
+
+@profiled('load', 'load')
+def load_stack_from_files(paths, name=None, use_disk_cache=True, workers=None, progress=None,
+                          window=None, bbox=None):
+    """
+    Загружает стек индекса из списка файлов. Каждый набор файлов декодируется
+    один раз за процесс, повторные вызовы возвращают тот же объект.
+    С use_disk_cache стек хранится на диске (см. stack_cache) и открывается через memmap.
+    Файлы декодируются параллельно в workers потоках, progress(done, total, path)
+    вызывается после каждого прочитанного файла.
+
+    window (окно пикселей) или bbox (запад, юг, восток, север) ограничивают стек
+    областью интереса: из каждого файла читаются только пересекающиеся с ней блоки,
+    а профиль стека описывает область. Такие стеки не сохраняются в кэш на диске.
+    """
+    paths = sort_by_date(paths)
+    if not paths:
+        raise ValueError("Не найдено ни одного растрового файла.")
+    window = resolve_window(paths[0], window, bbox)
+    files_key = _cache_key(paths)
+    key = (files_key, _window_key(window))
+    stack = _STACK_CACHE.get(key)
+    if stack is None and window is not None:
+        full = _STACK_CACHE.get((files_key, None))
+        if full is not None:
+            # Стек целиком уже декодирован: область берется из него без чтения файлов
+            rows = slice(window.row_off, window.row_off + window.height)
+            cols = slice(window.col_off, window.col_off + window.width)
+            stack = IndexStack(full.name, paths, full.dates, full.data[:, rows, cols],
+                               window_profile(full.profile, window), window)
+            _STACK_CACHE[key] = stack
+    if stack is None and window is not None:
+        data, profile = _read_stack(paths, workers, progress, window)
+        stack = IndexStack(name, paths, [extract_date(path) for path in paths], data, profile, window)
+        _STACK_CACHE[key] = stack
+    if stack is None:
+        data = None
+        if use_disk_cache:
+            try:
+                decode = partial(_decode_into, workers=workers, progress=progress)
+                data, profile = stack_cache.load_cached_stack(paths, name, _read_header, decode,
+                                                             extract_region(paths[0]))
+            except OSError:
+                # Папка кэша недоступна для записи: декодируем в память
+                data = None
+        if data is None:
+            data, profile = _read_stack(paths, workers, progress)
+        dates = [extract_date(path) for path in paths]
+        stack = IndexStack(name, paths, dates, data, profile)
+        _STACK_CACHE[key] = stack
+    elif name is not None and stack.name != name:
+        # Те же файлы под другим именем: переиспользуем декодированный массив
+        stack = IndexStack(name, stack.files, stack.dates, stack.data, stack.profile, stack.window)
+    return stack
+
+
+def load_stack(data_dir, name=None, use_disk_cache=True, workers=None, progress=None, window=None, bbox=None):
+    """Загружает стек индекса из всех .tif файлов директории (или их области window/bbox)."""
+    if name is None:
+        name = os.path.basename(os.path.normpath(data_dir)).upper()
+    return load_stack_from_files(list_rasters(data_dir), name, use_disk_cache, workers, progress, window, bbox)
+
+
+def load_cube(ndvi_dir=NDVI_DIR, savi_dir=SAVI_DIR, swir_dir=SWIR_DIR, use_disk_cache=True,
+              workers=None, progress=None, window=None, bbox=None):
+    """Загружает стеки NDVI, SAVI и SWIR (или их область window/bbox) в один RasterCube."""
+    dirs = {"NDVI": ndvi_dir, "SAVI": savi_dir, "SWIR": swir_dir}
+    return RasterCube({
+        name: load_stack(path, name, use_disk_cache, workers, progress, window, bbox)
+        for name, path in dirs.items() if path
+    })
+
+
+class AlignedIndices:
+    """
+    Несколько индексов, выровненных по дате съемки.
+
+    how='inner' оставляет только даты, которые есть у всех индексов; how='outer' -
+    все даты, а отсутствующие месяцы индекса заполняются NODATA_VALUE и отмечаются
+    в missing_mask(). Стек индекса загружается при первом обращении, и декодируются
+    только файлы выбранных дат. window или bbox ограничивают все стеки одной областью интереса.
+    """
+
+    def __init__(self, files_by_index, how='inner', use_disk_cache=True, workers=None, progress=None,
+                 window=None, bbox=None):
+        if how not in ('inner', 'outer'):
+            raise ValueError("how должен быть 'inner' или 'outer'.")
+        self.how = how
+        self.use_disk_cache = use_disk_cache
+        self.workers = workers
+        self.progress = progress
+        self.window = window
+        self.bbox = bbox
+        self._files = {}
+        for name, paths in files_by_index.items():
+            by_date = {}
+            for path in paths:
+                date = extract_date(path)
+                if date is None:
+                    continue
+                if date in by_date:
+                    raise ValueError(f"Для {name} найдено несколько файлов за {date:%Y-%m-%d}: "
+                                     f"{by_date[date]}, {path}")
+                by_date[date] = path
+            self._files[name.upper()] = by_date
+        date_sets = [set(by_date) for by_date in self._files.values()]
+        if not date_sets:
+            dates = set()
+        elif how == 'inner':
+            dates = set.intersection(*date_sets)
+        else:
+            dates = set.union(*date_sets)
+        self.dates = sorted(dates)
+        self._stacks = {}
+
+    def __getitem__(self, name):
+        return self.stack(name)
+
+    @property
+    def names(self):
+        return list(self._files)
+
+    def files(self, name):
+        """Файлы индекса по выровненным датам (None для отсутствующих месяцев)."""
+        by_date = self._files[name.upper()]
+        return [by_date.get(date) for date in self.dates]
+
+    def missing_mask(self, name):
+        """Булев массив по датам: True - месяца нет в архиве индекса."""
+        return np.array([path is None for path in self.files(name)], dtype=bool)
+
+    def dropped_dates(self, name):
+        """Даты индекса, не вошедшие в выравнивание (только для how='inner')."""
+        return sorted(set(self._files[name.upper()]) - set(self.dates))
+
+    def stack(self, name):
+        """IndexStack индекса с одним срезом на каждую выровненную дату."""
+        name = name.upper()
+        stack = self._stacks.get(name)
+        if stack is None:
+            stack = self._load(name)
+            self._stacks[name] = stack
+        return stack
+
+    @profiled('stack', 'stack')
+    def _load(self, name):
+        files = self.files(name)
+        present = [path for path in files if path is not None]
+        if not present:
+            raise ValueError(f"Нет файлов {name} за выбранные даты.")
+        window = resolve_window(present[0], self.window, self.bbox)
+        loaded = _cached_subset(present, name, window)
+        if loaded is None:
+            loaded = load_stack_from_files(present, name, self.use_disk_cache, self.workers, self.progress, window)
+        if len(present) == len(files):
+            return loaded
+        # Внешнее соединение: отсутствующие месяцы заполняются значением пропуска
+        data = np.full((len(files),) + loaded.shape[1:], NODATA_VALUE, dtype=loaded.data.dtype)
+        data[[i for i, path in enumerate(files) if path is not None]] = loaded.data
+        return IndexStack(name, files, list(self.dates), data, loaded.profile, loaded.window)
+
+
+def _cached_subset(paths, name, window=None):
+    """
+    Стек из уже декодированного в процессе стека, содержащего все файлы paths
+    (для окна window - той же области или растров целиком), или None.
+    """
+    key = _cache_key(sort_by_date(paths))
+    window_key = _window_key(window)
+    if (key, window_key) in _STACK_CACHE:
+        return None
+    wanted = set(key)
+    for (cached_key, cached_window), stack in _STACK_CACHE.items():
+        if cached_window not in (window_key, None) or not wanted <= set(cached_key):
+            continue
+        positions = {item: i for i, item in enumerate(cached_key)}
+        indices = [positions[item] for item in key]
+        data, profile = stack.data[indices], stack.profile
+        if window_key is not None and cached_window is None:
+            data = data[:, window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width]
+            profile = window_profile(profile, window)
+        return IndexStack(name, [item[0] for item in key], [stack.dates[i] for i in indices],
+                          data, profile, window)
+    return None
+
+
+def align_indices(index_dirs, how='inner', use_disk_cache=True, workers=None, progress=None, window=None, bbox=None):
+    """Выравнивает по датам индексы из папок index_dirs ({индекс: папка}) в области window/bbox."""
+    return AlignedIndices({name: list_rasters(data_dir) for name, data_dir in index_dirs.items()},
+                          how, use_disk_cache, workers, progress, window, bbox)
+
+
+def clear_cache():
+    """Очищает кэш декодированных стеков."""
+    _STACK_CACHE.clear()
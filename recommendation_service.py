@@ -0,0 +1,320 @@
+# recommendation_service.py
+
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+import numpy as np
+from planting_recommendations import CLASS_MAPPING, mlp_model, recommendation_for
+
+# Окно ожидания, в течение которого одновременные запросы объединяются в один вызов модели
+DEFAULT_MAX_DELAY = 0.002
+
+# Максимальное число точек в одном вызове модели
+DEFAULT_MAX_BATCH = 65536
+
+# Шаг квантования индексов для ключей кэша; классифицируется квантованная точка,
+# поэтому ответ не зависит от того, была ли точка в кэше
+DEFAULT_QUANTUM = 1e-3
+
+DEFAULT_CACHE_SIZE = 100000
+
+# Очередь входящих соединений: клиенты открывают много соединений одновременно
+LISTEN_BACKLOG = 1024
+
+# Число последних запросов для расчета перцентилей задержки
+LATENCY_WINDOW = 10000
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+# Тип земель и рекомендация для каждого кода класса
+ANSWERS = {code: (land_type, recommendation_for(land_type)) for code, land_type in CLASS_MAPPING.items()}
+
+
+class LRUCache:
+    """Кэш кодов классов по квантованной тройке индексов с вытеснением давно не использованных."""
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+class ServiceStats:
+    """Счетчики запросов, точек, пакетов, попаданий в кэш и задержек."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.points = 0
+        self.batches = 0
+        self.batched_points = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record_request(self, n_points, latency):
+        self.requests += 1
+        self.points += n_points
+        self.latencies.append(latency)
+
+    def record_batch(self, n_points):
+        self.batches += 1
+        self.batched_points += n_points
+
+    def snapshot(self):
+        uptime = time.perf_counter() - self.started
+        latencies_ms = np.array(self.latencies) * 1000
+        percentiles = {}
+        if latencies_ms.size:
+            for q in (50, 95, 99):
+                percentiles[f'p{q}'] = float(np.percentile(latencies_ms, q))
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'uptime_s': uptime,
+            'requests': self.requests,
+            'points': self.points,
+            'errors': self.errors,
+            'requests_per_s': self.requests / uptime if uptime else 0.0,
+            'points_per_s': self.points / uptime if uptime else 0.0,
+            'batches': self.batches,
+            'mean_batch_size': self.batched_points / self.batches if self.batches else 0.0,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_hit_rate': self.cache_hits / lookups if lookups else 0.0,
+            'latency_ms': percentiles,
+        }
+
+
+class MicroBatcher:
+    """
+    Собирает точки из одновременных запросов и классифицирует их одним вызовом модели.
+
+    Пакет отправляется, когда с момента первой точки прошло max_delay секунд или
+    набралось max_batch точек. Модель выполняется в пуле потоков цикла событий,
+    чтобы прием новых запросов не останавливался.
+    """
+
+    def __init__(self, model, stats, max_delay=DEFAULT_MAX_DELAY, max_batch=DEFAULT_MAX_BATCH):
+        self.model = model
+        self.stats = stats
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._pending = []
+        self._pending_points = 0
+        self._flush_handle = None
+
+    async def classify(self, points):
+        """Коды классов для массива точек (N, 3) float32."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((points, future))
+        self._pending_points += len(points)
+        if self._pending_points >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending, self._pending_points = self._pending, [], 0
+        if pending:
+            asyncio.get_running_loop().create_task(self._run_batch(pending))
+
+    async def _run_batch(self, pending):
+        features = np.concatenate([points for points, _ in pending])
+        self.stats.record_batch(len(features))
+        try:
+            classes = await asyncio.get_running_loop().run_in_executor(None, self.model.predict, features)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        start = 0
+        for points, future in pending:
+            if not future.done():
+                future.set_result(classes[start:start + len(points)])
+            start += len(points)
+
+
+class RecommendationService:
+    """Классификация точек с кэшем квантованных троек индексов и объединением запросов в пакеты."""
+
+    def __init__(self, model=mlp_model, quantum=DEFAULT_QUANTUM, cache_size=DEFAULT_CACHE_SIZE,
+                 max_delay=DEFAULT_MAX_DELAY, max_batch=DEFAULT_MAX_BATCH):
+        self.quantum = quantum
+        self.stats = ServiceStats()
+        self.cache = LRUCache(cache_size)
+        self.batcher = MicroBatcher(model, self.stats, max_delay, max_batch)
+
+    async def recommend(self, points):
+        """
+        Принимает массив точек (N, 3) в порядке NDVI, SAVI, SWIR и возвращает
+        список словарей с кодом класса, типом земель и рекомендацией.
+        """
+        started = time.perf_counter()
+        keys = np.round(np.asarray(points, dtype=np.float64) / self.quantum).astype(np.int64)
+        key_tuples = [tuple(key) for key in keys.tolist()]
+        codes = [self.cache.get(key) for key in key_tuples]
+        missing = [i for i, code in enumerate(codes) if code is None]
+        self.stats.cache_hits += len(codes) - len(missing)
+        self.stats.cache_misses += len(missing)
+
+        if missing:
+            # Повторяющиеся в запросе точки классифицируются один раз
+            unique = list(dict.fromkeys(key_tuples[i] for i in missing))
+            features = (np.array(unique, dtype=np.float64) * self.quantum).astype(np.float32)
+            classes = await self.batcher.classify(features)
+            for key, code in zip(unique, classes.tolist()):
+                self.cache.put(key, code)
+            resolved = dict(zip(unique, classes.tolist()))
+            for i in missing:
+                codes[i] = resolved[key_tuples[i]]
+
+        results = []
+        for code in codes:
+            land_type, recommendation = ANSWERS.get(code, (None, recommendation_for(None)))
+            results.append({'class': code, 'land_type': land_type, 'recommendation': recommendation})
+        self.stats.record_request(len(results), time.perf_counter() - started)
+        return results
+
+
+def parse_points(payload):
+    """
+    Точки из тела запроса: {"ndvi": .., "savi": .., "swir": ..} для одной точки
+    или {"points": [[ndvi, savi, swir], ...]} для массива.
+    """
+    if 'points' in payload:
+        points = np.asarray(payload['points'], dtype=np.float64)
+        if points.size == 0:
+            points = points.reshape(0, 3)
+        single = False
+    else:
+        points = np.array([[payload['ndvi'], payload['savi'], payload['swir']]], dtype=np.float64)
+        single = True
+    if points.ndim != 2 or points.shape[1] != 3 or not np.isfinite(points).all():
+        raise ValueError("Ожидаются конечные тройки значений (NDVI, SAVI, SWIR).")
+    return points, single
+
+
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError("Слишком большой запрос.")
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+
+def _write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+    head = (f"HTTP/1.1 {status} {reasons[status]}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + body)
+
+
+def make_handler(service):
+    """
+    Обработчик HTTP/1.1 соединений для asyncio.start_server и start_unix_server:
+    POST /recommend - классификация и рекомендации, GET /stats - счетчики сервиса.
+    """
+    async def handle(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    _write_response(writer, 400, {'error': "Некорректный запрос."}, False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                try:
+                    if method == 'GET' and path == '/stats':
+                        status, payload = 200, service.stats.snapshot()
+                    elif method == 'POST' and path == '/recommend':
+                        points, single = parse_points(json.loads(body or b'{}'))
+                        results = await service.recommend(points)
+                        status, payload = 200, results[0] if single else {'results': results}
+                    else:
+                        status, payload = 404, {'error': "Неизвестный путь."}
+                except (ValueError, KeyError, TypeError) as e:
+                    service.stats.errors += 1
+                    status, payload = 400, {'error': str(e)}
+                except Exception as e:
+                    service.stats.errors += 1
+                    status, payload = 500, {'error': str(e)}
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+async def serve(host='127.0.0.1', port=8765, unix_path=None, **options):
+    """Запускает сервис на TCP-порту или Unix-сокете и обслуживает запросы до остановки."""
+    service = RecommendationService(**options)
+    handler = make_handler(service)
+    if unix_path:
+        server = await asyncio.start_unix_server(handler, path=unix_path, backlog=LISTEN_BACKLOG)
+        print(f"Сервис рекомендаций слушает Unix-сокет {unix_path}")
+    else:
+        server = await asyncio.start_server(handler, host, port, backlog=LISTEN_BACKLOG)
+        print(f"Сервис рекомендаций слушает http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сервис рекомендаций по посадке")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help="путь к Unix-сокету вместо TCP-порта")
+    parser.add_argument('--max-delay', type=float, default=DEFAULT_MAX_DELAY, help="окно объединения запросов, с")
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument('--quantum', type=float, default=DEFAULT_QUANTUM)
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, quantum=args.quantum, cache_size=args.cache_size,
+                          max_delay=args.max_delay, max_batch=args.max_batch))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,412 @@
+# region_scheduler.py
+"""
+Обработка архива из нескольких соседних регионов.
+
+Регионы определяются по охвату в именах файлов (region_<запад>_<юг>_<восток>_<север>),
+у каждого свой временной ряд NDVI, SAVI и SWIR. Цепочка команд terravision выполняется
+для каждого региона отдельным заданием в пуле процессов, после чего растровые результаты
+регионов сшиваются в общие GeoTIFF, а таблицы объединяются с указанием региона.
+
+Каждое задание рассчитано на бюджет памяти одного процесса: число процессов ограничено
+свободной памятью, а регион, стеки которого не помещаются в бюджет, обрабатывается
+полосами строк (окнами, см. raster_cube.resolve_window). Результаты задания хранятся
+в output_dir/regions/<задание>/ вместе с отметкой о завершении, поэтому повторный запуск
+выполняет только упавшие или изменившиеся задания и заново сшивает результаты.
+
+    python terravision.py --regions --processes 4 --memory-budget 2048 stats + correlate + classify
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.windows import Window
+import profiling
+from raster_catalog import open_catalog
+from raster_cube import resolve_window
+from terravision import COMMANDS, INDEX_NAMES, Session
+
+# Бюджет памяти одного процесса по умолчанию, МБ
+DEFAULT_MEMORY_BUDGET_MB = 1024
+
+# Сколько раз повторяется упавшее задание в том же запуске
+DEFAULT_RETRIES = 1
+
+# Команды, сводящие регион к таблицам по датам: они не делятся на полосы
+TABLE_COMMANDS = ('trend', 'forecast', 'recommend')
+
+# Общие параметры, не влияющие на результаты задания
+SCHEDULER_OPTIONS = ('regions', 'processes', 'memory_budget', 'retries', 'profile', 'workers', 'output_dir')
+
+# Папка результатов заданий внутри output_dir и отметка о завершении задания
+REGIONS_DIR = "regions"
+DONE_FILE = "done.json"
+
+# Число строк общего растра, собираемых за один шаг сшивки
+MOSAIC_BLOCK_ROWS = 1024
+
+
+class Region(namedtuple('Region', 'name bbox files height width dtype')):
+    """Регион архива: охват, файлы индексов за период ({индекс: пути}) и размер растров."""
+
+    def stack_bytes(self, rows=None):
+        """Объем стеков всех индексов региона (или полосы из rows строк) в исходном типе."""
+        rows = self.height if rows is None else rows
+        itemsize = np.dtype(self.dtype).itemsize
+        return sum(len(paths) for paths in self.files.values()) * rows * self.width * itemsize
+
+
+Job = namedtuple('Job', 'name region window settings steps output_dir')
+
+
+def discover_regions(index_dirs, start=None, end=None, bbox=None):
+    """
+    Регионы папок index_dirs ({индекс: папка}) по каталогу растров: файлы за период
+    [start, end], сгруппированные по охвату из имени. bbox оставляет регионы,
+    пересекающиеся с ним. Возвращает список Region, упорядоченный с северо-запада.
+    """
+    regions = {}
+    with open_catalog(index_dirs=index_dirs) as catalog:
+        for name in index_dirs:
+            for entry in catalog.query(name, start, end, bbox):
+                if entry.date_end is None:
+                    continue
+                region = regions.setdefault(entry.region, {
+                    'bbox': entry.bbox, 'files': {}, 'shape': entry.shape, 'dtype': entry.dtype})
+                if entry.shape != region['shape']:
+                    raise ValueError(f"Размер растра {entry.path} не совпадает с другими файлами региона "
+                                     f"{entry.region}.")
+                region['files'].setdefault(name.upper(), []).append(entry.path)
+    result = [Region(name, info['bbox'], info['files'], *info['shape'], info['dtype'])
+              for name, info in regions.items()]
+    return sorted(result, key=lambda region: (-region.bbox[3], region.bbox[0]))
+
+
+def job_bytes(region, rows=None):
+    """Оценка памяти задания: стеки всех индексов и одна копия стека индекса во float32."""
+    rows = region.height if rows is None else rows
+    months = max(len(paths) for paths in region.files.values())
+    return region.stack_bytes(rows) + months * rows * region.width * 4
+
+
+def plan_jobs(regions, settings, steps, output_dir, memory_budget):
+    """
+    Задания для регионов. Регион, не помещающийся в memory_budget байт, обрабатывается
+    полосами строк; команды из TABLE_COMMANDS для него выполняются отдельным заданием
+    по региону целиком.
+    """
+    jobs = []
+    for region in regions:
+        window = None
+        if settings.bbox:
+            window = resolve_window(next(iter(region.files.values()))[0], bbox=settings.bbox)
+        if window is None:
+            window = Window(0, 0, region.width, region.height)
+        full = None if (window.width, window.height) == (region.width, region.height) else window
+        raster_steps = [step for step in steps if step.command not in TABLE_COMMANDS]
+        cost = job_bytes(region, int(window.height))
+        if cost <= memory_budget or not raster_steps:
+            jobs.append(Job(region.name, region, full, settings, steps, output_dir))
+            continue
+        table_steps = [step for step in steps if step.command in TABLE_COMMANDS]
+        if table_steps:
+            jobs.append(Job(region.name, region, full, settings, table_steps, output_dir))
+        band_rows = max(1, int(window.height) * memory_budget // cost)
+        for row in range(0, int(window.height), band_rows):
+            rows = min(band_rows, int(window.height) - row)
+            band = Window(window.col_off, window.row_off + row, window.width, rows)
+            jobs.append(Job(f"{region.name}_rows_{band.row_off}_{band.row_off + rows}", region, band,
+                            settings, raster_steps, output_dir))
+    return jobs
+
+
+def job_dir(job):
+    return os.path.join(job.output_dir, REGIONS_DIR, job.name)
+
+
+def job_signature(job):
+    """Хэш входных файлов (путь, размер, mtime), окна и параметров задания."""
+    files = {name: [[path, os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in paths]
+             for name, paths in job.region.files.items()}
+    window = None if job.window is None else [int(job.window.col_off), int(job.window.row_off),
+                                               int(job.window.width), int(job.window.height)]
+    steps = [{key: value for key, value in vars(step).items() if key not in SCHEDULER_OPTIONS} for step in job.steps]
+    payload = json.dumps([files, window, steps], default=str, sort_keys=True)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def completed_outputs(job):
+    """Результаты задания, если оно уже выполнено с теми же входными данными, иначе None."""
+    try:
+        with open(os.path.join(job_dir(job), DONE_FILE), encoding='utf-8') as f:
+            done = json.load(f)
+    except (OSError, ValueError):
+        return None
+    outputs = [os.path.join(job_dir(job), path) for path in done.get('outputs', [])]
+    if done.get('signature') != job_signature(job) or not all(os.path.exists(path) for path in outputs):
+        return None
+    return outputs
+
+
+class RegionSession(Session):
+    """Сессия terravision для одного региона: файлы индексов заданы списком, а не папкой."""
+
+    def __init__(self, args, files):
+        super().__init__(args)
+        self.region_files = files
+
+    def files(self, name):
+        if name not in self.region_files:
+            raise ValueError(f"Нет файлов {name} в регионе.")
+        return self.region_files[name]
+
+
+def run_job(job, threads=None):
+    """Выполняет цепочку команд задания в текущем процессе. Возвращает (пути, время, пиковый RSS)."""
+    from raster_cube import clear_cache
+    started = time.perf_counter()
+    directory = job_dir(job)
+    args = argparse.Namespace(**vars(job.settings))
+    args.output_dir = directory
+    args.workers = job.settings.workers or threads
+    # Задание уже занимает процесс пула: прогноз по пикселям (forecast --maps) выполняется в нем же
+    args.processes = 1
+    args.bbox = None
+    args.window = job.window
+    session = RegionSession(args, job.region.files)
+    outputs = []
+    try:
+        for step in job.steps:
+            outputs.extend(COMMANDS[step.command](session, step))
+    finally:
+        # Стеки региона больше не нужны: память освобождается для следующего задания процесса
+        clear_cache()
+    done = {'signature': job_signature(job), 'outputs': [os.path.relpath(path, directory) for path in outputs]}
+    tmp_path = os.path.join(directory, f"{DONE_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(done, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(directory, DONE_FILE))
+    return outputs, time.perf_counter() - started, profiling.peak_rss()
+
+
+def available_memory():
+    """Свободная физическая память в байтах (None, если недоступна)."""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def process_count(jobs, processes=None, memory_budget=None):
+    """Число процессов: не больше ядер, заданий и числа бюджетов памяти, помещающихся в свободную память."""
+    count = processes or os.cpu_count() or 1
+    memory = available_memory()
+    if memory_budget and memory:
+        count = min(count, max(1, memory // memory_budget))
+    return max(1, min(count, len(jobs)))
+
+
+def run_jobs(jobs, processes, retries=DEFAULT_RETRIES, progress=None):
+    """
+    Выполняет задания в пуле процессов. Упавшее задание повторяется до retries раз,
+    остальные при этом не перезапускаются. Если процесс пула завершился аварийно, все
+    незавершенные задания этого пула выполняются заново по одному, без учета попытки:
+    попыткой считается только сбой задания, выполнявшегося в пуле одним.
+    Возвращает ({задание: (пути, время, RSS)}, {задание: ошибка}).
+    """
+    threads = max(1, (os.cpu_count() or 1) // processes)
+    context = multiprocessing.get_context('spawn')
+    attempts = {}
+    results, errors = {}, {}
+    pending = list(jobs)
+    # Задания из сломанного пула: неизвестно, какое из них его сломало
+    isolated = []
+    while pending or isolated:
+        if pending:
+            batch, pending = pending, []
+        else:
+            batch, isolated = isolated[:1], isolated[1:]
+        with ProcessPoolExecutor(max_workers=min(processes, len(batch)), mp_context=context) as executor:
+            futures = {executor.submit(run_job, job, threads): job for job in batch}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    results[job.name] = future.result()
+                    errors.pop(job.name, None)
+                except BrokenProcessPool:
+                    if len(batch) > 1:
+                        isolated.append(job)
+                        continue
+                    attempts[job.name] = attempts.get(job.name, 0) + 1
+                    errors[job.name] = "Процесс задания завершился аварийно"
+                    if attempts[job.name] <= retries:
+                        isolated.append(job)
+                except Exception as exc:
+                    attempts[job.name] = attempts.get(job.name, 0) + 1
+                    errors[job.name] = f"{type(exc).__name__}: {exc}"
+                    if attempts[job.name] <= retries:
+                        pending.append(job)
+                if progress is not None:
+                    progress(job, errors.get(job.name), attempts.get(job.name, 0))
+    return results, errors
+
+
+def _same(a, b):
+    return abs(a - b) <= 1e-6 * max(abs(a), abs(b), 1.0)
+
+
+def mosaic_rasters(paths, output_path, block_rows=MOSAIC_BLOCK_ROWS):
+    """
+    Сшивает растры одной сетки (одинаковые CRS, разрешение, тип и число каналов, сдвиг
+    на целое число пикселей) в общий GeoTIFF. Общий растр пишется полосами по block_rows строк, поэтому
+    память не зависит от его размера. В перекрытиях сохраняется первый валидный пиксель.
+    """
+    with ExitStack() as stack:
+        sources = [stack.enter_context(rasterio.open(path)) for path in paths]
+        first = sources[0]
+        t = first.transform
+        for src in sources[1:]:
+            if (src.crs != first.crs or src.dtypes[0] != first.dtypes[0] or src.count != first.count
+                    or not _same(src.transform.a, t.a)
+                    or not _same(src.transform.e, t.e) or src.transform.b or src.transform.d):
+                raise ValueError(f"Растр {src.name} не совпадает по сетке с {first.name}.")
+        west = min(src.transform.c for src in sources)
+        north = max(src.transform.f for src in sources)
+        east = max(src.transform.c + src.width * t.a for src in sources)
+        south = min(src.transform.f + src.height * t.e for src in sources)
+        width, height = round((east - west) / t.a), round((south - north) / t.e)
+        placements = []
+        for src in sources:
+            col, row = (src.transform.c - west) / t.a, (src.transform.f - north) / t.e
+            if not _same(col, round(col)) or not _same(row, round(row)):
+                raise ValueError(f"Растр {src.name} сдвинут относительно сетки на долю пикселя.")
+            placements.append((src, round(row), round(col)))
+
+        nodata = first.nodata
+        dtype = np.dtype(first.dtypes[0])
+        if nodata is not None and np.isnan(nodata):
+            is_empty = np.isnan
+        elif nodata is not None:
+            def is_empty(values):
+                return values == nodata
+        else:
+            is_empty = None
+        profile = first.profile.copy()
+        for key in ('blockxsize', 'blockysize', 'tiled', 'interleave'):
+            profile.pop(key, None)
+        profile.update(driver='GTiff', width=width, height=height, compress='deflate', BIGTIFF='IF_SAFER',
+                       transform=Affine(t.a, 0.0, west, 0.0, t.e, north))
+        with profiling.stage('mosaic', 'write', path=output_path), \
+                rasterio.open(output_path, 'w', **profile) as dst:
+            for row0 in range(0, height, block_rows):
+                rows = min(block_rows, height - row0)
+                block = np.full((first.count, rows, width), 0 if nodata is None else nodata, dtype=dtype)
+                filled = np.zeros(block.shape, dtype=bool)
+                for src, row, col in placements:
+                    top, bottom = max(row0, row), min(row0 + rows, row + src.height)
+                    if top >= bottom:
+                        continue
+                    data = src.read(window=Window(0, top - row, src.width, bottom - top))
+                    profiling.count_read(data.nbytes)
+                    target = (slice(None), slice(top - row0, bottom - row0), slice(col, col + src.width))
+                    take = ~filled[target]
+                    if is_empty is not None:
+                        take &= ~is_empty(data)
+                    block[target][take] = data[take]
+                    filled[target] |= take
+                dst.write(block, window=Window(0, row0, width, rows))
+    return output_path
+
+
+def merge_tables(tables, output_path):
+    """Объединяет CSV заданий [(задание, путь)] в одну таблицу со столбцами региона и строк."""
+    header, rows = None, []
+    for job, path in tables:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            table_header = next(reader)
+            if header is None:
+                header = table_header
+            elif table_header != header:
+                raise ValueError(f"Столбцы таблицы {path} не совпадают с другими регионами.")
+            window = job.window
+            row_range = "" if window is None else f"{window.row_off}-{window.row_off + window.height}"
+            rows.extend([job.region.name, row_range] + row for row in reader)
+    with open(output_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Регион', 'Строки'] + header)
+        writer.writerows(rows)
+    return output_path
+
+
+def mosaic_outputs(jobs, results, output_dir):
+    """
+    Сшивает одноименные GeoTIFF выполненных заданий и объединяет их CSV в output_dir.
+    Графики (PNG) остаются только в папках заданий.
+    """
+    products = {}
+    for job in jobs:
+        if job.name not in results:
+            continue
+        for path in results[job.name][0]:
+            products.setdefault(os.path.relpath(path, job_dir(job)), []).append((job, path))
+    outputs = []
+    for product, items in sorted(products.items()):
+        output_path = os.path.join(output_dir, product)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if product.endswith('.tif'):
+            outputs.append(mosaic_rasters([path for _, path in items], output_path))
+        elif product.endswith('.csv'):
+            outputs.append(merge_tables(items, output_path))
+    return outputs
+
+
+def run_regions(settings, steps, progress=None):
+    """
+    Выполняет цепочку команд steps (разобранные аргументы terravision, settings - общие
+    параметры) для всех регионов и сшивает результаты в settings.output_dir.
+    Возвращает словарь с заданиями, ошибками и путями общих результатов.
+    """
+    index_dirs = {'NDVI': settings.ndvi_dir, 'SAVI': settings.savi_dir, 'SWIR': settings.swir_dir}
+    index_dirs = {name: path for name, path in index_dirs.items() if name in INDEX_NAMES and os.path.isdir(path)}
+    regions = discover_regions(index_dirs, settings.start, settings.end, settings.bbox)
+    if not regions:
+        raise ValueError("Не найдено ни одного региона за выбранный период.")
+    memory_budget = (settings.memory_budget or DEFAULT_MEMORY_BUDGET_MB) * 1024 * 1024
+    jobs = plan_jobs(regions, settings, steps, settings.output_dir, memory_budget)
+
+    results = {}
+    todo = []
+    for job in jobs:
+        outputs = completed_outputs(job)
+        if outputs is None:
+            todo.append(job)
+        else:
+            results[job.name] = (outputs, 0.0, None)
+    if progress is not None:
+        progress(f"Регионов: {len(regions)}, заданий: {len(jobs)}, уже выполнено: {len(jobs) - len(todo)}")
+
+    errors = {}
+    if todo:
+        processes = process_count(todo, settings.processes, memory_budget)
+        if progress is not None:
+            progress(f"Процессов: {processes}, бюджет памяти: {memory_budget // (1024 * 1024)} МБ на процесс")
+
+        def report(job, error, attempt):
+            if progress is not None:
+                progress(f"  {job.name}: " + ("готово" if error is None else f"ошибка (попытка {attempt}): {error}"))
+
+        done, errors = run_jobs(todo, processes, settings.retries, report)
+        results.update(done)
+    outputs = mosaic_outputs(jobs, results, settings.output_dir)
+    return {'regions': regions, 'jobs': jobs, 'results': results, 'errors': errors, 'outputs': outputs}
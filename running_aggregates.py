@@ -0,0 +1,246 @@
+# running_aggregates.py
+
+import os
+import json
+import threading
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+import profiling
+import stack_cache
+from raster_cube import NODATA_VALUE, extract_date, extract_region, list_rasters
+
+STATE_VERSION = 1
+
+
+def _date_key(date):
+    return np.datetime64(date, 'D')
+
+
+class WelfordAggregates:
+    """
+    Попиксельные число валидных месяцев, среднее и сумма квадратов отклонений M2
+    (алгоритм Уэлфорда) одного индекса. Месяц добавляется за один проход по растру;
+    значения в исходных единицах растра, пропуски (NODATA_VALUE) не учитываются.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.count = np.zeros(self.shape, dtype=np.uint16)
+        self.mean_values = np.zeros(self.shape, dtype=np.float64)
+        self.m2 = np.zeros(self.shape, dtype=np.float64)
+        # Учтенные месяцы: дата (ISO) -> подпись файла [путь, размер, mtime_ns]
+        self.months = {}
+
+    def __len__(self):
+        return len(self.months)
+
+    def _check(self, raster):
+        raster = np.asarray(raster)
+        if raster.shape != self.shape:
+            raise ValueError("Размер растра не совпадает с размером накопленных статистик.")
+        return raster, raster != NODATA_VALUE
+
+    def add_month(self, date, raster, signature=None):
+        """Добавляет месяц date (растр в исходных единицах)."""
+        key = str(_date_key(date))
+        if key in self.months:
+            raise ValueError(f"Месяц {key} уже учтен, используйте replace_month.")
+        raster, valid = self._check(raster)
+        x = raster[valid].astype(np.float64)
+        n = self.count[valid].astype(np.float64) + 1
+        mean = self.mean_values[valid]
+        delta = x - mean
+        mean = mean + delta / n
+        self.m2[valid] += delta * (x - mean)
+        self.mean_values[valid] = mean
+        self.count[valid] += 1
+        self.months[key] = signature
+
+    def mean(self):
+        """Среднее (NaN для пикселей без данных)."""
+        return np.where(self.count > 0, self.mean_values, np.nan)
+
+    def variance(self, ddof=0):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > ddof, self.m2 / (self.count.astype(np.float64) - ddof), np.nan)
+
+    def std(self, ddof=0):
+        return np.sqrt(self.variance(ddof))
+
+
+class RunningAggregates(WelfordAggregates):
+    """
+    Попиксельные накопленные статистики одного индекса по месяцам.
+
+    Кроме числа валидных месяцев, среднего и M2 (WelfordAggregates) для каждого пикселя
+    хранятся минимум, максимум и дата последнего валидного месяца. Добавление, удаление
+    и замена месяца обновляют статистики за один проход по одному растру.
+    """
+
+    def __init__(self, shape):
+        super().__init__(shape)
+        self.min_values = np.full(self.shape, np.nan, dtype=np.float32)
+        self.max_values = np.full(self.shape, np.nan, dtype=np.float32)
+        self.last_dates = np.full(self.shape, np.datetime64('NaT'), dtype='datetime64[D]')
+
+    def add_month(self, date, raster, signature=None):
+        """Добавляет месяц date (растр в исходных единицах)."""
+        super().add_month(date, raster, signature)
+        raster, valid = self._check(raster)
+        x = raster[valid].astype(np.float64)
+        self.min_values[valid] = np.fmin(self.min_values[valid], x)
+        self.max_values[valid] = np.fmax(self.max_values[valid], x)
+        day = _date_key(date)
+        last = self.last_dates[valid]
+        self.last_dates[valid] = np.where(np.isnat(last) | (last < day), day, last)
+
+    def remove_month(self, date, raster):
+        """
+        Исключает месяц date; raster - значения, с которыми месяц был добавлен.
+        Среднее и M2 пересчитываются обратным шагом Уэлфорда. Минимум, максимум и
+        последняя дата восстанавливаются перечитыванием оставшихся месяцев только
+        для пикселей, где удаленное значение было экстремумом или последним.
+        """
+        key = str(_date_key(date))
+        if key not in self.months:
+            raise KeyError(f"Месяц {key} не учтен.")
+        raster, valid = self._check(raster)
+        x = raster[valid].astype(np.float64)
+        n = self.count[valid].astype(np.float64)
+        mean = self.mean_values[valid]
+        remaining = n - 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            new_mean = np.where(remaining > 0, (n * mean - x) / remaining, 0.0)
+        m2 = np.where(remaining > 0, self.m2[valid] - (x - new_mean) * (x - mean), 0.0)
+        self.m2[valid] = np.maximum(m2, 0.0)
+        self.mean_values[valid] = new_mean
+        self.count[valid] -= 1
+
+        stale = np.zeros(self.shape, dtype=bool)
+        stale[valid] = ((x == self.min_values[valid]) | (x == self.max_values[valid]) |
+                        (self.last_dates[valid] == _date_key(date)))
+        del self.months[key]
+        self._rescan(stale)
+
+    def replace_month(self, date, old_raster, new_raster, signature=None):
+        """Заменяет значения месяца date: old_raster - прежние значения, new_raster - новые."""
+        self.remove_month(date, old_raster)
+        self.add_month(date, new_raster, signature)
+
+    def _rescan(self, stale):
+        """Пересчитывает минимум, максимум и последнюю дату пикселей stale по учтенным месяцам."""
+        self.min_values[stale] = np.nan
+        self.max_values[stale] = np.nan
+        self.last_dates[stale] = np.datetime64('NaT')
+        if not stale.any() or not self.months:
+            return
+        rows, cols = np.nonzero(stale)
+        window = Window(cols.min(), rows.min(), cols.max() - cols.min() + 1, rows.max() - rows.min() + 1)
+        region = (slice(rows.min(), rows.max() + 1), slice(cols.min(), cols.max() + 1))
+        stale_region = stale[region]
+        for key, signature in sorted(self.months.items()):
+            if signature is None:
+                raise ValueError(f"Для месяца {key} не известен файл, пересчет экстремумов невозможен.")
+            with rasterio.open(signature[0]) as src:
+                values = src.read(1, window=window)
+            profiling.count_read(values.nbytes)
+            mask = stale_region & (values != NODATA_VALUE)
+            for target, fn in ((self.min_values, np.fmin), (self.max_values, np.fmax)):
+                target[region][mask] = fn(target[region][mask], values[mask])
+            self.last_dates[region][mask] = np.datetime64(key, 'D')
+
+    def save(self, path):
+        """Сохраняет состояние в .npz (запись через временный файл)."""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=STATE_VERSION, count=self.count, mean=self.mean_values, m2=self.m2,
+                     min=self.min_values, max=self.max_values, last_dates=self.last_dates,
+                     months=json.dumps(self.months))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as state:
+            if int(state['version']) != STATE_VERSION:
+                raise ValueError("Неподдерживаемая версия состояния.")
+            aggregates = cls(state['count'].shape)
+            aggregates.count = state['count']
+            aggregates.mean_values = state['mean']
+            aggregates.m2 = state['m2']
+            aggregates.min_values = state['min']
+            aggregates.max_values = state['max']
+            aggregates.last_dates = state['last_dates']
+            aggregates.months = json.loads(state['months'].item())
+        return aggregates
+
+
+def state_path_for(data_dir, region=None):
+    """Файл состояния индекса (и региона region, см. raster_cube.extract_region) в папке кэша рядом с папками индексов."""
+    data_dir = os.path.abspath(data_dir)
+    name = os.path.basename(data_dir).lower()
+    if region is not None:
+        name = f"{name}_{region}"
+    return os.path.join(os.path.dirname(data_dir), stack_cache.CACHE_DIR_NAME, f"{name}_aggregates.npz")
+
+
+def _read(path):
+    with rasterio.open(path) as src:
+        raster = src.read(1)
+    profiling.count_read(raster.nbytes)
+    return raster
+
+
+@profiling.profiled('aggregates', 'reduce')
+def update_aggregates(data_dir, state_path=None, progress=None, region=None):
+    """
+    Обновляет сохраненные статистики индекса по содержимому папки data_dir.
+
+    Если в папке растры нескольких регионов, статистики ведутся для каждого отдельно:
+    регион выбирается параметром region (см. raster_cube.extract_region).
+
+    Новые месяцы добавляются по одному растру, остальные файлы не читаются. Если
+    файл месяца изменился или удален, прежние значения месяца уже недоступны,
+    поэтому статистики пересчитываются заново по всем файлам. Для замены месяца за
+    один проход используйте RunningAggregates.replace_month с прежним растром.
+    progress(done, total, path) вызывается после каждого прочитанного файла.
+    """
+    paths = [path for path in list_rasters(data_dir) if extract_date(path) is not None]
+    regions = sorted({extract_region(path) for path in paths}, key=str)
+    if region is None and len(regions) > 1:
+        raise ValueError(f"В папке {data_dir} растры нескольких регионов ({', '.join(map(str, regions))}), "
+                         f"укажите регион.")
+    if region is None and regions:
+        region = regions[0]
+    state_path = state_path or state_path_for(data_dir, region)
+    files = {}
+    for path in paths:
+        if extract_region(path) == region:
+            files[str(_date_key(extract_date(path)))] = stack_cache.file_signature(path)
+
+    aggregates = None
+    if os.path.exists(state_path):
+        try:
+            aggregates = RunningAggregates.load(state_path)
+        except (OSError, ValueError, KeyError):
+            aggregates = None
+    if aggregates is not None and any(files.get(key) != sig for key, sig in aggregates.months.items()):
+        aggregates = None
+
+    new_months = sorted(key for key in files if aggregates is None or key not in aggregates.months)
+    for done, key in enumerate(new_months, start=1):
+        path = files[key][0]
+        raster = _read(path)
+        if aggregates is None:
+            aggregates = RunningAggregates(raster.shape)
+        aggregates.add_month(key, raster, files[key])
+        if progress is not None:
+            progress(done, len(new_months), path)
+
+    if aggregates is None:
+        where = f"В папке {data_dir}" if region is None else f"В папке {data_dir} для региона {region}"
+        raise ValueError(f"{where} нет растров с датой в имени.")
+    if new_months or not os.path.exists(state_path):
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        aggregates.save(state_path)
+    return aggregates
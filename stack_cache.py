@@ -0,0 +1,135 @@
+# stack_cache.py
+
+import os
+import json
+import threading
+import numpy as np
+from affine import Affine
+from rasterio.crs import CRS
+
+# Папка кэша создается рядом с папками ndvi/, savi/ и swir/
+CACHE_DIR_NAME = ".terravision_cache"
+CACHE_VERSION = 1
+
+
+def cache_dir_for(paths):
+    """Возвращает папку кэша для набора файлов (рядом с папкой индекса)."""
+    data_dir = os.path.dirname(os.path.abspath(paths[0]))
+    return os.path.join(os.path.dirname(data_dir), CACHE_DIR_NAME)
+
+
+def file_signature(path):
+    """Ключ файла в кэше: путь, размер и время изменения."""
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def _entry_paths(paths, name, region=None):
+    data_dir = os.path.basename(os.path.dirname(os.path.abspath(paths[0])))
+    entry = data_dir if not name or name.lower() == data_dir.lower() else f"{data_dir}_{name}"
+    if region:
+        # В одной папке могут лежать растры нескольких регионов
+        entry = f"{entry}_{region}"
+    base = os.path.join(cache_dir_for(paths), entry.lower())
+    return base + ".npy", base + ".json"
+
+
+def _profile_to_json(profile):
+    result = {}
+    for key, value in profile.items():
+        if isinstance(value, CRS):
+            value = {"crs_wkt": value.to_wkt()}
+        elif isinstance(value, Affine):
+            value = {"gdal_transform": list(value.to_gdal())}
+        result[key] = value
+    return result
+
+
+def _profile_from_json(data):
+    profile = {}
+    for key, value in data.items():
+        if isinstance(value, dict) and "crs_wkt" in value:
+            value = CRS.from_wkt(value["crs_wkt"])
+        elif isinstance(value, dict) and "gdal_transform" in value:
+            value = Affine.from_gdal(*value["gdal_transform"])
+        profile[key] = value
+    return profile
+
+
+def _read_manifest(manifest_path):
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != CACHE_VERSION:
+        return None
+    return manifest
+
+
+def load_cached_stack(paths, name, read_header, decode_into, region=None):
+    """
+    Открывает стек индекса из кэша в виде memory-mapped массива (время, строки, столбцы).
+    Стеки разных регионов (region) одной папки хранятся отдельно.
+
+    read_header(path) должен возвращать (высота, ширина, dtype, профиль) растра,
+    decode_into(paths, out, indices) - декодировать растры в срезы out[indices]. Если кэш устарел,
+    декодируются только новые или измененные месяцы, остальные копируются из старого кэша.
+    Возвращает (data, profile).
+    """
+    npy_path, manifest_path = _entry_paths(paths, name, region)
+    signatures = [file_signature(path) for path in paths]
+    manifest = _read_manifest(manifest_path)
+
+    old_data = None
+    if manifest is not None and os.path.exists(npy_path):
+        try:
+            old_data = np.load(npy_path, mmap_mode='r')
+        except (OSError, ValueError):
+            old_data = None
+        if old_data is not None and manifest["files"] == signatures:
+            # Кэш актуален: растры не декодируются
+            return old_data, _profile_from_json(manifest["profile"])
+
+    height, width, dtype, profile = read_header(paths[0])
+    shape = (len(paths), height, width)
+
+    # Месяцы, которые можно скопировать из старого кэша без декодирования
+    reusable = {}
+    if old_data is not None and old_data.shape[1:] == shape[1:] and old_data.dtype == np.dtype(dtype):
+        reusable = {tuple(sig): i for i, sig in enumerate(manifest["files"])}
+
+    os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+    # Уникальные временные имена: один и тот же стек могут собирать несколько потоков
+    tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    tmp_path = npy_path + tmp_suffix
+    data = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+    try:
+        to_decode = []
+        for i, sig in enumerate(signatures):
+            j = reusable.get(tuple(sig))
+            if j is None:
+                to_decode.append(i)
+            else:
+                data[i] = old_data[j]
+        if to_decode:
+            decode_into([paths[i] for i in to_decode], data, to_decode)
+        data.flush()
+        del data, old_data
+        os.replace(tmp_path, npy_path)
+    except BaseException:
+        # Ошибка декодирования или отмена задачи: недособранный стек не остается в кэше
+        data = old_data = None
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    manifest = {
+        "version": CACHE_VERSION,
+        "name": name,
+        "profile": _profile_to_json(profile),
+        "files": signatures,
+    }
+    with open(manifest_path + tmp_suffix, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + tmp_suffix, manifest_path)
+    return np.load(npy_path, mmap_mode='r'), profile
@@ -1,19 +1,67 @@
 # terra_vision_gui.py
 
+import time
+
+# Момент начала импорта модуля: от него отсчитываются времена отчета о запуске
+STARTUP_T0 = time.perf_counter()
+
 import sys
-import os
-import numpy as np
-import pandas as pd
+from functools import partial
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QVBoxLayout,
     QPushButton, QFileDialog, QTabWidget, QMessageBox, QHBoxLayout,
-    QProgressDialog
+    QProgressDialog, QCheckBox, QPlainTextEdit
 )
-from PyQt5.QtCore import Qt
-import rasterio
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
+from PyQt5.QtCore import Qt, QThread, QThreadPool, QTimer
+from PyQt5.QtGui import QFontDatabase
+import profiling
+from gui_workers import Warmup, Worker
+
+# numpy, rasterio, pandas, matplotlib, statsmodels и модель MLP загружаются после
+# показа окна (прогрев в фоновом потоке), а в методах импортируются локально
+
+
+def _warm_rasters():
+    import raster_cube
+    return raster_cube
+
+
+def _warm_plotting():
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas, NavigationToolbar2QT
+    return Figure, FigureCanvas, NavigationToolbar2QT
+
+
+def _warm_model():
+    from mlp_inference import load_mlp_kernel
+    return load_mlp_kernel()
+
+
+def _warm_correlation():
+    import correlation
+    return correlation
+
+
+def _warm_pandas():
+    import pandas
+    return pandas
+
+
+def _warm_statsmodels():
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+    return SARIMAX
+
+
+# Этапы прогрева в порядке выполнения: сначала то, что нужно для загрузки данных
+WARMUP_STAGES = [
+    ('rasters', "чтение растров", _warm_rasters),
+    ('plotting', "графики", _warm_plotting),
+    ('model', "модель MLP", _warm_model),
+    ('correlation', "корреляция", _warm_correlation),
+    ('pandas', "pandas", _warm_pandas),
+    ('statsmodels', "statsmodels", _warm_statsmodels),
+]
+
 
 class TerraVisionGUI(QMainWindow):
     def __init__(self):
@@ -27,14 +75,45 @@ class TerraVisionGUI(QMainWindow):
         self.savi_files = []
         self.swir_files = []
         
-        # Инициализируем данные
-        self.ndvi_data = {}
-        self.savi_data = {}
-        self.swir_data = {}
+        # Инициализируем данные (стеки индексов IndexStack)
+        self.ndvi_data = None
+        self.savi_data = None
+        self.swir_data = None
+
+        # Пул потоков для долгих операций: загрузка, корреляции и прогнозы
+        # выполняются параллельно, не блокируя окно
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(max(5, QThread.idealThreadCount()))
+        self.workers = set()
+        self.forecast_results = {}
         
-        # Загрузка модели MLP для классификации земель
+        # Модель MLP для классификации земель загружается при прогреве
         self.mlp_model = None
-        self.load_mlp_model()
+
+        # Готовые этапы прогрева и этапы, от которых зависит каждая кнопка
+        self.ready = set()
+        self.analysis_started = False
+        self.startup_times = {'import': STARTUP_T0_IMPORTED - STARTUP_T0}
+        self.warmup_times = {}
+        self.button_requirements = {
+            self.load_ndvi_button: {'rasters'},
+            self.load_savi_button: {'rasters'},
+            self.load_swir_button: {'rasters'},
+            self.plot_ndvi_trend_button: {'rasters', 'plotting', 'pandas'},
+            self.plot_ndvi_savi_corr_button: {'rasters', 'correlation', 'plotting'},
+            self.plot_ndvi_swir_corr_button: {'rasters', 'correlation', 'plotting'},
+            self.plot_ndvi_map_button: {'rasters', 'plotting'},
+            self.forecast_indices_button: {'plotting', 'pandas', 'statsmodels'},
+            self.classify_land_button: {'model'},
+            self.planting_recommendation_button: {'model'},
+        }
+        self.analysis_buttons = set(self.button_requirements) - {
+            self.load_ndvi_button, self.load_savi_button, self.load_swir_button}
+        self.update_buttons()
+        self.startup_times['window'] = time.perf_counter() - STARTUP_T0
+
+        # Прогрев начинается после того, как цикл событий покажет окно
+        QTimer.singleShot(0, self.start_warmup)
     
     def initUI(self):
         # Создаем вкладки
@@ -82,10 +161,12 @@ class TerraVisionGUI(QMainWindow):
         self.analysis_layout = QVBoxLayout()
         self.analysis_tab.setLayout(self.analysis_layout)
 
-        # Создаем область для графиков
-        self.figure = Figure()
-        self.canvas = FigureCanvas(self.figure)
-        self.analysis_layout.addWidget(self.canvas)
+        # Область для графиков: до загрузки matplotlib на ее месте надпись
+        self.figure = None
+        self.pyramid_view = None
+        self.canvas = QLabel("Загрузка модуля графиков...")
+        self.canvas.setAlignment(Qt.AlignCenter)
+        self.analysis_layout.addWidget(self.canvas, stretch=1)
 
         # Добавляем кнопки для построения графиков
         self.buttons_layout = QHBoxLayout()
@@ -106,6 +187,11 @@ class TerraVisionGUI(QMainWindow):
         self.plot_ndvi_swir_corr_button.setEnabled(False)
         self.buttons_layout.addWidget(self.plot_ndvi_swir_corr_button)
 
+        self.plot_ndvi_map_button = QPushButton("Карта NDVI")
+        self.plot_ndvi_map_button.clicked.connect(self.plot_ndvi_map)
+        self.plot_ndvi_map_button.setEnabled(False)
+        self.buttons_layout.addWidget(self.plot_ndvi_map_button)
+
         self.forecast_indices_button = QPushButton("Прогноз индексов")
         self.forecast_indices_button.clicked.connect(self.forecast_indices)
         self.forecast_indices_button.setEnabled(False)
@@ -127,62 +213,217 @@ class TerraVisionGUI(QMainWindow):
         self.analysis_result_label.setAlignment(Qt.AlignCenter)
         self.analysis_layout.addWidget(self.analysis_result_label)
 
-    def load_mlp_model(self):
-        # Загружаем модель MLP
-        try:
-            import joblib
-            self.mlp_model = joblib.load('mlp_model2.pkl')
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить модель MLP:\n{e}")
+        # Вкладка профилирования: разбивка последнего запуска по этапам
+        self.profile_tab = QWidget()
+        self.tabs.addTab(self.profile_tab, "Профилирование")
+        self.profile_layout = QVBoxLayout()
+        self.profile_tab.setLayout(self.profile_layout)
+
+        self.profile_checkbox = QCheckBox("Записывать время и память этапов")
+        self.profile_checkbox.setChecked(profiling.is_enabled())
+        self.profile_checkbox.toggled.connect(self.toggle_profiling)
+        self.profile_layout.addWidget(self.profile_checkbox)
+
+        self.profile_label = QLabel("Нет данных о запусках.")
+        self.profile_layout.addWidget(self.profile_label)
+
+        self.profile_text = QPlainTextEdit()
+        self.profile_text.setReadOnly(True)
+        self.profile_text.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.profile_layout.addWidget(self.profile_text)
+
+        self.save_trace_button = QPushButton("Сохранить трассировку...")
+        self.save_trace_button.clicked.connect(self.save_trace)
+        self.profile_layout.addWidget(self.save_trace_button)
+        self.last_profile = []
+
+    def start_warmup(self):
+        """Запускает фоновую загрузку тяжелых модулей и модели MLP."""
+        self.startup_times['shown'] = time.perf_counter() - STARTUP_T0
+        self.statusBar().showMessage("Загрузка компонентов...")
+        self.warmup = Warmup([(name, fn) for name, _, fn in WARMUP_STAGES])
+        self.warmup.signals.ready.connect(self.on_stage_ready)
+        self.warmup.signals.failed.connect(self.on_stage_failed)
+        self.warmup.signals.finished.connect(self.on_warmup_finished)
+        self.thread_pool.start(self.warmup)
+
+    def on_stage_ready(self, name, result, seconds):
+        self.warmup_times[name] = (seconds, time.perf_counter() - STARTUP_T0)
+        if name == 'plotting':
+            self.create_canvas(*result)
+        elif name == 'model':
+            # Веса модели MLP (прямой проход на numpy, без sklearn)
+            self.mlp_model = result
+        self.ready.add(name)
+        self.update_buttons()
+        labels = {stage: label for stage, label, _ in WARMUP_STAGES}
+        self.statusBar().showMessage(f"Загружено: {', '.join(labels[s] for s in labels if s in self.ready)}")
+
+    def on_stage_failed(self, name, message):
+        if name == 'model':
+            QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить модель MLP:\n{message}")
+        else:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить компонент {name}:\n{message}")
+
+    def on_warmup_finished(self):
+        total = time.perf_counter() - STARTUP_T0
+        self.statusBar().showMessage(
+            f"Окно открыто за {self.startup_times['shown']:.2f} с, компоненты загружены за {total:.2f} с", 10000)
+        print(self.startup_report(total))
+
+    def startup_report(self, total):
+        """Отчет о времени запуска: импорт, создание окна и этапы фонового прогрева."""
+        lines = ["Время запуска TerraVision (с от начала импорта):",
+                 f"  импорт модулей:   {self.startup_times['import']:.3f}",
+                 f"  окно создано:     {self.startup_times['window']:.3f}",
+                 f"  окно показано:    {self.startup_times['shown']:.3f}",
+                 "  фоновый прогрев (длительность / готово к):"]
+        for name, label, _ in WARMUP_STAGES:
+            if name in self.warmup_times:
+                seconds, at = self.warmup_times[name]
+                lines.append(f"    {label:<16}{seconds:.3f} / {at:.3f}")
+            else:
+                lines.append(f"    {label:<16}ошибка")
+        lines.append(f"  все компоненты:   {total:.3f}")
+        return "\n".join(lines)
+
+    def create_canvas(self, Figure, FigureCanvas, NavigationToolbar):
+        # Виджеты создаются только в главном потоке
+        self.figure = Figure()
+        canvas = FigureCanvas(self.figure)
+        self.analysis_layout.replaceWidget(self.canvas, canvas)
+        self.canvas.deleteLater()
+        self.canvas = canvas
+        # Панель масштабирования и сдвига карт
+        self.toolbar = NavigationToolbar(canvas, self.analysis_tab)
+        self.analysis_layout.insertWidget(self.analysis_layout.indexOf(canvas), self.toolbar)
+
+    def clear_figure(self):
+        """Очищает область графиков и отключает показ пирамиды предыдущей карты."""
+        if self.pyramid_view is not None:
+            self.pyramid_view.disconnect()
+            self.pyramid_view = None
+        self.figure.clear()
+
+    def toggle_profiling(self, enabled):
+        if enabled:
+            profiling.enable()
+        else:
+            profiling.disable()
+
+    def show_profile(self, label, mark):
+        """Показывает на вкладке профилирования этапы, записанные после mark."""
+        if not profiling.is_enabled():
+            return
+        self.last_profile = profiling.events(since=mark)
+        self.profile_label.setText(f"Последний запуск: {label}")
+        self.profile_text.setPlainText(profiling.format_summary(profiling.summary(self.last_profile)))
+
+    def save_trace(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Сохранить трассировку", "terravision_trace.json", "Chrome Trace (*.json)")
+        if path:
+            try:
+                profiling.export_chrome_trace(path, self.last_profile or profiling.events())
+            except OSError as e:
+                QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить трассировку:\n{e}")
+
+    def draw_canvas(self):
+        with profiling.stage('render', 'render'):
+            self.canvas.draw()
+
+    def update_buttons(self):
+        """Включает кнопки, для которых загружены нужные компоненты."""
+        for button, requirements in self.button_requirements.items():
+            enabled = requirements <= self.ready
+            if button in self.analysis_buttons:
+                enabled = enabled and self.analysis_started
+            button.setEnabled(enabled)
 
     def load_ndvi_data(self):
         options = QFileDialog.Options()
         files, _ = QFileDialog.getOpenFileNames(
             self, "Выберите файлы данных NDVI", "", "TIFF Files (*.tif);;All Files (*)", options=options)
         if files:
-            try:
-                self.ndvi_files = files
-                self.ndvi_data = self.load_all_rasters(self.ndvi_files)
-                self.ndvi_status_label.setText(f"Загружено файлов NDVI: {len(files)}")
-                self.check_all_data_loaded()
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить данные NDVI:\n{e}")
+            self.load_index_in_background("NDVI", files)
 
     def load_savi_data(self):
         options = QFileDialog.Options()
         files, _ = QFileDialog.getOpenFileNames(
             self, "Выберите файлы данных SAVI", "", "TIFF Files (*.tif);;All Files (*)", options=options)
         if files:
-            try:
-                self.savi_files = files
-                self.savi_data = self.load_all_rasters(self.savi_files)
-                self.savi_status_label.setText(f"Загружено файлов SAVI: {len(files)}")
-                self.check_all_data_loaded()
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить данные SAVI:\n{e}")
+            self.load_index_in_background("SAVI", files)
 
     def load_swir_data(self):
         options = QFileDialog.Options()
         files, _ = QFileDialog.getOpenFileNames(
             self, "Выберите файлы данных SWIR", "", "TIFF Files (*.tif);;All Files (*)", options=options)
         if files:
-            try:
-                self.swir_files = files
-                self.swir_data = self.load_all_rasters(self.swir_files)
-                self.swir_status_label.setText(f"Загружено файлов SWIR: {len(files)}")
-                self.check_all_data_loaded()
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить данные SWIR:\n{e}")
-
-    def load_all_rasters(self, file_list):
-        data_dict = {}
-        for file_path in file_list:
-            file_name = os.path.basename(file_path)
-            with rasterio.open(file_path) as src:
-                data = src.read(1)
-                profile = src.profile
-            data_dict[file_name] = {'data': data, 'profile': profile}
-        return data_dict
+            self.load_index_in_background("SWIR", files)
+
+    def load_all_rasters(self, file_list, name=None, progress=None):
+        # Стек (время, строки, столбцы), упорядоченный по датам; повторно файлы не декодируются
+        from raster_cube import load_stack_from_files
+        return load_stack_from_files(file_list, name, progress=progress)
+
+    def load_index_in_background(self, index_name, files):
+        """Загружает файлы индекса в фоновом потоке и обновляет статус по завершении."""
+        key = index_name.lower()
+
+        def task(report_progress):
+            return self.load_all_rasters(files, index_name, lambda done, total, path: report_progress(done, total))
+
+        def on_done(stack):
+            setattr(self, f"{key}_files", files)
+            setattr(self, f"{key}_data", stack)
+            getattr(self, f"{key}_status_label").setText(f"Загружено файлов {index_name}: {len(files)}")
+            self.check_all_data_loaded()
+
+        self.run_in_background(f"Загрузка данных {index_name}...", task, on_done,
+                               f"Не удалось загрузить данные {index_name}")
+
+    def run_in_background(self, label, task, on_done, error_message):
+        """
+        Выполняет task(report_progress) в пуле потоков. Окно прогресса не блокирует
+        интерфейс и позволяет отменить задачу; результат передается в on_done в главном потоке.
+        """
+        progress = QProgressDialog(label, "Отмена", 0, 0, self)
+        progress.setWindowTitle("Пожалуйста, подождите")
+        progress.setWindowModality(Qt.NonModal)
+        progress.setMinimumDuration(0)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+
+        mark = profiling.mark()
+
+        def profiled_task(report_progress):
+            with profiling.stage(label.rstrip('.'), 'task'):
+                return task(report_progress)
+
+        worker = Worker(profiled_task)
+        worker.signals.progress.connect(partial(self.update_progress, progress))
+        worker.signals.finished.connect(on_done)
+        # Разбивка показывается после on_done, чтобы в нее вошла отрисовка результата
+        worker.signals.finished.connect(lambda result: self.show_profile(label.rstrip('.'), mark))
+        worker.signals.failed.connect(
+            lambda message: QMessageBox.critical(self, "Ошибка", f"{error_message}:\n{message}"))
+        # finish_worker освобождает задачу вместе с ее сигналами, поэтому подключается последним
+        for signal in (worker.signals.finished, worker.signals.failed, worker.signals.cancelled):
+            signal.connect(partial(self.finish_worker, worker, progress))
+        progress.canceled.connect(worker.cancel)
+
+        self.workers.add(worker)
+        self.thread_pool.start(worker)
+        progress.show()
+        return worker
+
+    def update_progress(self, progress, done, total):
+        progress.setMaximum(total)
+        progress.setValue(done)
+
+    def finish_worker(self, worker, progress, *args):
+        self.workers.discard(worker)
+        progress.close()
 
     def check_all_data_loaded(self):
         if self.ndvi_files and self.savi_files and self.swir_files:
@@ -193,13 +434,9 @@ class TerraVisionGUI(QMainWindow):
     def start_analysis(self):
         try:
             self.analysis_result_label.setText("Анализ данных выполнен успешно.")
-            # Активируем кнопки для дальнейшего анализа
-            self.plot_ndvi_trend_button.setEnabled(True)
-            self.plot_ndvi_savi_corr_button.setEnabled(True)
-            self.plot_ndvi_swir_corr_button.setEnabled(True)
-            self.forecast_indices_button.setEnabled(True)
-            self.classify_land_button.setEnabled(True)
-            self.planting_recommendation_button.setEnabled(True)
+            # Активируем кнопки для дальнейшего анализа (те, чьи компоненты уже загружены)
+            self.analysis_started = True
+            self.update_buttons()
             # Переключаемся на вкладку с результатами анализа
             self.tabs.setCurrentWidget(self.analysis_tab)
         except Exception as e:
@@ -207,30 +444,24 @@ class TerraVisionGUI(QMainWindow):
 
     def plot_ndvi_trend(self):
         try:
-            self.figure.clear()
+            import pandas as pd
+            self.clear_figure()
             ax = self.figure.add_subplot(111)
             dates = []
             ndvi_means = []
-            for file_name, content in self.ndvi_data.items():
-                ndvi_values = content['data']
-                ndvi_values = ndvi_values.astype(float)
-                ndvi_values[ndvi_values == 0] = np.nan
-                avg = np.nanmean(ndvi_values)
-                date_str = self.extract_date_from_filename(file_name)
-                if date_str:
-                    date = pd.to_datetime(date_str)
-                    dates.append(date)
+            # Стек уже упорядочен по датам
+            for date, avg in zip(self.ndvi_data.dates, self.ndvi_data.mean_series()):
+                if date is not None:
+                    dates.append(pd.to_datetime(date))
                     ndvi_means.append(avg)
             if dates:
-                # Сортировка данных по датам
-                dates, ndvi_means = zip(*sorted(zip(dates, ndvi_means)))
                 # Построение графика
                 ax.plot(dates, ndvi_means, marker='o', color='b', linestyle='-', linewidth=2, markersize=4)
                 ax.set_title("Тренд среднего NDVI по времени")
                 ax.set_xlabel("Дата")
                 ax.set_ylabel("Средний NDVI")
                 ax.grid(True)
-                self.canvas.draw()
+                self.draw_canvas()
             else:
                 QMessageBox.warning(self, "Предупреждение", "Не удалось извлечь даты из имен файлов NDVI.")
         except Exception as e:
@@ -244,182 +475,172 @@ class TerraVisionGUI(QMainWindow):
         return None
 
     def plot_ndvi_savi_correlation(self):
-        try:
-            progress = QProgressDialog("Вычисление корреляции NDVI и SAVI...", None, 0, 0, self)
-            progress.setWindowTitle("Пожалуйста, подождите")
-            progress.setCancelButton(None)
-            progress.setWindowModality(Qt.WindowModal)
-            progress.show()
-
-            self.figure.clear()
-            ax = self.figure.add_subplot(111)
-            # Оптимизированный код для расчета корреляции
-            ndvi_stack, savi_stack = self.get_stacks(self.ndvi_data, self.savi_data)
-            if ndvi_stack is None or savi_stack is None:
-                progress.close()
-                return
-            correlation_map = self.calculate_correlation_map_optimized(ndvi_stack, savi_stack)
-            cax = ax.imshow(correlation_map, cmap='coolwarm', vmin=-1, vmax=1)
-            self.figure.colorbar(cax, ax=ax, label="Коэффициент корреляции")
-            ax.set_title("Карта корреляции между NDVI и SAVI")
-            ax.axis('off')
-            self.canvas.draw()
-
-            progress.close()
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось построить корреляцию NDVI и SAVI:\n{e}")
+        self.plot_correlation(self.savi_data, "SAVI")
 
     def plot_ndvi_swir_correlation(self):
-        try:
-            progress = QProgressDialog("Вычисление корреляции NDVI и SWIR...", None, 0, 0, self)
-            progress.setWindowTitle("Пожалуйста, подождите")
-            progress.setCancelButton(None)
-            progress.setWindowModality(Qt.WindowModal)
-            progress.show()
-
-            self.figure.clear()
-            ax = self.figure.add_subplot(111)
-            # Оптимизированный код для расчета корреляции
-            ndvi_stack, swir_stack = self.get_stacks(self.ndvi_data, self.swir_data)
-            if ndvi_stack is None or swir_stack is None:
-                progress.close()
-                return
-            correlation_map = self.calculate_correlation_map_optimized(ndvi_stack, swir_stack)
-            cax = ax.imshow(correlation_map, cmap='coolwarm', vmin=-1, vmax=1)
-            self.figure.colorbar(cax, ax=ax, label="Коэффициент корреляции")
-            ax.set_title("Карта корреляции между NDVI и SWIR")
-            ax.axis('off')
-            self.canvas.draw()
-
-            progress.close()
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось построить корреляцию NDVI и SWIR:\n{e}")
+        self.plot_correlation(self.swir_data, "SWIR")
+
+    def plot_correlation(self, other_data, other_name):
+        # Стеки готовятся в главном потоке, расчет корреляции выполняется в фоне
+        ndvi_stack, other_stack = self.get_stacks(self.ndvi_data, other_data)
+        if ndvi_stack is None or other_stack is None:
+            return
+
+        from stack_cache import cache_dir_for
+        cache_dir = cache_dir_for(self.ndvi_data.files)
+
+        def task(report_progress):
+            from overview_pyramid import array_pyramid
+            correlation_map = self.calculate_correlation_map_optimized(ndvi_stack, other_stack, report_progress)
+            # Пирамида обзоров строится в фоне и кэшируется рядом с данными
+            return array_pyramid(correlation_map, f"ndvi_{other_name.lower()}_correlation", cache_dir)
+
+        self.run_in_background(
+            f"Вычисление корреляции NDVI и {other_name}...", task,
+            partial(self.show_correlation_map, other_name),
+            f"Не удалось построить корреляцию NDVI и {other_name}")
+
+    def show_correlation_map(self, other_name, pyramid):
+        self.show_pyramid(pyramid, f"Карта корреляции между NDVI и {other_name}", "Коэффициент корреляции",
+                          cmap='coolwarm', vmin=-1, vmax=1)
+
+    def show_pyramid(self, pyramid, title, label, **imshow_options):
+        """Показывает карту по пирамиде обзоров: отрисовывается только уровень, подходящий масштабу."""
+        from gui_pyramid import PyramidView
+        self.clear_figure()
+        ax = self.figure.add_subplot(111)
+        self.pyramid_view = PyramidView(ax, pyramid, **imshow_options)
+        self.figure.colorbar(self.pyramid_view.image, ax=ax, label=label)
+        ax.set_title(title)
+        ax.set_xticks([])
+        ax.set_yticks([])
+        self.draw_canvas()
+
+    def plot_ndvi_map(self):
+        # Последний месяц NDVI: полное разрешение читается окнами по мере приближения
+        path = self.ndvi_data.files[-1]
+
+        def task(report_progress):
+            from overview_pyramid import raster_pyramid
+            return raster_pyramid(path, progress=report_progress)
+
+        def on_done(pyramid):
+            vmin, vmax = pyramid.value_range()
+            date = self.ndvi_data.dates[-1]
+            title = f"NDVI за {date:%Y-%m-%d}" if date is not None else "NDVI"
+            self.show_pyramid(pyramid, title, "NDVI (исходные единицы)", cmap='RdYlGn', vmin=vmin, vmax=vmax)
+
+        self.run_in_background("Построение обзоров NDVI...", task, on_done, "Не удалось показать карту NDVI")
 
     def get_stacks(self, data1, data2):
-        # Убедимся, что файлы соответствуют друг другу
-        keys1 = sorted(data1.keys())
-        keys2 = sorted(data2.keys())
-
-        if len(keys1) != len(keys2):
-            QMessageBox.warning(self, "Предупреждение", "Количество файлов NDVI и других индексов не совпадает.")
+        # Сопоставляем месяцы по дате съемки; уже декодированные стеки не читаются повторно
+        from raster_cube import AlignedIndices
+        aligned = AlignedIndices({data1.name: data1.files, data2.name: data2.files})
+        if not aligned.dates:
+            QMessageBox.warning(self, "Предупреждение", f"У {data1.name} и {data2.name} нет общих дат съемки.")
             return None, None
+        for name in aligned.names:
+            dropped = aligned.dropped_dates(name)
+            if dropped:
+                print(f"{name}: не учитываются месяцы без пары: {', '.join(f'{d:%Y-%m-%d}' for d in dropped)}")
+
+        # Стеки (время, строки, столбцы) в исходном типе данных, нули считаются пропусками
+        return aligned[data1.name].data, aligned[data2.name].data
 
-        stack1 = []
-        stack2 = []
-        for key1, key2 in zip(keys1, keys2):
-            arr1 = data1[key1]['data'].astype(float)
-            arr1[arr1 == 0] = np.nan
-            arr2 = data2[key2]['data'].astype(float)
-            arr2[arr2 == 0] = np.nan
-            stack1.append(arr1)
-            stack2.append(arr2)
-        stack1 = np.stack(stack1, axis=-1)
-        stack2 = np.stack(stack2, axis=-1)
-        return stack1, stack2
-
-    def calculate_correlation_map_optimized(self, stack1, stack2):
+    def calculate_correlation_map_optimized(self, stack1, stack2, progress=None):
         """
         Оптимизированная функция для расчета корреляции между двумя стековыми массивами.
+        progress(done_rows, total_rows) вызывается после каждого блока строк.
         """
         # Проверяем, что размеры стеков совпадают
         if stack1.shape != stack2.shape:
             raise ValueError("Размеры стеков не совпадают.")
 
-        # Получаем размеры массива
-        rows, cols, bands = stack1.shape
-
-        # Преобразуем в двумерные массивы
-        stack1_flat = stack1.reshape(-1, bands)
-        stack2_flat = stack2.reshape(-1, bands)
-
-        # Создаем маску валидных значений
-        valid_mask = ~np.isnan(stack1_flat) & ~np.isnan(stack2_flat)
-
-        # Инициализируем массив для хранения корреляций
-        correlation_flat = np.full(stack1_flat.shape[0], np.nan)
-
-        # Вычисляем средние и стандартные отклонения
-        with np.errstate(invalid='ignore'):
-            mean1 = np.nanmean(stack1_flat, axis=1)
-            mean2 = np.nanmean(stack2_flat, axis=1)
-            std1 = np.nanstd(stack1_flat, axis=1)
-            std2 = np.nanstd(stack2_flat, axis=1)
-
-        # Вычисляем ковариацию
-        with np.errstate(invalid='ignore', divide='ignore'):
-            cov = np.nansum((stack1_flat - mean1[:, None]) * (stack2_flat - mean2[:, None]), axis=1) / (np.sum(valid_mask, axis=1) - 1)
-            correlation_flat = cov / (std1 * std2)
-            correlation_flat[(std1 == 0) | (std2 == 0) | (np.sum(valid_mask, axis=1) <= 1)] = np.nan
-
-        # Преобразуем обратно в двумерный массив
-        correlation_map = correlation_flat.reshape(rows, cols)
-        return correlation_map
+        # Корреляция по общему набору валидных дат, блоками строк в float32
+        from correlation import masked_correlation
+        return masked_correlation(stack1, stack2, progress=progress)
 
     def forecast_indices(self):
-        try:
-            self.figure.clear()
-            ax = self.figure.add_subplot(111)
-            indices = {'NDVI': self.ndvi_data, 'SAVI': self.savi_data, 'SWIR': self.swir_data}
-            colors = {'NDVI': 'blue', 'SAVI': 'green', 'SWIR': 'red'}
-            for index_name, data_dict in indices.items():
-                dates = []
-                values = []
-                for file_name, content in data_dict.items():
-                    index_values = content['data']
-                    index_values = index_values.astype(float)
-                    index_values[index_values == 0] = np.nan
-                    avg = np.nanmean(index_values)
-                    date_str = self.extract_date_from_filename(file_name)
-                    if date_str:
-                        date = pd.to_datetime(date_str)
-                        dates.append(date)
-                        values.append(avg)
-                    else:
-                        print(f"Не удалось извлечь дату из имени файла: {file_name}")
-                if dates:
-                    # Создаём DataFrame и переиндексируем с использованием полной даты
-                    data = pd.DataFrame({'Date': dates, index_name: values})
-                    data.set_index('Date', inplace=True)
-                    # Ресемплирование данных до ежемесячной частоты и интерполяция пропущенных значений
-                    data = data.resample('MS').mean()
-                    data[index_name] = data[index_name].interpolate(method='linear')
-                    series = data[index_name]
-                    # Проверка количества данных
-                    if len(series) < 24:
-                        QMessageBox.warning(self, "Предупреждение", f"Недостаточно данных для прогнозирования {index_name}. Требуется минимум 2 года данных.")
-                        continue
-                    # Прогнозирование
-                    from statsmodels.tsa.statespace.sarimax import SARIMAX
-                    model = SARIMAX(series, order=(1, 1, 1), seasonal_order=(1, 1, 1, 12))
-                    sarima_fit = model.fit(disp=False)
-                    forecast = sarima_fit.get_forecast(steps=12)
-                    forecast_index = forecast.predicted_mean.index
-                    forecast_values = forecast.predicted_mean.values
-                    # Построение графика
-                    ax.plot(series.index, series.values, label=f"{index_name} (фактические)", color=colors[index_name])
-                    ax.plot(forecast_index, forecast_values, label=f"{index_name} (прогноз)", linestyle="--", color=colors[index_name])
-                else:
-                    QMessageBox.warning(self, "Предупреждение", f"Не удалось извлечь даты из имен файлов {index_name}.")
-            ax.set_title("Прогноз индексов с помощью SARIMA")
-            ax.set_xlabel("Дата")
-            ax.set_ylabel("Значение индекса")
-            ax.legend()
-            self.canvas.draw()
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось выполнить прогнозирование:\n{e}")
+        # Модели SARIMA для каждого индекса обучаются параллельно в фоновых потоках
+        self.forecast_results = {}
+        indices = {'NDVI': self.ndvi_data, 'SAVI': self.savi_data, 'SWIR': self.swir_data}
+        for index_name, stack in indices.items():
+            self.run_in_background(f"Прогнозирование {index_name}...",
+                                   partial(self.forecast_index, index_name, stack),
+                                   self.show_forecast_result, "Не удалось выполнить прогнозирование")
+
+    def forecast_index(self, index_name, stack, report_progress):
+        """
+        Строит прогноз SARIMA на 12 месяцев для среднего значения индекса (выполняется в фоне).
+        Возвращает (index_name, (ряд, даты прогноза, значения прогноза) или None, предупреждение или None).
+        """
+        import pandas as pd
+        report_progress(0, 2)
+        dates = []
+        values = []
+        for file_name, date, avg in zip(stack.file_names, stack.dates, stack.mean_series()):
+            if date is not None:
+                dates.append(pd.to_datetime(date))
+                values.append(avg)
+            else:
+                print(f"Не удалось извлечь дату из имени файла: {file_name}")
+        if not dates:
+            return index_name, None, f"Не удалось извлечь даты из имен файлов {index_name}."
+        # Создаём DataFrame и переиндексируем с использованием полной даты
+        data = pd.DataFrame({'Date': dates, index_name: values})
+        data.set_index('Date', inplace=True)
+        # Ресемплирование данных до ежемесячной частоты и интерполяция пропущенных значений
+        data = data.resample('MS').mean()
+        data[index_name] = data[index_name].interpolate(method='linear')
+        series = data[index_name]
+        # Проверка количества данных
+        if len(series) < 24:
+            return index_name, None, f"Недостаточно данных для прогнозирования {index_name}. Требуется минимум 2 года данных."
+        report_progress(1, 2)
+        # Прогнозирование
+        from statsmodels.tsa.statespace.sarimax import SARIMAX
+        model = SARIMAX(series, order=(1, 1, 1), seasonal_order=(1, 1, 1, 12))
+        with profiling.stage('sarima', 'fit'):
+            sarima_fit = model.fit(disp=False)
+        forecast = sarima_fit.get_forecast(steps=12)
+        report_progress(2, 2)
+        return index_name, (series, forecast.predicted_mean.index, forecast.predicted_mean.values), None
+
+    def show_forecast_result(self, result):
+        index_name, forecast, warning = result
+        if warning is not None:
+            QMessageBox.warning(self, "Предупреждение", warning)
+            return
+        self.forecast_results[index_name] = forecast
+
+        # Перерисовываем все готовые прогнозы в исходном порядке индексов
+        self.clear_figure()
+        ax = self.figure.add_subplot(111)
+        colors = {'NDVI': 'blue', 'SAVI': 'green', 'SWIR': 'red'}
+        for name, color in colors.items():
+            if name not in self.forecast_results:
+                continue
+            series, forecast_index, forecast_values = self.forecast_results[name]
+            ax.plot(series.index, series.values, label=f"{name} (фактические)", color=color)
+            ax.plot(forecast_index, forecast_values, label=f"{name} (прогноз)", linestyle="--", color=color)
+        ax.set_title("Прогноз индексов с помощью SARIMA")
+        ax.set_xlabel("Дата")
+        ax.set_ylabel("Значение индекса")
+        ax.legend()
+        self.draw_canvas()
 
     def classify_land(self):
         try:
             if self.mlp_model is None:
                 QMessageBox.critical(self, "Ошибка", "Модель MLP не загружена.")
                 return
+            import numpy as np
             # Используем средние значения по всем загруженным данным
-            ndvi = np.nanmean([np.nanmean(d['data']) for d in self.ndvi_data.values()])
-            savi = np.nanmean([np.nanmean(d['data']) for d in self.savi_data.values()])
-            swir = np.nanmean([np.nanmean(d['data']) for d in self.swir_data.values()])
+            ndvi = np.nanmean(self.ndvi_data.data.mean(axis=(1, 2)))
+            savi = np.nanmean(self.savi_data.data.mean(axis=(1, 2)))
+            swir = np.nanmean(self.swir_data.data.mean(axis=(1, 2)))
             # Классифицируем тип земельного участка
-            data_point = pd.DataFrame([[ndvi, savi, swir]], columns=['NDVI', 'SAVI', 'SWIR'])
-            prediction = self.mlp_model.predict(data_point)
+            prediction = self.mlp_model.predict_one(ndvi, savi, swir)
             class_mapping = {
                 1: 'Вода',
                 2: 'Пустыня/городские зоны',
@@ -427,7 +648,7 @@ class TerraVisionGUI(QMainWindow):
                 4: 'Средняя растительность',
                 5: 'Плотная растительность (леса)'
             }
-            classification = class_mapping.get(prediction[0], "Неизвестный класс")
+            classification = class_mapping.get(prediction, "Неизвестный класс")
             QMessageBox.information(self, "Классификация земель", f"Тип земельного участка: {classification}")
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось выполнить классификацию:\n{e}")
@@ -443,15 +664,13 @@ class TerraVisionGUI(QMainWindow):
             # Здесь мы можем использовать те же данные, что и для классификации земель
 
             # Получаем средние значения индексов
-            ndvi = np.nanmean([np.nanmean(d['data']) for d in self.ndvi_data.values()])
-            savi = np.nanmean([np.nanmean(d['data']) for d in self.savi_data.values()])
-            swir = np.nanmean([np.nanmean(d['data']) for d in self.swir_data.values()])
-
-            # Подготавливаем данные для модели
-            data_point = pd.DataFrame([[ndvi, savi, swir]], columns=['NDVI', 'SAVI', 'SWIR'])
+            import numpy as np
+            ndvi = np.nanmean(self.ndvi_data.data.mean(axis=(1, 2)))
+            savi = np.nanmean(self.savi_data.data.mean(axis=(1, 2)))
+            swir = np.nanmean(self.swir_data.data.mean(axis=(1, 2)))
 
             # Получаем предсказание класса земель
-            land_class = self.mlp_model.predict(data_point)[0]
+            land_class = self.mlp_model.predict_one(ndvi, savi, swir)
 
             # На основе класса земель даём рекомендации по посадке
             recommendations = {
@@ -468,6 +687,8 @@ class TerraVisionGUI(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось получить рекомендации по посадке:\n{e}")
 
+STARTUP_T0_IMPORTED = time.perf_counter()
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     gui = TerraVisionGUI()
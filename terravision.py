@@ -0,0 +1,507 @@
+# terravision.py
+"""
+Командная строка TerraVision для пакетного запуска анализов без окон matplotlib.
+
+    python terravision.py [общие параметры] <команда> [параметры] [+ <команда> [параметры] ...]
+
+Команды: stats, trend, correlate, climatology, anomaly, forecast, classify, recommend. Несколько команд,
+разделенных "+", выполняются в одном процессе и используют одни и те же загруженные
+стеки. Тяжелые библиотеки (statsmodels, matplotlib, pandas) импортируются только
+командами, которым они нужны.
+
+Пример:
+    python terravision.py --start 2021-01-01 --output-dir out stats + correlate --with SAVI SWIR --png
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from datetime import datetime
+import profiling
+
+INDEX_NAMES = ('NDVI', 'SAVI', 'SWIR')
+
+# Разделитель команд в одном вызове
+CHAIN_SEPARATOR = '+'
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ожидается дата в формате ГГГГ-ММ-ДД: {value}")
+
+
+def index_name(value):
+    name = value.upper()
+    if name not in INDEX_NAMES:
+        raise argparse.ArgumentTypeError(f"Неизвестный индекс: {value}")
+    return name
+
+
+class Session:
+    """
+    Общее состояние цепочки команд: папки индексов, период, область интереса и папка
+    результатов. Стеки загружаются один раз и переиспользуются всеми командами цепочки.
+    """
+
+    def __init__(self, args):
+        self.dirs = {'NDVI': args.ndvi_dir, 'SAVI': args.savi_dir, 'SWIR': args.swir_dir}
+        self.start = args.start
+        self.end = args.end
+        self.output_dir = args.output_dir
+        self.workers = args.workers
+        self.processes = args.processes
+        self.bbox = args.bbox
+        self.pixel_window = args.window
+        self._window = None
+        self._files = {}
+        self._climatologies = {}
+
+    def files(self, name):
+        """Файлы индекса за выбранный период, упорядоченные по дате."""
+        if name not in self._files:
+            from raster_cube import extract_date, list_rasters
+            files = []
+            for path in list_rasters(self.dirs[name]):
+                date = extract_date(path)
+                if date is None or (self.start and date < self.start) or (self.end and date > self.end):
+                    continue
+                files.append(path)
+            if not files:
+                raise ValueError(f"Нет файлов {name} в папке {self.dirs[name]} за выбранный период.")
+            self._files[name] = files
+        return self._files[name]
+
+    @property
+    def window(self):
+        """Окно области интереса (--bbox или --window) в пикселях растров или None."""
+        if self._window is None and (self.bbox or self.pixel_window):
+            from raster_cube import resolve_window
+            self._window = resolve_window(self.files('NDVI')[0], self.pixel_window, self.bbox)
+        return self._window
+
+    def stack(self, name):
+        from raster_cube import load_stack_from_files
+        return load_stack_from_files(self.files(name), name, workers=self.workers, window=self.window)
+
+    def aligned(self, names):
+        """Стеки нескольких индексов, сопоставленные по дате съемки."""
+        from raster_cube import AlignedIndices
+        return AlignedIndices({name: self.files(name) for name in names}, workers=self.workers,
+                              window=self.window)
+
+    def climatology(self, name):
+        """
+        Климатология индекса по календарным месяцам за период сессии. Хранится в кэше
+        (отдельно для каждого периода) и дополняется только новыми месяцами.
+        """
+        if name not in self._climatologies:
+            from climatology import state_path_for, update_climatology
+            files = self.files(name)
+            state_path = state_path_for(files)
+            if self.start or self.end:
+                period = "_".join(f"{date:%Y%m%d}" if date else "" for date in (self.start, self.end))
+                state_path = state_path[:-len(".npz")] + f"_{period}.npz"
+            self._climatologies[name] = update_climatology(files, state_path)
+        return self._climatologies[name]
+
+    def profile(self, name):
+        """Профиль растров индекса для области сессии."""
+        import rasterio
+        from raster_cube import window_profile
+        with rasterio.open(self.files(name)[0]) as src:
+            profile = src.profile
+        return profile if self.window is None else window_profile(profile, self.window)
+
+    def crop(self, array):
+        """Область сессии из массива (..., строки, столбцы) на всю сетку растров."""
+        window = self.window
+        if window is None:
+            return array
+        return array[..., window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width]
+
+    def output(self, *parts):
+        path = os.path.join(self.output_dir, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+
+def write_raster(path, array, profile, nodata):
+    """GeoTIFF из массива (строки, столбцы) или многоканального (каналы, строки, столбцы)."""
+    import rasterio
+    profile = dict(profile)
+    profile.update(driver='GTiff', dtype=str(array.dtype), count=1 if array.ndim == 2 else array.shape[0],
+                   nodata=nodata, compress='deflate')
+    for key in ('blockxsize', 'blockysize', 'tiled', 'interleave'):
+        profile.pop(key, None)
+    with profiling.stage('write', 'write', path=path), rasterio.open(path, 'w', **profile) as dst:
+        if array.ndim == 2:
+            dst.write(array, 1)
+        else:
+            dst.write(array)
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def pyplot():
+    """matplotlib без графического интерфейса."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def save_map(path, array, title, label, **imshow_options):
+    plt = pyplot()
+    fig, ax = plt.subplots(figsize=(10, 6))
+    image = ax.imshow(array, **imshow_options)
+    fig.colorbar(image, ax=ax, label=label)
+    ax.set_title(title)
+    ax.set_xticks([])
+    ax.set_yticks([])
+    fig.tight_layout()
+    save_figure(fig, path)
+
+
+def save_figure(fig, path):
+    with profiling.stage('render', 'render', path=path):
+        fig.savefig(path, dpi=150)
+    pyplot().close(fig)
+
+
+def cmd_stats(session, args):
+    """Попиксельные среднее, стандартное отклонение и медиана каждого индекса."""
+    import numpy as np
+    from pixel_histogram import HISTOGRAM_DTYPES, PixelHistogram
+    rows = []
+    outputs = []
+    for name in args.indices:
+        stack = session.stack(name)
+        if stack.data.dtype in HISTOGRAM_DTYPES:
+            histogram = PixelHistogram.from_stack(stack.data)
+            results = {'mean': histogram.mean(), 'std': histogram.std(), 'median': histogram.median()}
+        else:
+            # Вещественные и знаковые растры: точный расчет по стеку float
+            import warnings
+            data = stack.to_float()
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                results = {'mean': np.nanmean(data, axis=0), 'std': np.nanstd(data, axis=0),
+                           'median': np.nanmedian(data, axis=0)}
+        for statistic, values in results.items():
+            outputs.append(session.output(f"{name.lower()}_{statistic}.tif"))
+            write_raster(outputs[-1], values.astype(np.float32), stack.profile, np.nan)
+        rows.append([name] + [float(np.nanmean(results[key])) for key in ('mean', 'std', 'median')])
+    outputs.append(session.output("summary_statistics.csv"))
+    write_csv(outputs[-1], ['Индекс', 'Среднее', 'Стандартное отклонение', 'Медиана'], rows)
+    return outputs
+
+
+def cmd_trend(session, args):
+    """Среднее нормализованное значение индексов по датам и попиксельные карты трендов (--maps)."""
+    from index_trend_analysis import calculate_average_index
+    series = {}
+    for name in args.indices:
+        dates, means = calculate_average_index(session.stack(name))
+        series[name] = dict(zip(dates, means))
+    dates = sorted(set().union(*series.values()))
+    path = session.output("trend.csv")
+    write_csv(path, ['Дата'] + list(args.indices),
+              [[f"{date:%Y-%m-%d}"] + [series[name].get(date, '') for name in args.indices] for date in dates])
+    outputs = [path]
+    if args.maps:
+        import numpy as np
+        from pixel_trend import stack_trends
+        for name in args.indices:
+            stack = session.stack(name)
+            for product, values in stack_trends(stack, workers=session.workers).items():
+                outputs.append(session.output("trend_maps", f"{name.lower()}_{product}.tif"))
+                write_raster(outputs[-1], values, stack.profile, np.nan)
+    if args.png:
+        plt = pyplot()
+        fig, ax = plt.subplots(figsize=(12, 6))
+        for name in args.indices:
+            ax.plot(list(series[name]), list(series[name].values()), marker='o', label=name)
+        ax.set_title("Изменения индексов по времени")
+        ax.set_xlabel("Дата")
+        ax.set_ylabel("Среднее значение индекса")
+        ax.legend()
+        ax.grid(True)
+        fig.autofmt_xdate()
+        fig.tight_layout()
+        outputs.append(session.output("trend.png"))
+        save_figure(fig, outputs[-1])
+    return outputs
+
+
+def cmd_correlate(session, args):
+    """Попиксельная корреляция NDVI с другими индексами по общим датам."""
+    from correlation import stack_correlation
+    outputs = []
+    for other in args.others:
+        aligned = session.aligned(['NDVI', other])
+        correlation_map = stack_correlation(aligned['NDVI'], aligned[other])
+        path = session.output(f"ndvi_{other.lower()}_correlation.tif")
+        write_raster(path, correlation_map, aligned['NDVI'].profile, float('nan'))
+        outputs.append(path)
+        if args.png:
+            outputs.append(session.output(f"ndvi_{other.lower()}_correlation.png"))
+            save_map(outputs[-1], correlation_map, f"Карта корреляции между NDVI и {other}",
+                     "Коэффициент корреляции", cmap='coolwarm', vmin=-1, vmax=1)
+    return outputs
+
+
+def cmd_climatology(session, args):
+    """Попиксельные среднее, стандартное отклонение и число лет для каждого календарного месяца."""
+    import numpy as np
+    outputs = []
+    for name in args.indices:
+        climatology = session.climatology(name)
+        profile = session.profile(name)
+        for product, values, nodata in (('mean', climatology.means(), np.nan), ('std', climatology.stds(), np.nan),
+                                        ('count', climatology.counts(), None)):
+            # Каналы 1-12 - январь-декабрь
+            outputs.append(session.output(f"{name.lower()}_climatology_{product}.tif"))
+            write_raster(outputs[-1], np.ascontiguousarray(session.crop(values)), profile, nodata)
+    return outputs
+
+
+def cmd_anomaly(session, args):
+    """Стандартизованная аномалия месяцев относительно климатологии их календарного месяца."""
+    from raster_cube import extract_date
+    from climatology import anomaly_for_file
+    outputs = []
+    for name in args.indices:
+        files = {extract_date(path): path for path in session.files(name)}
+        dates = args.dates or [max(files)]
+        missing = [date for date in dates if date not in files]
+        if missing:
+            raise ValueError(f"Нет файлов {name} за {', '.join(f'{date:%Y-%m-%d}' for date in missing)}.")
+        climatology = session.climatology(name)
+        profile = session.profile(name)
+        for date in dates:
+            anomaly = anomaly_for_file(climatology, files[date], min_years=args.min_years, window=session.window)
+            outputs.append(session.output("anomaly", f"{name.lower()}_anomaly_{date:%Y-%m-%d}.tif"))
+            write_raster(outputs[-1], anomaly, profile, float('nan'))
+    return outputs
+
+
+def cmd_forecast(session, args):
+    """Прогноз SARIMA среднего значения индексов и карты прогноза по пикселям или блокам (--maps)."""
+    from index_forecasting_sarima import forecast_sarima, index_series
+    rows = []
+    results = {}
+    for name in args.indices:
+        data = index_series(session.stack(name))['Value']
+        forecast_index, forecast_values = forecast_sarima(data, args.periods)
+        results[name] = (data, forecast_index, forecast_values)
+        rows.extend([f"{date:%Y-%m-%d}", name, 'факт', value] for date, value in data.items())
+        rows.extend([f"{date:%Y-%m-%d}", name, 'прогноз', value]
+                    for date, value in zip(forecast_index, forecast_values))
+    path = session.output("forecast.csv")
+    write_csv(path, ['Дата', 'Индекс', 'Тип', 'Значение'], rows)
+    outputs = [path]
+    if args.maps:
+        from pixel_forecast import stack_forecast, write_forecast_maps
+        for name in args.indices:
+            forecast = stack_forecast(session.stack(name), block=args.block, mode=args.mode, periods=args.periods,
+                                      processes=session.processes)
+            outputs.extend(write_forecast_maps(forecast, session.profile(name), session.output("forecast_maps"),
+                                               name.lower(), block=args.block))
+    if args.png:
+        plt = pyplot()
+        fig, axes = plt.subplots(len(results), 1, figsize=(12, 4 * len(results)), squeeze=False)
+        for ax, (name, (data, forecast_index, forecast_values)) in zip(axes[:, 0], results.items()):
+            ax.plot(data.index, data.values, label=f"{name} (фактические)")
+            ax.plot(forecast_index, forecast_values, label=f"{name} (прогноз)", linestyle="--")
+            ax.set_title(f"Прогноз {name} с помощью SARIMA")
+            ax.legend()
+        fig.tight_layout()
+        outputs.append(session.output("forecast.png"))
+        save_figure(fig, outputs[-1])
+    return outputs
+
+
+def cmd_classify(session, args):
+    """Карта классов земель (MLP) для каждого месяца и преобладающий класс за период."""
+    from land_cover_map import CLASS_NODATA, classify_month, load_model
+    from ndvi_classes import ClassCounter
+    import rasterio
+    model = load_model()
+    aligned = session.aligned(INDEX_NAMES)
+    outputs = []
+    counter = None
+    for date, ndvi_path, savi_path, swir_path in zip(aligned.dates, *(aligned.files(name) for name in INDEX_NAMES)):
+        path = session.output("land_classes", f"land_classes_{date:%Y-%m-%d}.tif")
+        classify_month(model, ndvi_path, savi_path, swir_path, path, args.batch_size, workers=session.workers,
+                       window=session.window)
+        outputs.append(path)
+        with rasterio.open(path) as src:
+            classes, profile = src.read(1), src.profile
+        if counter is None:
+            counter = ClassCounter(classes.shape)
+        counter.update(classes)
+    if counter is not None:
+        path = session.output("land_classes_modal.tif")
+        write_raster(path, counter.modal_class(), profile, CLASS_NODATA)
+        outputs.append(path)
+    return outputs
+
+
+def cmd_recommend(session, args):
+    """Тип земель и рекомендации по посадке для точек или для среднего по сцене."""
+    from planting_recommendations import CLASS_MAPPING, mlp_model, recommendation_for
+    points = [tuple(point) for point in args.point or []]
+    if args.points:
+        with open(args.points, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                points.append(tuple(float(row[name.lower()]) for name in INDEX_NAMES))
+    if not points:
+        import numpy as np
+        # Средние значения индексов по всем месяцам периода, без учета пропусков
+        points.append(tuple(float(np.nanmean(session.stack(name).mean_series())) for name in INDEX_NAMES))
+    rows = []
+    for point in points:
+        land_type = CLASS_MAPPING.get(mlp_model.predict_one(*point))
+        rows.append(list(point) + [land_type, recommendation_for(land_type)])
+        print(f"NDVI={point[0]:g} SAVI={point[1]:g} SWIR={point[2]:g}: {land_type}. {rows[-1][-1]}")
+    path = session.output("recommendations.csv")
+    write_csv(path, ['NDVI', 'SAVI', 'SWIR', 'Тип земель', 'Рекомендация'], rows)
+    return [path]
+
+
+COMMANDS = {
+    'stats': cmd_stats,
+    'trend': cmd_trend,
+    'correlate': cmd_correlate,
+    'climatology': cmd_climatology,
+    'anomaly': cmd_anomaly,
+    'forecast': cmd_forecast,
+    'classify': cmd_classify,
+    'recommend': cmd_recommend,
+}
+
+
+def build_parser(with_globals=True):
+    parser = argparse.ArgumentParser(
+        prog='terravision', description="Пакетный анализ спутниковых индексов NDVI, SAVI и SWIR.",
+        epilog=f"Команды можно объединять через '{CHAIN_SEPARATOR}': stats {CHAIN_SEPARATOR} trend --png")
+    if with_globals:
+        parser.add_argument('--ndvi-dir', default='ndvi')
+        parser.add_argument('--savi-dir', default='savi')
+        parser.add_argument('--swir-dir', default='swir')
+        parser.add_argument('--start', type=parse_date, help="первая дата периода (ГГГГ-ММ-ДД)")
+        parser.add_argument('--end', type=parse_date, help="последняя дата периода (ГГГГ-ММ-ДД)")
+        parser.add_argument('--output-dir', default='output', help="папка для результатов")
+        parser.add_argument('--workers', type=int, help="число потоков чтения растров")
+        region = parser.add_mutually_exclusive_group()
+        region.add_argument('--bbox', nargs=4, type=float, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'),
+                            help="область интереса в координатах растров; читаются только ее блоки")
+        region.add_argument('--window', nargs=4, type=int, metavar=('COL', 'ROW', 'WIDTH', 'HEIGHT'),
+                            help="область интереса в пикселях растров")
+        parser.add_argument('--regions', action='store_true',
+                            help="обработать каждый регион папок индексов отдельно в пуле процессов "
+                                 "и сшить результаты (см. region_scheduler)")
+        parser.add_argument('--processes', type=int,
+                            help="число процессов для --regions и forecast --maps (по умолчанию - ядра)")
+        parser.add_argument('--memory-budget', type=int, metavar='MB',
+                            help="бюджет памяти одного процесса для --regions, МБ")
+        parser.add_argument('--retries', type=int, default=1, help="повторы упавшего задания для --regions")
+        parser.add_argument('--profile', metavar='TRACE', help="профилировать этапы и сохранить трассировку "
+                                                                "в формате Chrome (сводка выводится в конце)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add(name, with_indices=True, with_png=False):
+        command = commands.add_parser(name, help=COMMANDS[name].__doc__)
+        if with_indices:
+            command.add_argument('--indices', nargs='+', type=index_name, default=list(INDEX_NAMES))
+        if with_png:
+            command.add_argument('--png', action='store_true', help="сохранить график в PNG")
+        return command
+
+    add('stats')
+    trend = add('trend', with_png=True)
+    trend.add_argument('--maps', action='store_true',
+                       help="попиксельные карты трендов: МНК, наклон Сена, тест Манна-Кендалла (GeoTIFF)")
+    correlate = add('correlate', with_indices=False, with_png=True)
+    correlate.add_argument('--with', dest='others', nargs='+', type=index_name, default=['SAVI', 'SWIR'])
+    add('climatology')
+    anomaly = add('anomaly')
+    anomaly.add_argument('--dates', nargs='+', type=parse_date, help="даты снимков (по умолчанию - последний)")
+    anomaly.add_argument('--min-years', type=int, default=3, help="минимум лет с данными календарного месяца")
+    forecast = add('forecast', with_png=True)
+    forecast.add_argument('--periods', type=int, default=12, help="горизонт прогноза, месяцев")
+    forecast.add_argument('--maps', action='store_true',
+                          help="карты прогноза и доверительного интервала по пикселям или блокам (GeoTIFF)")
+    forecast.add_argument('--block', type=int, default=1, help="размер блока для --maps, пикселей (1 - попиксельно)")
+    forecast.add_argument('--mode', choices=('fit', 'filter'), default='fit',
+                          help="fit - параметры модели для каждого ряда, filter - общие параметры сцены (быстрее)")
+    classify = add('classify', with_indices=False)
+    classify.add_argument('--batch-size', type=int, default=65536)
+    recommend = add('recommend', with_indices=False)
+    recommend.add_argument('--point', nargs=3, type=float, action='append', metavar=('NDVI', 'SAVI', 'SWIR'))
+    recommend.add_argument('--points', help="CSV со столбцами ndvi, savi, swir")
+    return parser
+
+
+def split_chain(argv):
+    chain = [[]]
+    for arg in argv:
+        if arg == CHAIN_SEPARATOR:
+            chain.append([])
+        else:
+            chain[-1].append(arg)
+    return chain
+
+
+def main(argv=None):
+    chain = split_chain(sys.argv[1:] if argv is None else argv)
+    # Общие параметры задаются перед первой командой
+    first = build_parser().parse_args(chain[0])
+    steps = [first] + [build_parser(with_globals=False).parse_args(part) for part in chain[1:]]
+    if first.profile and not profiling.is_enabled():
+        profiling.enable()
+    if first.regions:
+        return run_regions(first, steps)
+    session = Session(first)
+    for step in steps:
+        started = time.perf_counter()
+        with profiling.stage(step.command, 'command'):
+            outputs = COMMANDS[step.command](session, step)
+        print(f"{step.command}: {len(outputs)} файлов за {time.perf_counter() - started:.1f} с")
+        for path in outputs:
+            print(f"  {path}")
+    if first.profile:
+        print(profiling.format_summary(profiling.summary()))
+        print(f"Трассировка сохранена в {profiling.export_chrome_trace(first.profile)}")
+    return 0
+
+
+def run_regions(first, steps):
+    from region_scheduler import run_regions as schedule
+    if first.window:
+        raise SystemExit("--window нельзя использовать с --regions: окно в пикселях относится к одному растру.")
+    started = time.perf_counter()
+    report = schedule(first, steps, progress=print)
+    print(f"Регионы: {len(report['results'])} из {len(report['jobs'])} заданий за "
+          f"{time.perf_counter() - started:.1f} с")
+    for path in report['outputs']:
+        print(f"  {path}")
+    for name, error in report['errors'].items():
+        print(f"Задание {name} не выполнено: {error}", file=sys.stderr)
+    if first.profile:
+        print(profiling.format_summary(profiling.summary()))
+        print(f"Трассировка сохранена в {profiling.export_chrome_trace(first.profile)}")
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
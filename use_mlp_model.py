@@ -1,16 +1,14 @@
-import joblib
-import pandas as pd
+from mlp_inference import load_mlp_kernel
 
-# Загрузка модели
-mlp_model = joblib.load('mlp_model2.pkl')
+# Загрузка модели (веса mlp_model2.pkl, прямой проход на numpy)
+mlp_model = load_mlp_kernel()
 
 def classify_land_use(ndvi, savi, swir):
     """
     Классифицирует тип земельного участка на основе индексов NDVI, SAVI и SWIR.
     """
-    # Создаем DataFrame с именами признаков
-    data = pd.DataFrame([[ndvi, savi, swir]], columns=['NDVI', 'SAVI', 'SWIR'])
-    prediction = mlp_model.predict(data)
+    # Признаки передаются в порядке обучения модели: NDVI, SAVI, SWIR
+    prediction = mlp_model.predict_one(ndvi, savi, swir)
     
     class_mapping = {
         1: 'Вода',
@@ -20,7 +18,7 @@ def classify_land_use(ndvi, savi, swir):
         5: 'Плотная растительность (леса)'
     }
     
-    return class_mapping[prediction[0]]
+    return class_mapping[prediction]
 
 # Пример использования
 ndvi_value = 0.45